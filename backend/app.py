@@ -1,56 +1,215 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-import pandas as pd
-import joblib
-import fastf1
 import numpy as np
+import json
 import os
+import threading
+import time
+from session_cache import LoadBusy, RecentRaces, SessionCache, import_fastf1
+from simulation import DEFAULT_NOISE, MAX_SIMS, run_monte_carlo
+from race_index import RaceIndex, compound_colors, race_payload, schedule_payload, strategy_payload
+from race_engine import MAX_RACE_SIMS, race_events, race_report, simulate_race, tyre_model_for
+from model_registry import ModelRegistry
+from predict_cache import PredictCache
+import metrics
+from metrics import (MOCK_FALLBACKS, REQUEST_SECONDS, STREAM_EVENTS, STREAM_FIRST_EVENT_SECONDS,
+                     STREAMS_CANCELLED, stage)
 
 app = Flask(__name__)
 CORS(app)
 
-# Load Model
-MODEL_PATH = 'f1_model.pkl'
-FEATURES_PATH = 'model_features.pkl'
-
-model = None
-model_features = None
+# Startup imports stay light (Flask, NumPy): pandas, pyarrow and FastF1 are imported by the first
+# request that needs them, and /predict scores with the model's tree arrays until XGBoost has
+# loaded in the background (see inference.py). `python bench.py coldstart` measures it.
 
-if os.path.exists('cache'):
-    try:
-        fastf1.Cache.enable_cache('cache')
-    except:
-        pass # Cache might be locked or issues
+# Load Model
+# Versioned models from models/ (see model_registry.py); a new CURRENT is picked up without restart
+registry = ModelRegistry()
 
 def load_model():
-    global model, model_features
-    if os.path.exists(MODEL_PATH):
-        model = joblib.load(MODEL_PATH)
-        model_features = joblib.load(FEATURES_PATH)
-        print("Model loaded.")
-    else:
+    if not registry.reload() and registry.current() is None:
         print("Model not found. Please run train.py first.")
 
 load_model()
 
-COMPOUND_MAP = {
-    'SOFT': 1, 'MEDIUM': 2, 'HARD': 3,
-    'INTERMEDIATE': 4, 'WET': 5,
-    'UNKNOWN': 2
-}
+def resolve_model(data):
+    # Optional 'version' in the body or query string pins a model; otherwise CURRENT / A/B routing
+    version = (data or {}).get('version') or request.args.get('version')
+    return registry.get(version, routing_key=request.headers.get('X-Client-Id'))
+
+def load_session(year, round_num, session_type='R'):
+    from compact_laps import load_compact_session
+
+    return load_compact_session(year, round_num, session_type)
+
+# Loaded sessions shared by /race and /race/.../strategy, kept as compact lap tables
+# (compact_laps.py). Loads run on their own small pool so they never tie up every server
+# thread (see serve.py)
+session_cache = SessionCache(
+    loader=load_session,
+    max_entries=int(os.environ.get('F1_SESSION_CACHE_ENTRIES', 8)),
+    max_bytes=int(os.environ.get('F1_SESSION_CACHE_MB', 512)) * 1024 * 1024,
+    load_workers=int(os.environ.get('F1_LOAD_WORKERS', 2)),
+    max_waiting=int(os.environ.get('F1_MAX_WAITING_LOADS', 8))
+)
+
+# Races opened in the UI, newest first; the last few are warmed up after a restart
+recent_races = RecentRaces(os.environ.get(
+    'F1_RECENT_RACES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recent_races.json')))
+
+def warm_up(races):
+    # Background, after start: import the /race stack (pandas, pyarrow) and bring the given races
+    # into memory: race index payloads, else their sessions when the feature store lacks them
+    start = time.perf_counter()
+    from features import has_race_features, read_stints
+    warmed = 0
+    for year, round_num in races:
+        try:
+            indexed = [race_index.get(year, round_num, kind) for kind in ('race', 'strategy')]
+            if None in indexed and not (has_race_features(year, round_num)
+                                        and read_stints(year, round_num) is not None):
+                session_cache.get(year, round_num, 'R')
+            warmed += 1
+        except Exception as e:
+            print(f"Warm-up of {year}/{round_num} failed: {e}")
+    print(f"Warmed up {warmed} recent races in {time.perf_counter() - start:.1f}s.")
+
+def init_worker():
+    # Per-process background work. Called from __main__, serve.py and gunicorn's post_fork.
+    # A forked worker keeps the models the master preloaded (the master never scores, so
+    # XGBoost's OpenMP pool is first started in the worker) and restarts the threads.
+    if registry.loaded_in_pid != os.getpid() and not registry.after_fork():
+        registry.reset()
+        load_model()
+    registry.start_watcher(float(os.environ.get('F1_MODEL_WATCH_SECONDS', 5)))
+    warm_races = int(os.environ.get('F1_WARMUP_RACES', 0))
+    if warm_races:
+        threading.Thread(target=warm_up, args=(recent_races.races()[:warm_races],),
+                         name='warm-up', daemon=True).start()
+
+def preload():
+    # Everything startup defers, done now and waited for. gunicorn's preloaded master calls this
+    # before forking, so workers share it (imports and the CURRENT model) copy-on-write and never
+    # fork in the middle of an import or a Booster load.
+    import compact_laps, features  # pandas, pyarrow
+    import_fastf1()
+    loaded = registry.current()
+    if loaded is not None:
+        loaded.native.booster_ready.wait()
+
+def shutdown():
+    registry.stop_watcher()
+    session_cache.shutdown()
+
+# Recent /predict results and per-row predictions, keyed on the canonical request (see predict_cache.py)
+predict_cache = PredictCache(
+    max_entries=int(os.environ.get('F1_PREDICT_CACHE_ENTRIES', 1024)),
+    max_rows=int(os.environ.get('F1_PREDICT_CACHE_ROWS', 100000)),
+    ttl=float(os.environ.get('F1_PREDICT_CACHE_TTL', 300)),
+    decimals=int(os.environ.get('F1_PREDICT_CACHE_DECIMALS', 3))
+)
+
+# Prebuilt schedules and race payloads (see race_index.py); checked before FastF1
+race_index = RaceIndex()
+
+def index_response(entry):
+    # Stored payload as-is: gzip when prebuilt and accepted, 304 when the client already has the
+    # variant it would get. Each encoding has its own strong ETag.
+    if entry.gzipped is not None and request.accept_encodings['gzip']:
+        body, etag, encoding = entry.gzipped, f"{entry.etag}-gzip", 'gzip'
+    else:
+        body, etag, encoding = entry.body, entry.etag, None
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+def busy_response(e):
+    return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+
+def mock_fallback(endpoint, reason):
+    print(f"{endpoint}: falling back to mock data ({reason})")
+    MOCK_FALLBACKS.inc((endpoint, reason))
+
+# Request timing
+# Every request lands in f1_request_duration_seconds; blocks wrapped in stage() land in
+# f1_stage_duration_seconds. Send "X-Profile: 1" to get this request's breakdown back
+# as Server-Timing and X-Stage-Timings (JSON, ms) headers.
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+    g.stages = {}
+
+@app.after_request
+def record_timing(response):
+    start = g.get('start')
+    if start is None:
+        return response
+    total = time.perf_counter() - start
+    REQUEST_SECONDS.observe((request.endpoint or 'unknown', request.method, str(response.status_code)), total)
+    if request.headers.get('X-Profile') == '1':
+        stages = g.get('stages', {})
+        response.headers['Server-Timing'] = metrics.server_timing(stages, total)
+        response.headers['X-Stage-Timings'] = json.dumps(
+            {**{name: round(s * 1000, 3) for name, s in stages.items()}, 'total': round(total * 1000, 3)})
+    return response
+
+@metrics.register_collector
+def collect_app_metrics():
+    stats = session_cache.stats()
+    for key, help_text in (('hits', 'Session cache hits'),
+                           ('misses', 'Session cache misses'),
+                           ('evictions', 'Sessions evicted from the cache'),
+                           ('coalesced', 'Requests that joined a load already in flight'),
+                           ('rejected', 'Requests turned away with 503 while loads were saturated')):
+        yield (f'f1_session_cache_{key}_total', 'counter', help_text, [({}, stats[key])])
+    yield ('f1_session_cache_entries', 'gauge', 'Sessions held in memory', [({}, stats['entries'])])
+    yield ('f1_session_cache_bytes', 'gauge', 'Estimated bytes held by cached sessions', [({}, stats['bytes'])])
+    yield ('f1_session_cache_race_bytes', 'gauge', 'Estimated bytes per cached session',
+           [({'race': '-'.join(str(k) for k in key)}, size) for key, size in zip(stats['keys'], stats['entry_bytes'])])
+    yield ('f1_session_loads_in_progress', 'gauge', 'FastF1 loads running or queued', [({}, stats['loading'])])
+    current = registry.current()
+    index = race_index.stats()
+    yield ('f1_race_index_hits_total', 'counter', 'Requests served from the race index', [({}, index['hits'])])
+    yield ('f1_race_index_misses_total', 'counter', 'Race index lookups that fell through to FastF1', [({}, index['misses'])])
+    predictions = predict_cache.stats()
+    for key, help_text in (('hits', '/predict requests answered from the result cache'),
+                           ('partial_hits', '/predict requests that reused some cached row predictions'),
+                           ('misses', '/predict requests with no cached rows'),
+                           ('rows_reused', 'Per-driver predictions reused from the cache'),
+                           ('rows_predicted', 'Per-driver predictions computed by the model'),
+                           ('seconds_saved', 'Estimated /predict time saved by the cache')):
+        yield (f'f1_predict_cache_{key}_total', 'counter', help_text, [({}, predictions[key])])
+    yield ('f1_predict_cache_hit_ratio', 'gauge', 'Share of /predict requests answered from the result cache',
+           [({}, predictions['hit_ratio'])])
+    yield ('f1_predict_cache_entries', 'gauge', 'Cached /predict results', [({}, predictions['entries'])])
+    yield ('f1_model_info', 'gauge', 'Active model version',
+           [({'version': current.version}, 1)] if current is not None else [])
 
 @app.route('/races/<int:year>', methods=['GET'])
 def get_races(year):
     try:
-        # Try fetching from FastF1 first
+        with stage('race_index'):
+            entry = race_index.get(year)
+        if entry is not None:
+            return index_response(entry)
+
+        # Then FastF1
         try:
-            schedule = fastf1.get_event_schedule(year)
-            races = schedule[schedule['EventFormat'] == 'conventional'][['RoundNumber', 'EventName', 'Location', 'Country']].to_dict('records')
-        except:
+            races = schedule_payload(import_fastf1().get_event_schedule(year))
+        except Exception as e:
+            print(f"Error fetching schedule for {year}: {e}")
             races = []
             
         # If no races found (e.g., Early 2026 or API issue), use Mock Schedule for 2026+
         if not races and year >= 2026:
+            mock_fallback('get_races', 'no_schedule')
             races = [
                 {'RoundNumber': 1, 'EventName': 'Bahrain Grand Prix', 'Location': 'Sakhir', 'Country': 'Bahrain'},
                 {'RoundNumber': 2, 'EventName': 'Saudi Arabian Grand Prix', 'Location': 'Jeddah', 'Country': 'Saudi Arabia'},
@@ -72,17 +231,28 @@ def get_races(year):
 @app.route('/race/<int:year>/<int:round_num>', methods=['GET'])
 def get_race_data(year, round_num):
     try:
+        with stage('race_index'):
+            entry = race_index.get(year, round_num, 'race')
+        if entry is not None:
+            recent_races.record(year, round_num)
+            return index_response(entry)
+
+        from features import build_race_features
+
         # Check if we can fetch real data
+        # Feature store first, then the (cached) session for races not yet extracted
         use_mock = False
         try:
-            session = fastf1.get_session(year, round_num, 'R')
-            # Check if session has happened by checking a date or if load fails
-            # simplest is to try loading
-            session.load(telemetry=False, weather=False, messages=False)
-            if len(session.laps) == 0:
+            stored = build_race_features(year, round_num, session_cache.get, stage=stage)
+            if stored is None:
                 use_mock = True
-        except:
+                mock_fallback('get_race_data', 'no_laps')
+        except LoadBusy as e:
+            return busy_response(e)
+        except Exception as e:
+            print(f"Error loading race {year}/{round_num}: {e}")
             use_mock = True
+            mock_fallback('get_race_data', type(e).__name__)
 
         if use_mock:
             # Generate Mock Data for Future/Upcoming Races
@@ -121,66 +291,12 @@ def get_race_data(year, round_num):
                 'drivers': drivers_data
             })
 
-        # Real Data Logic (Existing)
-        laps = session.laps
-        results = session.results
-        
-        quick_laps = laps.pick_quicklaps()
-        if len(quick_laps) > 0:
-            field_avg = quick_laps.groupby('Team')['LapTime'].mean().dt.total_seconds().mean()
-        else:
-            field_avg = 90.0 # fallback
-
-        drivers_data = []
-        for drv in session.drivers:
-            try:
-                d_res = results.loc[drv]
-                d_laps = laps.pick_driver(drv)
-                
-                if len(d_laps) == 0: continue
-                
-                stints = d_laps['Stint'].unique()
-                stops = len(stints) - 1 if len(stints) > 0 else 0
-                start_compound = d_laps.iloc[0]['Compound']
-                
-                d_quick = d_laps.pick_quicklaps()
-                if len(d_quick) > 0:
-                    d_pace = d_quick['LapTime'].mean().total_seconds()
-                    pace_delta = d_pace - field_avg
-                    consistency = d_quick['LapTime'].std().total_seconds()
-                else:
-                    pace_delta = 0
-                    consistency = 0
-                    
-                drivers_data.append({
-                    'code': d_res['Abbreviation'],
-                    'name': d_res['BroadcastName'] or d_res['FullName'],
-                    'team': d_res['TeamName'],
-                    'grid': int(d_res['GridPosition']),
-                    'start_compound': str(start_compound),
-                    'stops': int(stops),
-                    'pace_delta': float(pace_delta) if not pd.isna(pace_delta) else 0.0,
-                    'consistency': float(consistency) if not pd.isna(consistency) else 0.0
-                })
-            except:
-                continue
-        
-        wet_counts = laps['Compound'].value_counts()
-        wet_laps = wet_counts.get('INTERMEDIATE', 0) + wet_counts.get('WET', 0)
-        is_wet = bool((wet_laps / len(laps) > 0.1) if len(laps) > 0 else False)
-        
-        return jsonify({
-            'year': year,
-            'round': round_num,
-            'event': session.event['EventName'],
-            'circuit_info': {
-                'location': session.event['Location'],
-                'country': session.event['Country'],
-                'name': session.event['EventName']
-            },
-            'is_wet': is_wet,
-            'drivers': drivers_data
-        })
+        # Real Data Logic
+        recent_races.record(year, round_num)
+        with stage('payload_build'):
+            payload = race_payload(year, round_num, *stored)
+        with stage('serialize'):
+            return jsonify(payload)
         
     except Exception as e:
         print(f"Error in get_race_data: {e}")
@@ -189,103 +305,109 @@ def get_race_data(year, round_num):
 @app.route('/race/<int:year>/<int:round_num>/strategy', methods=['GET'])
 def get_strategy_data(year, round_num):
     try:
-        # Try real data
+        with stage('race_index'):
+            entry = race_index.get(year, round_num, 'strategy')
+        if entry is not None:
+            return index_response(entry)
+
+        from features import read_stints, stint_table, write_stints
+
+        # Try real data: stored stint table, else one grouped pass over the session's laps
         try:
-            session = fastf1.get_session(year, round_num, 'R')
-            session.load(telemetry=False, weather=False, messages=False)
+            with stage('stint_store_read'):
+                stints = read_stints(year, round_num)
+            # Stored tables carry their colours (Color column); older ones get the defaults
+            colors = None
+            if stints is None:
+                with stage('session_load'):
+                    session = session_cache.get(year, round_num, 'R')
+                if len(session.laps) == 0:
+                    raise ValueError("Session has no laps")
+                with stage('stint_extraction'):
+                    stints = stint_table(session.laps, session.drivers)
+                colors = compound_colors(session)
+                with stage('stint_store_write'):
+                    write_stints(year, round_num, stints, colors=colors)
             
-            strategy_data = []
-            for drv in session.drivers:
-                d_laps = session.laps.pick_driver(drv)
-                if len(d_laps) == 0: continue
-                
-                stints = []
-                for stint_num in d_laps['Stint'].unique():
-                    s_laps = d_laps[d_laps['Stint'] == stint_num]
-                    stints.append({
-                        'compound': s_laps.iloc[0]['Compound'],
-                        'start_lap': int(s_laps.iloc[0]['LapNumber']),
-                        'end_lap': int(s_laps.iloc[-1]['LapNumber']),
-                        'color': fastf1.plotting.COMPOUND_COLORS.get(s_laps.iloc[0]['Compound'], '#ffffff')
-                    })
-                
-                strategy_data.append({
-                    'driver': drv,
-                    'stints': stints
-                })
-            return jsonify(strategy_data)
-        except:
+            with stage('payload_build'):
+                strategy_data = strategy_payload(stints, colors)
+            with stage('serialize'):
+                return jsonify(strategy_data)
+        except LoadBusy as e:
+            return busy_response(e)
+        except Exception as e:
+            print(f"Error loading strategy {year}/{round_num}: {e}")
+            mock_fallback('get_strategy_data', type(e).__name__)
             # Mock Strategy Data for Future/Simulated
             return jsonify([]) # Return empty for now or generate mock if critical
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Prometheus text exposition format
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
-@app.route('/predict', methods=['POST'])
-def predict():
-    if not model:
-        return jsonify({'error': 'Model not loaded'}), 503
-        
-    data = request.json
-    # data: { drivers: [...], weather: { is_wet: bool } }
-    
-    drivers_input = data.get('drivers', [])
-    is_wet = 1 if data.get('weather', {}).get('is_wet', False) else 0
-    
-    rows = []
-    
-    for d in drivers_input:
-        # Prepare row for DataFrame
-        # Features: ['GridPosition', 'StartCompound', 'Stops', 'PaceDelta', 'Consistency', 'IsWet']
-        compound_val = COMPOUND_MAP.get(d['start_compound'].upper(), 2)
-        
-        rows.append({
-            'GridPosition': d['grid'],
-            'StartCompound': compound_val,
-            'Stops': int(d['stops']),
-            'PaceDelta': d['pace_delta'],
-            'Consistency': d['consistency'],
-            'IsWet': is_wet,
-            'DriverCode': d['code'] # tracking
-        })
-        
-    df = pd.DataFrame(rows)
-    
-    # Predict
-    # Model predicts PositionDelta (Finish - Start)
-    # Finish = Grid + PredDelta
-    
-    X = df[model_features]
-    preds = model.predict(X)
-    
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(session_cache.stats())
+
+@app.route('/predict/cache/stats', methods=['GET'])
+def get_predict_cache_stats():
+    return jsonify(predict_cache.stats())
+
+@app.route('/models', methods=['GET'])
+def get_models():
+    return jsonify(registry.info())
+
+@app.route('/models/reload', methods=['POST'])
+def reload_models():
+    # Body { version } activates that version; empty body re-reads CURRENT
+    version = (request.get_json(silent=True) or {}).get('version')
+    try:
+        changed = registry.activate(version) if version else registry.reload()
+    except KeyError as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify({'changed': changed, **registry.info()})
+
+# F1 Points System (top 10)
+POINTS_SYSTEM = {1: 25, 2: 18, 3: 15, 4: 12, 5: 10, 6: 8, 7: 6, 8: 4, 9: 2, 10: 1}
+
+def build_prediction(drivers_input, preds, is_wet, include_story=True):
+    # Ranked classification plus story/radio for one grid, from per-driver predicted deltas
     results = []
-    for i, pred_delta in enumerate(preds):
-        row = rows[i]
-        predicted_pos = row['GridPosition'] + pred_delta
+    for d, pred_delta in zip(drivers_input, preds):
+        predicted_pos = d['grid'] + pred_delta
         results.append({
-            'code': row['DriverCode'],
+            'code': d['code'],
             'predicted_position_raw': float(predicted_pos),
-            'start_pos': row['GridPosition'],
+            'start_pos': d['grid'],
             'delta': float(pred_delta)
         })
         
     # Sort and Assign integer rank
     results.sort(key=lambda x: x['predicted_position_raw'])
     
-    # F1 Points System (top 10)
-    points_system = {1: 25, 2: 18, 3: 15, 4: 12, 5: 10, 6: 8, 7: 6, 8: 4, 9: 2, 10: 1}
-    
     final_order = []
-    story_events = []
-    radio_messages = []
-
     for rank, res in enumerate(results, 1):
         res['predicted_rank'] = rank
         res['gain_loss'] = res['start_pos'] - rank 
-        res['points'] = points_system.get(rank, 0)
+        res['points'] = POINTS_SYSTEM.get(rank, 0)
         final_order.append(res)
-        
+
+    if not include_story:
+        return {'classification': final_order}
+    return {'classification': final_order, **prediction_story(final_order, is_wet)}
+
+def prediction_story(final_order, is_wet):
+    # Story snippets and team radio for a ranked classification
+    story_events = []
+    radio_messages = []
+
+    for res in final_order:
+        rank = res['predicted_rank']
+
         # Generate Story Snippets & Radio
         # WINNER
         if rank == 1:
@@ -322,18 +444,325 @@ def predict():
                 'message': "I have no grip! Tires are gone.",
                 'lap': '45'
             })
-            
+
     # Add weather context
     if is_wet:
         story_events.insert(0, "Race Control: Wet conditions declared. Intermediates are the tyre of choice.")
     else:
         story_events.insert(0, "Race Control: Dry conditions. Track temperature is optimal.")
 
-    return jsonify({
-        'classification': final_order,
+    return {
         'story': story_events,
         'radio': radio_messages
+    }
+
+_POINTS_BY_RANK = np.array([POINTS_SYSTEM.get(rank, 0) for rank in range(12)])  # index 11: outside the points
+
+def rank_batch(grids, preds, offsets):
+    # build_prediction's classification for every scenario at once, as rank-ordered columns over
+    # the stacked rows: one stable sort on (scenario, predicted position) instead of one per grid
+    sizes = np.diff(offsets)
+    scenario = np.repeat(np.arange(len(sizes)), sizes)
+    drivers = [d for drivers_input, _ in grids for d in drivers_input]
+    start_pos = [d['grid'] for d in drivers]
+    raw = np.asarray(start_pos, dtype=np.float32) + preds  # float32, as grid + pred_delta is per grid
+    order = np.lexsort((raw, scenario))
+    rank = np.arange(1, len(order) + 1) - offsets[scenario]
+    order_list, rank_list = order.tolist(), rank.tolist()
+    start_sorted = [start_pos[i] for i in order_list]
+    return {
+        'code': [drivers[i]['code'] for i in order_list],
+        'predicted_position_raw': raw[order].astype(float).tolist(),
+        'start_pos': start_sorted,
+        'delta': preds[order].astype(float).tolist(),
+        'predicted_rank': rank_list,
+        'gain_loss': [s - r for s, r in zip(start_sorted, rank_list)],
+        'points': _POINTS_BY_RANK[np.minimum(rank, 11)].tolist(),
+    }
+
+@app.route('/predict', methods=['POST'])
+def predict():
+    data = request.json
+    try:
+        loaded = resolve_model(data)
+    except KeyError as e:
+        return jsonify({'error': str(e)}), 404
+    if loaded is None:
+        return jsonify({'error': 'Model not loaded'}), 503
+        
+    # data: { drivers: [...], weather: { is_wet: bool } }
+    
+    drivers_input = data.get('drivers', [])
+    is_wet = 1 if data.get('weather', {}).get('is_wet', False) else 0
+    
+    # Predict
+    # Model predicts PositionDelta (Finish - Start)
+    # Finish = Grid + PredDelta
+    # Features go straight into a float32 matrix for the booster (see inference.py), rounded to
+    # the form predict_cache keys on
+    start = time.perf_counter()
+    with stage('feature_matrix'):
+        X = predict_cache.canonical(loaded.native.matrix(drivers_input, is_wet), loaded.native.features)
+    with stage('cache_lookup'):
+        key = predict_cache.key(loaded.version, X, drivers_input, is_wet)
+        result = predict_cache.get(key, lookup_start=start)
+    cache_status = 'HIT'
+    if result is None:
+        with stage('model_predict'):
+            preds, reused = predict_cache.predict_rows(loaded.version, X, loaded.native.predict_matrix)
+        cache_status = 'PARTIAL' if reused else 'MISS'
+
+        with stage('ranking'):
+            result = build_prediction(drivers_input, preds, is_wet)
+        result['model_version'] = loaded.version
+        predict_cache.put(key, result, time.perf_counter() - start)
+    with stage('serialize'):
+        response = jsonify(result)
+    response.headers['X-Cache'] = cache_status
+    return response
+
+MAX_BATCH_SCENARIOS = 2000
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    data = request.json
+    try:
+        loaded = resolve_model(data)
+    except KeyError as e:
+        return jsonify({'error': str(e)}), 404
+    if loaded is None:
+        return jsonify({'error': 'Model not loaded'}), 503
+
+    # data: { scenarios: [{ id?, drivers: [...], weather: { is_wet: bool } }, ...], version?,
+    #         include_story? (default false: classification only),
+    #         format? ('rows': /predict's list of drivers, default; 'columns': one list per field,
+    #                  in finishing order, several times cheaper to encode and parse) }
+    scenarios = data.get('scenarios', [])
+    include_story = bool(data.get('include_story', False))
+    columnar = data.get('format', 'rows') == 'columns'
+    if not isinstance(scenarios, list) or not scenarios:
+        return jsonify({'error': 'scenarios must be a non-empty list'}), 400
+    if len(scenarios) > MAX_BATCH_SCENARIOS:
+        return jsonify({'error': f'At most {MAX_BATCH_SCENARIOS} scenarios per batch'}), 400
+
+    grids = [
+        (s.get('drivers', []), 1 if s.get('weather', {}).get('is_wet', False) else 0)
+        for s in scenarios
+    ]
+    # One model call over all rows of all scenarios and one sort ranking them all. Features are
+    # rounded as on /predict, so both endpoints agree.
+    preds, offsets = loaded.native.predict_batch(
+        grids, stage=stage, prepare=lambda X: predict_cache.canonical(X, loaded.native.features))
+    with stage('ranking'):
+        columns = rank_batch(grids, preds, offsets)
+    bounds = offsets.tolist()
+
+    def scenario_result(i):
+        lo, hi = bounds[i], bounds[i + 1]
+        if columnar:
+            classification = {name: values[lo:hi] for name, values in columns.items()}
+        else:
+            names = list(columns)
+            classification = [dict(zip(names, row)) for row in zip(*(values[lo:hi] for values in columns.values()))]
+        result = {'scenario': scenarios[i].get('id', i), 'classification': classification}
+        if include_story:
+            rows = classification if not columnar else [
+                dict(zip(classification, row)) for row in zip(*classification.values())]
+            result.update(prediction_story(rows, grids[i][1]))
+        return result
+
+    # NDJSON: one line per scenario, so clients can start on the first result early
+    wants_stream = (request.args.get('stream') in ('1', 'true')
+                    or 'application/x-ndjson' in request.headers.get('Accept', ''))
+    if wants_stream:
+        def generate():
+            for i in range(len(scenarios)):
+                yield json.dumps(scenario_result(i), separators=(',', ':')) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson',
+                        headers={'X-Model-Version': loaded.version})
+
+    # Compact separators: the payload is large and key sorting buys nothing here
+    with stage('results'):
+        results = [scenario_result(i) for i in range(len(scenarios))]
+    with stage('serialize'):
+        body = json.dumps({'model_version': loaded.version, 'results': results}, separators=(',', ':'))
+    return Response(body, mimetype='application/json')
+
+@app.route('/simulate', methods=['POST'])
+def simulate():
+    data = request.json
+    try:
+        loaded = resolve_model(data)
+    except KeyError as e:
+        return jsonify({'error': str(e)}), 404
+    if loaded is None:
+        return jsonify({'error': 'Model not loaded'}), 503
+
+    # data: { drivers: [...], weather: { is_wet: bool }, n_sims: int, seed: int, noise: {...} }
+    drivers_input = data.get('drivers', [])
+    if not drivers_input:
+        return jsonify({'error': 'No drivers given'}), 400
+    is_wet = 1 if data.get('weather', {}).get('is_wet', False) else 0
+
+    try:
+        n_sims = int(data.get('n_sims', 10000))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'n_sims must be an integer'}), 400
+    if not 1 <= n_sims <= MAX_SIMS:
+        return jsonify({'error': f'n_sims must be between 1 and {MAX_SIMS}'}), 400
+
+    noise = data.get('noise') or {}
+    if not isinstance(noise, dict) or not set(noise) <= set(DEFAULT_NOISE):
+        return jsonify({'error': f'noise must be an object with keys from {sorted(DEFAULT_NOISE)}'}), 400
+    try:
+        noise = {key: float(value) for key, value in noise.items()}
+    except (TypeError, ValueError):
+        return jsonify({'error': 'noise values must be numbers'}), 400
+    for key, value in noise.items():
+        # *_sd are spreads, *_p probabilities
+        if not np.isfinite(value) or value < 0 or (key.endswith('_p') and value > 1):
+            return jsonify({'error': f'noise.{key} out of range'}), 400
+
+    seed = data.get('seed')
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int) or seed < 0):
+        return jsonify({'error': 'seed must be a non-negative integer'}), 400
+
+    with stage('monte_carlo'):
+        result = run_monte_carlo(
+            loaded.native, drivers_input, is_wet,
+            n_sims=n_sims, noise=noise, seed=seed
+        )
+    result['model_version'] = loaded.version
+    with stage('serialize'):
+        return jsonify(result)
+
+def race_request(data):
+    # Shared by /simulate/race and /simulate/race/stream: (simulation kwargs, None) or (None, error response)
+    drivers_input = data.get('drivers', [])
+    if not drivers_input:
+        return None, (jsonify({'error': 'No drivers given'}), 400)
+    try:
+        n_sims = int(data.get('n_sims', 500))
+        laps = int(data['laps']) if data.get('laps') else None
+    except (TypeError, ValueError):
+        return None, (jsonify({'error': 'n_sims and laps must be integers'}), 400)
+    if not 1 <= n_sims <= MAX_RACE_SIMS:
+        return None, (jsonify({'error': f'n_sims must be between 1 and {MAX_RACE_SIMS}'}), 400)
+    if laps is not None and not 10 <= laps <= 100:
+        return None, (jsonify({'error': 'laps must be between 10 and 100'}), 400)
+    # Optional race whose tyre model to use: both or neither
+    year, round_num = data.get('year'), data.get('round')
+    if year is not None or round_num is not None:
+        try:
+            year, round_num = int(year), int(round_num)
+        except (TypeError, ValueError):
+            return None, (jsonify({'error': 'year and round must be integers'}), 400)
+        if not (1950 <= year <= 2100 and 1 <= round_num <= 30):
+            return None, (jsonify({'error': 'year or round out of range'}), 400)
+    seed = data.get('seed')
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int) or seed < 0):
+        return None, (jsonify({'error': 'seed must be a non-negative integer'}), 400)
+    return {
+        'drivers_input': drivers_input,
+        'is_wet': bool(data.get('weather', {}).get('is_wet', False)),
+        'n_sims': n_sims,
+        'laps': laps,
+        'seed': seed,
+        'year': year,
+        'round_num': round_num,
+    }, None
+
+@app.route('/simulate/race', methods=['POST'])
+def simulate_race_laps():
+    # Lap-by-lap race engine (see race_engine.py); same response shape as /predict plus a lap chart
+    # data: { drivers: [...], weather: { is_wet: bool }, year?, round? (tyre model of that race),
+    #         laps?, n_sims?, seed?, include_story? }
+    data = request.json or {}
+    race, error = race_request(data)
+    if error:
+        return error
+    drivers_input = race['drivers_input']
+
+    with stage('tyre_model'):
+        tyre_model = tyre_model_for(race['year'], race['round_num'])
+    with stage('race_sim'):
+        sim = simulate_race(drivers_input, race['is_wet'], tyre_model, n_sims=race['n_sims'],
+                            laps=race['laps'], seed=race['seed'])
+    with stage('race_report'):
+        result = race_report(drivers_input, sim, include_story=bool(data.get('include_story', True)))
+    result.update({
+        'n_sims': sim['n_sims'],
+        'laps': sim['laps'],
+        'tyre_model': tyre_model,
+        'timing_ms': sim['timing_ms'],
     })
+    with stage('serialize'):
+        return jsonify(result)
+
+@app.route('/simulate/race/stream', methods=['POST'])
+def stream_race():
+    # /simulate/race as it happens. Same body, plus standings_every? (laps between standings events).
+    # Server-Sent Events by default; NDJSON ({"event", "data"} per line) with ?format=ndjson or
+    # Accept: application/x-ndjson. Events: start, lap, radio, standings, result (the /simulate/race
+    # body), or error. The race only advances when the server pulls the next chunk, so a slow
+    # reader holds the simulation back instead of it buffering ahead, and a client that disconnects
+    # closes the generator, which stops the work.
+    data = request.json or {}
+    race, error = race_request(data)
+    if error:
+        return error
+    try:
+        standings_every = max(1, int(data.get('standings_every', 1)))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'standings_every must be an integer'}), 400
+    ndjson = (request.args.get('format') == 'ndjson'
+              or 'application/x-ndjson' in request.headers.get('Accept', ''))
+
+    with stage('tyre_model'):
+        tyre_model = tyre_model_for(race['year'], race['round_num'])
+    # The generator runs after this view returns, outside the request context
+    endpoint, started = request.endpoint, g.start
+    events = race_events(race['drivers_input'], race['is_wet'], tyre_model, n_sims=race['n_sims'],
+                         laps=race['laps'], seed=race['seed'], standings_every=standings_every,
+                         include_story=bool(data.get('include_story', True)))
+
+    def encode(event, payload):
+        body = json.dumps(payload, separators=(',', ':'))
+        if ndjson:
+            return f'{{"event":"{event}","data":{body}}}\n'
+        return f"event: {event}\ndata: {body}\n\n"
+
+    def generate():
+        first_event = None
+        finished = False
+        try:
+            for event, payload in events:
+                if event == 'result':
+                    payload['tyre_model'] = tyre_model
+                    payload['timing_ms']['first_event'] = first_event * 1000
+                chunk = encode(event, payload)
+                if first_event is None:
+                    first_event = time.perf_counter() - started
+                    STREAM_FIRST_EVENT_SECONDS.observe((endpoint,), first_event)
+                STREAM_EVENTS.inc((endpoint, event))
+                yield chunk
+            finished = True
+        except Exception as e:
+            # Headers are already sent; report the failure in-band
+            print(f"Race stream failed: {e}")
+            finished = True
+            yield encode('error', {'error': str(e)})
+        finally:
+            events.close()
+            if not finished:
+                STREAMS_CANCELLED.inc((endpoint,))
+
+    response = Response(generate(), mimetype='application/x-ndjson' if ndjson else 'text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Stop nginx-style proxies from buffering the stream
+    return response
 
 if __name__ == '__main__':
+    # Development server; see serve.py for the production entry point
+    init_worker()
     app.run(debug=True, port=5000)
@@ -0,0 +1,63 @@
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+# Write-then-rename for everything the backend saves (feature store, stints, compact laps, model
+# versions and tree arrays, race index payloads, CURRENT, recent_races.json): the new file or
+# directory is written to a hidden scratch path next to its target and renamed over it once
+# complete, so a reader in any thread or process sees the old one or the new one, never half.
+
+
+def scratch_path(path):
+    # Hidden, and unique per process and thread, so two writers of one target never share it
+    head, tail = os.path.split(path)
+    return os.path.join(head, f".{tail}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def replacing(path, overwrite=True):
+    # Yields the scratch path to write: a file, or a directory the block creates. When the block
+    # finishes it is renamed over `path`; the scratch is removed if it fails.
+    # A directory already at `path` is moved aside first (readers that mapped its files keep
+    # them), or with overwrite=False the rename fails with OSError. If another writer renames
+    # the same directory in between, theirs is kept.
+    tmp_path = scratch_path(path)
+    old_path = tmp_path[:-len('.tmp')] + '.old'
+    try:
+        yield tmp_path
+        if not os.path.isdir(tmp_path):
+            os.replace(tmp_path, path)
+            return
+        try:
+            if overwrite and os.path.isdir(path):
+                os.replace(path, old_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            if not overwrite or not os.path.isdir(path):
+                raise
+    finally:
+        _remove(tmp_path)
+        _remove(old_path)
+
+
+def write_bytes(path, data):
+    with replacing(path) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+
+
+def write_text(path, text):
+    with replacing(path) as tmp_path:
+        with open(tmp_path, 'w') as f:
+            f.write(text)
@@ -0,0 +1,1028 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from fastf1.core import Laps, SessionResults
+
+from features import COMPOUND_MAP, FEATURE_COLUMNS, extract_race_features, is_wet_race, stint_table
+from inference import NativePredictor
+
+# Offline micro-benchmarks on synthetic FastF1-shaped sessions.
+# Usage: python bench.py features --repeat 20
+#        python bench.py laps
+#        python bench.py coldstart
+#        python bench.py predict --requests 2000
+#        python bench.py batch --scenarios 500
+#        python bench.py loadtest --race-loads 12
+#        python bench.py suite --output bench_results.json --compare baseline.json
+
+
+COMPOUNDS = np.array(['SOFT', 'MEDIUM', 'HARD'])
+
+
+class SyntheticSession:
+    # Just enough of fastf1.core.Session for the feature code: laps, results, drivers, event
+    def __init__(self, n_drivers=20, n_laps=57, seed=0):
+        rng = np.random.default_rng(seed)
+        numbers = np.array([str(i + 1) for i in range(n_drivers)])
+        codes = np.array([f"D{i:02d}" for i in range(n_drivers)])
+        teams = np.array([f"Team {i // 2}" for i in range(n_drivers)])
+
+        car = np.repeat(np.arange(n_drivers), n_laps)
+        lap = np.tile(np.arange(1, n_laps + 1), n_drivers)
+
+        # One or two stops per car, stint index steps up after each pit lap
+        pit_a = rng.integers(12, n_laps // 2, n_drivers)
+        pit_b = np.where(rng.random(n_drivers) < 0.5, rng.integers(n_laps // 2, n_laps - 5, n_drivers), n_laps + 1)
+        stint = 1 + (lap > pit_a[car]) + (lap > pit_b[car])
+        compound = COMPOUNDS[(rng.integers(0, 3, (n_drivers, 3))[car, stint - 1])]
+        stint_start = np.where(stint == 1, 1, np.where(stint == 2, pit_a[car] + 1, pit_b[car] + 1))
+        tyre_life = lap - stint_start + 1
+
+        lap_time = 90.0 + car * 0.05 + tyre_life * 0.04 + rng.normal(0, 0.4, car.size)
+        lap_time[lap == 1] += 8.0  # Standing start
+        lap_time[(lap == pit_a[car]) | (lap == pit_b[car])] += 20.0  # In-laps
+
+        self.laps = Laps(pd.DataFrame({
+            'Driver': codes[car],
+            'DriverNumber': numbers[car],
+            'Team': teams[car],
+            'LapTime': pd.to_timedelta(lap_time, unit='s'),
+            'LapNumber': lap.astype(float),
+            'Stint': stint.astype(float),
+            'Compound': compound,
+            'TyreLife': tyre_life.astype(float),
+        }))
+        self.results = SessionResults(pd.DataFrame({
+            'DriverNumber': numbers,
+            'Abbreviation': codes,
+            'BroadcastName': [c.title() for c in codes],
+            'FullName': codes,
+            'TeamName': teams,
+            'GridPosition': (rng.permutation(n_drivers) + 1).astype(float),
+            'Position': (rng.permutation(n_drivers) + 1).astype(float),
+        }, index=numbers))
+        self.drivers = list(numbers)
+        self.event = {'EventName': 'Synthetic Grand Prix', 'Location': 'Nowhere', 'Country': 'Nowhere'}
+
+
+def legacy_race_features(session):
+    # Per-driver loop the API and train.py used before features were vectorized.
+    # Kept here as the parity reference.
+    laps = session.laps
+    results = session.results
+    quick_laps = laps.pick_quicklaps()
+    if len(quick_laps) > 0:
+        field_avg = quick_laps.groupby('Team')['LapTime'].mean().dt.total_seconds().mean()
+    else:
+        field_avg = 90.0
+
+    rows = []
+    for drv in session.drivers:
+        d_res = results.loc[drv]
+        d_laps = laps[laps['DriverNumber'] == drv]  # laps.pick_driver(drv)
+        if len(d_laps) == 0: continue
+        stints = d_laps['Stint'].unique()
+        d_quick = d_laps.pick_quicklaps()
+        if len(d_quick) > 0:
+            pace_delta = d_quick['LapTime'].mean().total_seconds() - field_avg
+            consistency = d_quick['LapTime'].std().total_seconds()
+        else:
+            pace_delta = 0
+            consistency = 0
+        rows.append({
+            'DriverNumber': drv,
+            'Driver': d_res['Abbreviation'],
+            'Name': d_res['BroadcastName'] or d_res['FullName'],
+            'Team': d_res['TeamName'],
+            'GridPosition': d_res['GridPosition'],
+            'FinishPosition': d_res['Position'],
+            'StartCompound': str(d_laps.iloc[0]['Compound']),
+            'Stops': len(stints) - 1 if len(stints) > 0 else 0,
+            'PaceDelta': float(pace_delta) if not pd.isna(pace_delta) else 0.0,
+            'Consistency': float(consistency) if not pd.isna(consistency) else 0.0,
+            'IsWet': int(is_wet_race(laps))
+        })
+    return pd.DataFrame(rows, columns=FEATURE_COLUMNS)
+
+
+def check_feature_parity(session):
+    expected = legacy_race_features(session)
+    actual, _ = extract_race_features(session)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, atol=1e-6)
+
+
+def legacy_stints(session):
+    # Per-driver, per-stint loop /strategy used before stint_table (colours left out)
+    laps = session.laps
+    strategy_data = []
+    for drv in session.drivers:
+        d_laps = laps[laps['DriverNumber'] == drv]
+        if len(d_laps) == 0: continue
+        stints = []
+        for stint_num in d_laps['Stint'].unique():
+            s_laps = d_laps[d_laps['Stint'] == stint_num]
+            stints.append({
+                'compound': s_laps.iloc[0]['Compound'],
+                'start_lap': int(s_laps.iloc[0]['LapNumber']),
+                'end_lap': int(s_laps.iloc[-1]['LapNumber']),
+            })
+        strategy_data.append({'driver': drv, 'stints': stints})
+    return strategy_data
+
+
+def check_stint_parity(session):
+    table = stint_table(session.laps, session.drivers)
+    actual = [
+        {'driver': drv, 'stints': [
+            {'compound': s.Compound, 'start_lap': int(s.StartLap), 'end_lap': int(s.EndLap)}
+            for s in d.itertuples(index=False)]}
+        for drv, d in table.groupby('DriverNumber', sort=False)
+    ]
+    assert actual == legacy_stints(session), "stint_table differs from the per-driver loop"
+    return table
+
+
+def timeit(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.array(times)
+
+
+def bench_features(args):
+    session = SyntheticSession(n_drivers=args.drivers, n_laps=args.laps)
+    check_feature_parity(session)
+    print(f"Parity OK ({args.drivers} drivers x {args.laps} laps)")
+
+    legacy = timeit(lambda: legacy_race_features(session), args.repeat)
+    vectorized = timeit(lambda: extract_race_features(session), args.repeat)
+    for name, times in (('per-driver loop', legacy), ('vectorized', vectorized)):
+        print(f"  {name:16s} median {np.median(times) * 1000:8.2f} ms  "
+              f"({1 / np.median(times):7.1f} races/s)")
+    print(f"  speedup x{np.median(legacy) / np.median(vectorized):.1f}")
+
+
+MODEL_FEATURES = ['GridPosition', 'StartCompound', 'Stops', 'PaceDelta', 'Consistency', 'IsWet']
+
+
+def bench_stints(args):
+    session = SyntheticSession(n_drivers=args.drivers, n_laps=args.laps)
+    table = check_stint_parity(session)
+    print(f"Parity OK ({args.drivers} drivers x {args.laps} laps, {len(table)} stints)")
+    fresh = table[table['Stint'] >= 2]['DegradationSlope']
+    print(f"  degradation slope median {fresh.median():.4f} s/lap (SyntheticSession uses 0.04)")
+
+    legacy = timeit(lambda: legacy_stints(session), args.repeat)
+    grouped = timeit(lambda: stint_table(session.laps, session.drivers), args.repeat)
+    for name, times in (('per-stint loop', legacy), ('stint_table', grouped)):
+        print(f"  {name:16s} median {np.median(times) * 1000:8.2f} ms")
+    print(f"  speedup x{np.median(legacy) / np.median(grouped):.1f}")
+
+
+def full_width_session(session, seed=0):
+    # SyntheticSession widened to every column a loaded FastF1 session carries (Laps._COLUMNS and
+    # SessionResults._COLUMNS), for memory comparisons against what the API actually caches
+    rng = np.random.default_rng(seed)
+    laps = pd.DataFrame(session.laps)
+    n = len(laps)
+    secs = laps['LapTime'].dt.total_seconds().to_numpy()
+    for column, dtype in Laps._COLUMNS.items():
+        if column in laps:
+            continue
+        if dtype == 'timedelta64[ns]':
+            laps[column] = pd.to_timedelta(np.cumsum(secs) * rng.uniform(0.3, 1.0), unit='s')
+        elif dtype == 'datetime64[ns]':
+            laps[column] = pd.Timestamp('2023-03-05 15:00') + pd.to_timedelta(np.cumsum(secs), unit='s')
+        elif dtype == 'float64':
+            laps[column] = rng.uniform(200, 330, n).round(1)
+        elif dtype is str:
+            laps[column] = np.array(['1', '12', '4', ''])[rng.integers(0, 4, n)].astype(object)
+        else:
+            laps[column] = rng.random(n) < 0.5
+    results = pd.DataFrame(session.results)
+    for column, dtype in SessionResults._COLUMNS.items():
+        if column not in results:
+            results[column] = (f"{column} value " + results['Abbreviation']) if dtype is str else np.nan
+
+    wide = SyntheticSession.__new__(SyntheticSession)
+    wide.laps = Laps(laps)
+    wide.results = SessionResults(results)
+    wide.drivers = session.drivers
+    wide.event = session.event
+    return wide
+
+
+def check_compact_parity(session, compact):
+    from features import fit_tyre_model
+
+    expected, _ = extract_race_features(session)
+    actual, _ = extract_race_features(compact)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, atol=1e-4)
+    expected = stint_table(session.laps, session.drivers)
+    actual = stint_table(compact.laps, compact.drivers)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, atol=1e-4)
+    expected, actual = fit_tyre_model(session.laps), fit_tyre_model(compact.laps)
+    for compound, fit in expected['compounds'].items():
+        for name, value in fit.items():
+            assert abs(actual['compounds'][compound][name] - value) < 1e-3, (compound, name)
+    assert abs(actual['pit_loss'] - expected['pit_loss']) < 1e-3
+
+
+def bench_laps(args):
+    from compact_laps import CompactSession
+    from session_cache import estimate_session_bytes
+
+    session = full_width_session(SyntheticSession(n_drivers=args.drivers, n_laps=args.laps))
+    compact = CompactSession.from_session(session)
+    check_compact_parity(session, compact)
+    with tempfile.TemporaryDirectory() as workdir:
+        compact.save(workdir)
+        mapped = CompactSession.load(workdir)
+        check_compact_parity(session, mapped)
+        print(f"Parity OK ({args.drivers} drivers x {args.laps} laps: features, stints, tyre model; "
+              f"in memory and memory-mapped)")
+
+        full_bytes, compact_bytes = estimate_session_bytes(session), estimate_session_bytes(compact)
+        print(f"  FastF1 session  {full_bytes / 1024:8.1f} KB  ({len(Laps._COLUMNS)} lap columns)")
+        print(f"  compact session {compact_bytes / 1024:8.1f} KB  (x{full_bytes / compact_bytes:.1f} smaller)")
+        if full_bytes < 5 * compact_bytes:
+            raise SystemExit("Compact session is less than 5x smaller")
+
+        load = timeit(lambda: CompactSession.load(workdir), args.repeat)
+        print(f"  load from disk  median {np.median(load) * 1000:8.2f} ms (memory-mapped)")
+    for name, s in (('FastF1 session', session), ('compact session', compact)):
+        times = timeit(lambda: (extract_race_features(s), stint_table(s.laps, s.drivers)), args.repeat)
+        print(f"  {name:16s} features + stints median {np.median(times) * 1000:8.2f} ms")
+
+
+def fixture_model(n_samples=2000, seed=0, **params):
+    # Small model with the production feature set, trained on random but plausible rows
+    import xgboost as xgb
+
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame({
+        'GridPosition': rng.integers(1, 21, n_samples),
+        'StartCompound': rng.integers(1, 6, n_samples),
+        'Stops': rng.integers(0, 4, n_samples),
+        'PaceDelta': rng.normal(0, 0.8, n_samples),
+        'Consistency': rng.uniform(0.1, 1.5, n_samples),
+        'IsWet': rng.integers(0, 2, n_samples),
+    })
+    y = (X['PaceDelta'] * 6 - (X['GridPosition'] - 10.5) * 0.4 + rng.normal(0, 2, n_samples)).round()
+    model = xgb.XGBRegressor(**{'n_estimators': 100, 'learning_rate': 0.1, 'max_depth': 5,
+                                'objective': 'reg:squarederror', **params})
+    model.fit(X, y)
+    return model
+
+
+def synthetic_grid(n_drivers=20, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{
+        'code': f"D{i:02d}",
+        'grid': i + 1,
+        'start_compound': str(rng.choice(['Soft', 'Medium', 'Hard'])),
+        'stops': int(rng.integers(1, 3)),
+        'pace_delta': float(rng.normal(0, 0.5)),
+        'consistency': float(rng.uniform(0.2, 0.8)),
+    } for i in range(n_drivers)]
+
+
+def legacy_predict(model, model_features, drivers_input, is_wet):
+    # DataFrame + sklearn wrapper path /predict used before inference.py
+    rows = []
+    for d in drivers_input:
+        rows.append({
+            'GridPosition': d['grid'],
+            'StartCompound': COMPOUND_MAP.get(d['start_compound'].upper(), 2),
+            'Stops': int(d['stops']),
+            'PaceDelta': d['pace_delta'],
+            'Consistency': d['consistency'],
+            'IsWet': is_wet,
+            'DriverCode': d['code']
+        })
+    df = pd.DataFrame(rows)
+    return model.predict(df[model_features])
+
+
+def latency_summary(times):
+    ms = np.asarray(times) * 1000
+    return {'p50_ms': float(np.percentile(ms, 50)), 'p99_ms': float(np.percentile(ms, 99)),
+            'mean_ms': float(ms.mean())}
+
+
+def bench_predict(args):
+    from inference import TreeArrays
+
+    model = fixture_model()
+    native = NativePredictor.from_sklearn(model, MODEL_FEATURES)
+    trees = NativePredictor(None, MODEL_FEATURES, TreeArrays.from_booster(model.get_booster()))
+    grids = [synthetic_grid(args.drivers, seed=i) for i in range(50)]
+
+    for i, grid in enumerate(grids):
+        expected = legacy_predict(model, MODEL_FEATURES, grid, i % 2)
+        assert np.array_equal(expected, native.predict(grid, i % 2)), "native path differs from sklearn path"
+        assert np.array_equal(expected, trees.predict(grid, i % 2)), "tree arrays differ from sklearn path"
+    check_tree_parity()
+    print(f"Parity OK (native booster == tree arrays == sklearn wrapper on {len(grids)} grids)")
+
+    paths = (
+        ('DataFrame + sklearn', lambda g, w: legacy_predict(model, MODEL_FEATURES, g, w)),
+        ('native booster', native.predict),
+        ('tree arrays', trees.predict),
+    )
+    for name, fn in paths:
+        times = []
+        for i in range(args.requests):
+            start = time.perf_counter()
+            fn(grids[i % len(grids)], i % 2)
+            times.append(time.perf_counter() - start)
+        summary = latency_summary(times)
+        print(f"  {name:20s} p50 {summary['p50_ms']:7.3f} ms  p99 {summary['p99_ms']:7.3f} ms")
+
+
+def fixture_app(workdir=None):
+    # Import app.py against a throwaway model registry holding the fixture model
+    workdir = workdir or tempfile.mkdtemp(prefix='f1-bench-')
+    os.environ['F1_MODEL_DIR'] = os.path.join(workdir, 'models')
+    os.environ['F1_FEATURE_STORE'] = os.path.join(workdir, 'feature_store')
+    os.environ['F1_MODEL_WATCH_SECONDS'] = '0'
+    os.environ['F1_RACE_INDEX'] = os.path.join(workdir, 'race_index')
+    os.environ['F1_LAPS_DIR'] = os.path.join(workdir, 'compact_laps')
+    os.environ['F1_RECENT_RACES'] = os.path.join(workdir, 'recent_races.json')
+    # Modules imported before this ran (bench.py itself, or an earlier suite section) have
+    # already read their directories from the environment
+    import compact_laps
+    import features
+    import model_registry
+    compact_laps.LAPS_DIR = os.environ['F1_LAPS_DIR']
+    features.FEATURE_STORE_DIR = os.environ['F1_FEATURE_STORE']
+    model_registry.REGISTRY_DIR = os.environ['F1_MODEL_DIR']
+
+    from model_registry import save_version
+    save_version(fixture_model(), MODEL_FEATURES, meta={'fixture': True}, root=os.environ['F1_MODEL_DIR'])
+
+    import app
+    return app.app.test_client()
+
+
+class _HttpClient:
+    # Minimal stand-in for the Flask test client that goes through a real socket
+    def __init__(self, wsgi_app):
+        import logging
+        import threading
+        from werkzeug.serving import make_server
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.server = make_server('127.0.0.1', 0, wsgi_app, threaded=True)
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def post(self, path, json=None):
+        import json as json_module
+        import urllib.request
+
+        req = urllib.request.Request(self.base + path, data=json_module.dumps(json).encode(),
+                                     headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req) as resp:
+            body = resp.read().decode()
+
+        class Result:
+            def get_json(self):
+                return json_module.loads(body)
+
+            def get_data(self, as_text=True):
+                return body
+        return Result()
+
+
+def bench_batch(args):
+    client = fixture_app()
+    if args.http:
+        client = _HttpClient(client.application)
+    scenarios = [{
+        'id': i,
+        'drivers': synthetic_grid(args.drivers, seed=i),
+        'weather': {'is_wet': bool(i % 2)}
+    } for i in range(args.scenarios)]
+
+    start = time.perf_counter()
+    singles = []
+    for s in scenarios:
+        r = client.post('/predict', json={'drivers': s['drivers'], 'weather': s['weather']})
+        singles.append(r.get_json())
+    single_s = time.perf_counter() - start
+
+    runs = {}
+    for name, body, query in (('/predict/batch story', {'include_story': True}, ''),
+                              ('/predict/batch', {}, ''),
+                              ('/predict/batch columns', {'format': 'columns'}, ''),
+                              ('/predict/batch NDJSON', {}, '?stream=1')):
+        start = time.perf_counter()
+        r = client.post('/predict/batch' + query, json={'scenarios': scenarios, **body})
+        if query:
+            results = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+        else:
+            results = r.get_json()['results']
+        runs[name] = (time.perf_counter() - start, results)
+
+    for i, one in enumerate(singles):
+        for name, (_, results) in runs.items():
+            classification = results[i]['classification']
+            if isinstance(classification, dict):
+                classification = [dict(zip(classification, row)) for row in zip(*classification.values())]
+            assert classification == one['classification'], f"{name} differs from /predict"
+    assert all(r['story'][0] == one['story'][0] for r, one in zip(runs['/predict/batch story'][1], singles))
+    print(f"Parity OK ({args.scenarios} scenarios: /predict == /predict/batch rows, columns and NDJSON)")
+
+    print(f"  {'/predict x N':24s} {single_s * 1000:8.1f} ms  {args.scenarios / single_s:9.0f} scenarios/s  x1.0")
+    for name, (seconds, _) in runs.items():
+        print(f"  {name:24s} {seconds * 1000:8.1f} ms  {args.scenarios / seconds:9.0f} scenarios/s"
+              f"  x{single_s / seconds:.1f}")
+
+
+def bench_race(args):
+    from features import fit_tyre_model
+    from race_engine import race_report, race_tyre_model, simulate_race
+
+    # SyntheticSession laps degrade 0.04 s/lap on every compound and in-laps cost 20 s
+    session = SyntheticSession(n_drivers=args.drivers, n_laps=args.laps)
+    fit = fit_tyre_model(session.laps)
+    slopes = {c: round(v['slope'], 3) for c, v in fit['compounds'].items()}
+    print(f"Fitted degradation {slopes} s/lap, pit loss {fit['pit_loss']:.1f} s")
+
+    grid = synthetic_grid(args.drivers)
+    tyre_model = race_tyre_model(fit)
+    for n_sims in args.sims:
+        times = timeit(lambda: simulate_race(grid, False, tyre_model, n_sims=n_sims, seed=0), args.repeat)
+        print(f"  {n_sims:5d} races x {args.laps} laps  median {np.median(times) * 1000:8.1f} ms  "
+              f"({n_sims / np.median(times):8.0f} races/s)")
+    report = race_report(grid, simulate_race(grid, False, tyre_model, n_sims=200, seed=0))
+    print(f"  story: {len(report['story'])} events, {len(report['radio'])} radio messages")
+
+
+def _slow_loader(seconds):
+    # Stand-in for fastf1 session.load(): network wait plus some pandas work
+    def load(year, round_num, session_type='R'):
+        time.sleep(seconds)
+        return SyntheticSession(seed=round_num)
+    return load
+
+
+def bench_loadtest(args):
+    # /predict latency on a threaded waitress server, idle vs while many race loads are pending
+    import threading
+    import urllib.error
+    import urllib.request
+    from waitress import create_server
+
+    client = fixture_app()
+    import app as app_module
+    app_module.session_cache.loader = _slow_loader(args.load_seconds)
+
+    server = create_server(app_module.app, host='127.0.0.1', port=0, threads=args.threads)
+    base = f"http://127.0.0.1:{server.effective_port}"
+    threading.Thread(target=server.run, daemon=True).start()
+
+    payload = json.dumps({'drivers': synthetic_grid(20)}).encode()
+
+    def predict_latencies(n):
+        times = []
+        for _ in range(n):
+            req = urllib.request.Request(base + '/predict', data=payload,
+                                         headers={'Content-Type': 'application/json'})
+            start = time.perf_counter()
+            urllib.request.urlopen(req).read()
+            times.append(time.perf_counter() - start)
+        return latency_summary(times)
+
+    idle = predict_latencies(args.requests)
+
+    statuses = []
+    def race_request(round_num):
+        try:
+            with urllib.request.urlopen(f"{base}/race/2023/{round_num}") as resp:
+                statuses.append(resp.status)
+        except urllib.error.HTTPError as e:
+            statuses.append(e.code)
+
+    loaders = [threading.Thread(target=race_request, args=(r,)) for r in range(1, args.race_loads + 1)]
+    for t in loaders:
+        t.start()
+    time.sleep(0.2)  # Let the race requests occupy their threads first
+    busy = predict_latencies(args.requests)
+    for t in loaders:
+        t.join()
+    server.task_dispatcher.shutdown()
+    server.close()
+
+    print(f"waitress threads={args.threads}, load workers={app_module.session_cache.load_workers}, "
+          f"max waiting loads={app_module.session_cache.max_waiting}, {args.race_loads} race requests "
+          f"of {args.load_seconds}s each")
+    for name, summary in (('/predict idle', idle), ('/predict during loads', busy)):
+        print(f"  {name:22s} p50 {summary['p50_ms']:7.2f} ms  p99 {summary['p99_ms']:7.2f} ms")
+    print(f"  race responses: {sorted(statuses)}")
+
+
+def bench_memo(args):
+    # /predict through the test client on a UI-like session: each run either repeats the last
+    # request or tweaks one driver. Cached (with a parity check) vs the cache disabled.
+    client = fixture_app()
+    import app as app_module
+
+    rng = np.random.default_rng(0)
+    grid = synthetic_grid(args.drivers)
+    session = []
+    for _ in range(args.requests):
+        if rng.random() >= args.repeat_share:
+            grid = [dict(d) for d in grid]
+            d = grid[rng.integers(len(grid))]
+            d['pace_delta'] = round(float(d['pace_delta'] + rng.normal(0, 0.2)), 3)
+        session.append(grid)
+
+    cache = app_module.predict_cache
+    results, spent = {}, {}
+    for name, max_entries in (('no cache', 0), ('memoized', cache.max_entries or 1024)):
+        cache.max_entries = max_entries
+        cache.clear()
+        times, inference, classifications = [], [], []
+        for grid in session:
+            start = time.perf_counter()
+            resp = client.post('/predict', json={'drivers': grid}, headers={'X-Profile': '1'})
+            times.append(time.perf_counter() - start)
+            stages = json.loads(resp.headers['X-Stage-Timings'])
+            # Everything the cache stands in front of, minus the HTTP/JSON overhead both share
+            inference.append(sum(stages.get(k, 0.0) for k in
+                                 ('feature_matrix', 'cache_lookup', 'model_predict', 'ranking')) / 1000)
+            classifications.append([r['code'] for r in resp.get_json()['classification']])
+        results[name] = classifications
+        spent[name] = sum(inference)
+        total, work = latency_summary(times), latency_summary(inference)
+        print(f"  {name:10s} request p50 {total['p50_ms']:7.3f} ms  mean {total['mean_ms']:7.3f} ms   "
+              f"inference p50 {work['p50_ms']:7.3f} ms  mean {work['mean_ms']:7.3f} ms")
+    assert results['memoized'] == results['no cache'], "memoized results differ from fresh predictions"
+
+    stats = cache.stats()
+    print(f"Parity OK. {args.requests} requests, {args.repeat_share:.0%} repeats: hit ratio "
+          f"{stats['hit_ratio']:.2f}, partial {stats['partial_hits']}, row reuse {stats['row_hit_ratio']:.2f}, "
+          f"saved ~{stats['seconds_saved'] * 1000:.0f} ms by the cache's estimate, "
+          f"{(spent['no cache'] - spent['memoized']) * 1000:.0f} ms measured")
+
+
+def bench_stream(args):
+    # /simulate/race/stream over a real waitress socket: time to first event and to the result
+    # against the one-shot /simulate/race, then a client that hangs up mid-race
+    import http.client
+    import socket
+    import threading
+    from waitress import create_server
+
+    fixture_app()
+    import app as app_module
+    from metrics import STREAMS_CANCELLED
+
+    server = create_server(app_module.app, host='127.0.0.1', port=0, threads=4)
+    port = server.effective_port
+    threading.Thread(target=server.run, daemon=True).start()
+    grid = synthetic_grid(20)
+
+    def post(path, body):
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('POST', path, json.dumps(body), {'Content-Type': 'application/json'})
+        return conn, conn.getresponse()
+
+    print(f"{'sims':>5s} {'laps':>4s}  {'first event':>11s}  {'stream done':>11s}  {'/simulate/race':>14s}")
+    for n_sims in args.sims:
+        body = {'drivers': grid, 'n_sims': n_sims, 'laps': args.laps, 'seed': 0}
+        start = time.perf_counter()
+        conn, resp = post('/simulate/race/stream?format=ndjson', body)
+        first = None
+        for line in resp:
+            if first is None:
+                first = time.perf_counter() - start
+            event = json.loads(line)['event']
+        done = time.perf_counter() - start
+        conn.close()
+        assert event == 'result', f"stream ended with {event}"
+
+        start = time.perf_counter()
+        conn, resp = post('/simulate/race', body)
+        resp.read()
+        oneshot = time.perf_counter() - start
+        conn.close()
+        print(f"{n_sims:5d} {args.laps:4d}  {first * 1000:8.1f} ms  {done * 1000:8.1f} ms  {oneshot * 1000:11.1f} ms")
+
+    # Hang up after a few laps: the server should stop simulating, not finish the race
+    cancelled = dict(STREAMS_CANCELLED._values).get(('stream_race',), 0)
+    body = {'drivers': grid, 'n_sims': max(args.sims), 'laps': args.laps, 'standings_every': 1}
+    sock = socket.create_connection(('127.0.0.1', port))
+    payload = json.dumps(body).encode()
+    sock.sendall(b"POST /simulate/race/stream?format=ndjson HTTP/1.1\r\nHost: bench\r\n"
+                 b"Content-Type: application/json\r\nContent-Length: %d\r\n\r\n%s" % (len(payload), payload))
+    received = b''
+    while received.count(b'"event":"standings"') < 3:
+        received += sock.recv(65536)
+    sock.shutdown(socket.SHUT_RDWR)
+    sock.close()
+    deadline = time.time() + 30
+    while dict(STREAMS_CANCELLED._values).get(('stream_race',), 0) == cancelled and time.time() < deadline:
+        time.sleep(0.05)
+    stopped = dict(STREAMS_CANCELLED._values).get(('stream_race',), 0) > cancelled
+    sent = dict(app_module.STREAM_EVENTS._values).get(('stream_race', 'standings'), 0)
+    print(f"disconnect after 3 laps: {'stream cancelled' if stopped else 'NOT cancelled'}, "
+          f"{sent - len(args.sims) * args.laps} of {args.laps} laps simulated for it")
+    server.task_dispatcher.shutdown()
+    server.close()
+
+
+# Run in a fresh interpreter: import app.py, send one /predict, then wait for the background
+# XGBoost load. Timings are from the first line of the script.
+_COLDSTART_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().post('/predict', json=json.loads(sys.argv[1]))
+answered = time.perf_counter()
+native = app.registry.current().native
+scored_with_trees = native.booster is None
+heavy = sorted(m for m in ('pandas', 'pyarrow', 'fastf1', 'sklearn', 'joblib') if m in sys.modules)
+native.booster_ready.wait()
+print(json.dumps({'status': response.status_code, 'import_s': imported - start,
+                  'first_predict_s': answered - start, 'booster_s': time.perf_counter() - start,
+                  'scored_with_trees': scored_with_trees, 'heavy_modules': heavy}))
+"""
+
+
+def coldstart_runs(workdir, runs):
+    import subprocess
+    import sys
+
+    from model_registry import save_version
+
+    models = os.path.join(workdir, 'models')
+    if not os.path.isdir(models):
+        save_version(fixture_model(), MODEL_FEATURES, meta={'fixture': True}, root=models)
+    env = {**os.environ, 'F1_MODEL_DIR': models, 'F1_MODEL_WATCH_SECONDS': '0',
+           'F1_FEATURE_STORE': os.path.join(workdir, 'feature_store'),
+           'F1_RACE_INDEX': os.path.join(workdir, 'race_index'),
+           'F1_LAPS_DIR': os.path.join(workdir, 'compact_laps'),
+           'F1_RECENT_RACES': os.path.join(workdir, 'recent_races.json'),
+           'PYTHONPATH': os.path.dirname(os.path.abspath(__file__))}
+    body = json.dumps({'drivers': synthetic_grid(20)})
+    results = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', _COLDSTART_SCRIPT, body], cwd=workdir, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        result['process_s'] = time.perf_counter() - start
+        if result['status'] != 200:
+            raise SystemExit(f"/predict answered {result['status']} on a cold start")
+        results.append(result)
+    return results
+
+
+def bench_coldstart(args):
+    check_tree_parity()
+    print("Parity OK (tree arrays == booster)")
+    workdir = tempfile.mkdtemp(prefix='f1-coldstart-')
+    runs = coldstart_runs(workdir, args.runs)
+    for i, r in enumerate(runs, 1):
+        print(f"  run {i}: import {r['import_s'] * 1000:7.1f} ms  first /predict {r['first_predict_s'] * 1000:7.1f} ms "
+              f"({'tree arrays' if r['scored_with_trees'] else 'booster'})  booster ready {r['booster_s'] * 1000:7.1f} ms  "
+              f"process {r['process_s'] * 1000:7.1f} ms")
+    print(f"  median first /predict {np.median([r['first_predict_s'] for r in runs]) * 1000:.1f} ms, "
+          f"heavy modules at that point: {', '.join(runs[-1]['heavy_modules']) or 'none'}")
+
+
+def check_tree_parity(n_rows=5000, seed=0):
+    # TreeArrays against Booster.inplace_predict, NaNs included: must be bit-identical
+    from inference import TreeArrays
+
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([rng.integers(1, 21, n_rows), rng.integers(1, 6, n_rows), rng.integers(0, 4, n_rows),
+                         rng.normal(0, 0.8, n_rows), rng.uniform(0.1, 1.5, n_rows),
+                         rng.integers(0, 2, n_rows)]).astype(np.float32)
+    X[rng.random(X.shape) < 0.02] = np.nan
+    for params in ({}, {'max_depth': 8, 'n_estimators': 300}, {'n_estimators': 40, 'max_depth': 2}):
+        booster = fixture_model(**params).get_booster()
+        expected = booster.inplace_predict(X)
+        actual = TreeArrays.from_booster(booster).predict(X)
+        assert np.array_equal(actual, expected), f"TreeArrays differ from the booster for {params}"
+
+
+# --- Suite: fixed workloads, results to JSON, compared against a stored baseline ---
+
+def _timings(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.asarray(times)
+
+
+def _peak_mb(fn):
+    # Peak Python/NumPy allocation while fn runs (tracemalloc slows it, so never timed)
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def _metric(value, unit, better='lower'):
+    return {'value': float(value), 'unit': unit, 'better': better}
+
+
+def _latency_metrics(prefix, times):
+    ms = times * 1000
+    return {f"{prefix}.p50_ms": _metric(np.percentile(ms, 50), 'ms'),
+            f"{prefix}.p99_ms": _metric(np.percentile(ms, 99), 'ms')}
+
+
+def suite_ingest(args, workdir):
+    from features import load_training_dataset
+    from ingest import store_race
+    from train import to_training_frame
+
+    root = os.path.join(workdir, 'ingest_store')
+    import features
+    features.FEATURE_STORE_DIR, saved_root = root, features.FEATURE_STORE_DIR
+    try:
+        sessions = [SyntheticSession(seed=r) for r in range(1, args.races + 1)]
+        start = time.perf_counter()
+        for round_num, session in enumerate(sessions, 1):
+            store_race(2023, round_num, session)
+        ingest_s = time.perf_counter() - start
+
+        races = [(2023, r) for r in range(1, args.races + 1)]
+        start = time.perf_counter()
+        to_training_frame(load_training_dataset(races, root))
+        dataset_s = time.perf_counter() - start
+        reload = _timings(lambda: to_training_frame(load_training_dataset(races, root)), args.repeat)
+    finally:
+        features.FEATURE_STORE_DIR = saved_root
+    return {
+        'ingest.races_per_s': _metric(args.races / ingest_s, 'races/s', 'higher'),
+        'ingest.dataset_build_ms': _metric(dataset_s * 1000, 'ms'),
+        'ingest.dataset_reload_ms': _metric(np.median(reload) * 1000, 'ms'),
+    }
+
+
+def suite_features(args, workdir):
+    from compact_laps import CompactSession
+    from session_cache import estimate_session_bytes
+
+    session = SyntheticSession()
+    extract = _timings(lambda: extract_race_features(session), args.repeat)
+    stints = _timings(lambda: stint_table(session.laps, session.drivers), args.repeat)
+    compact = CompactSession.from_session(session)
+    compact_extract = _timings(lambda: extract_race_features(compact), args.repeat)
+    return {
+        'features.extract_races_per_s': _metric(1 / np.median(extract), 'races/s', 'higher'),
+        'features.compact_extract_races_per_s': _metric(1 / np.median(compact_extract), 'races/s', 'higher'),
+        'features.stint_table_ms': _metric(np.median(stints) * 1000, 'ms'),
+        'memory.extract_peak_mb': _metric(_peak_mb(lambda: extract_race_features(session)), 'MB'),
+        'memory.cached_race_kb': _metric(estimate_session_bytes(compact) / 1024, 'KB'),
+    }
+
+
+def suite_inference(args, workdir):
+    from race_engine import simulate_race
+
+    native = NativePredictor.from_sklearn(fixture_model(), MODEL_FEATURES)
+    grids = [synthetic_grid(20, seed=i) for i in range(50)]
+    scenarios = [(g, i % 2) for i, g in enumerate(grids * 4)]
+    counter = iter(range(10 ** 9))
+    single = _timings(lambda: native.predict(grids[next(counter) % len(grids)], 0), args.repeat * 20)
+    batch = _timings(lambda: native.predict_batch(scenarios), args.repeat)
+    race = _timings(lambda: simulate_race(grids[0], False, n_sims=500, seed=0), max(3, args.repeat // 4))
+    return {
+        **_latency_metrics('inference.single', single),
+        'inference.batch_scenarios_per_s': _metric(len(scenarios) / np.median(batch), 'scenarios/s', 'higher'),
+        'race_engine.races_per_s': _metric(500 / np.median(race), 'races/s', 'higher'),
+        'memory.predict_batch_peak_mb': _metric(_peak_mb(lambda: native.predict_batch(scenarios)), 'MB'),
+        'memory.race_sim_peak_mb': _metric(_peak_mb(lambda: simulate_race(grids[0], False, n_sims=500, seed=0)), 'MB'),
+    }
+
+
+def suite_http(args, workdir):
+    client = fixture_app(workdir)
+    import app as app_module
+    from compact_laps import CompactSession
+    # Cold /race: what load_compact_session does after a FastF1 load, minus the network
+    app_module.session_cache.loader = (
+        lambda year, round_num, session_type='R': CompactSession.from_session(SyntheticSession(seed=round_num)))
+    app_module.predict_cache.max_entries = 0  # Time the computation, not memoized replies
+
+    counter = iter(range(10 ** 9))
+    grids = [synthetic_grid(20, seed=i) for i in range(50)]
+    scenarios = [{'id': i, 'drivers': g} for i, g in enumerate(grids)]
+    requests = {
+        'predict': lambda: client.post('/predict', json={'drivers': grids[next(counter) % len(grids)]}),
+        'predict_batch': lambda: client.post('/predict/batch', json={'scenarios': scenarios}),
+        'simulate': lambda: client.post('/simulate', json={'drivers': grids[0], 'n_sims': 1000}),
+        'simulate_race': lambda: client.post('/simulate/race', json={'drivers': grids[0], 'n_sims': 200, 'seed': 0}),
+        'race_stored': lambda: client.get('/race/2023/1'),
+        'strategy_stored': lambda: client.get('/race/2023/1/strategy'),
+        'metrics': lambda: client.get('/metrics'),
+    }
+    counts = {'predict': args.repeat * 10, 'predict_batch': args.repeat, 'metrics': args.repeat * 5}
+    results = {}
+    for name, call in requests.items():
+        response = call()
+        assert response.status_code == 200, f"{name} failed: {response.status_code} {response.data[:200]}"
+        results.update(_latency_metrics(f"http.{name}", _timings(call, counts.get(name, args.repeat * 2), warmup=0)))
+
+    # Races nobody asked for yet: session load, feature extraction and store write per request
+    cold = iter(range(2, 10 ** 6))
+    results.update(_latency_metrics('http.race_cold', _timings(lambda: client.get(f"/race/2023/{next(cold)}"),
+                                                                args.repeat, warmup=0)))
+    results['memory.race_cold_peak_mb'] = _metric(_peak_mb(lambda: client.get(f"/race/2023/{next(cold)}")), 'MB')
+    return results
+
+
+def suite_startup(args, workdir):
+    runs = coldstart_runs(os.path.join(workdir, 'coldstart'), 3)
+    return {
+        'startup.import_ms': _metric(np.median([r['import_s'] for r in runs]) * 1000, 'ms'),
+        'startup.first_predict_ms': _metric(np.median([r['first_predict_s'] for r in runs]) * 1000, 'ms'),
+    }
+
+
+SUITE = (('ingest', suite_ingest), ('features', suite_features), ('inference', suite_inference),
+         ('http', suite_http), ('startup', suite_startup))
+
+
+def compare_results(current, baseline, threshold, min_delta_ms=1.0):
+    # (rows, regressions); a metric regresses when it is worse than the baseline by > threshold
+    # (and, for latencies, by more than min_delta_ms: sub-millisecond timings are mostly noise)
+    rows, regressions = [], []
+    for name, metric in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None or not base['value']:
+            rows.append((name, None, metric, None, 'new'))
+            continue
+        change = (metric['value'] - base['value']) / base['value']
+        worse = change if metric['better'] == 'lower' else -change
+        status = 'REGRESSION' if worse > threshold else 'improved' if worse < -threshold else 'ok'
+        if metric['unit'] == 'ms' and abs(metric['value'] - base['value']) < min_delta_ms:
+            status = 'ok'
+        if status == 'REGRESSION':
+            regressions.append(name)
+        rows.append((name, base, metric, change, status))
+    return rows, regressions
+
+
+def bench_suite(args):
+    import platform
+    import subprocess
+    import xgboost
+
+    workdir = tempfile.mkdtemp(prefix='f1-suite-')
+    wanted = set(args.only or [name for name, _ in SUITE])
+    results, start = {}, time.perf_counter()
+    for name, run in SUITE:
+        if name in wanted:
+            t = time.perf_counter()
+            results.update(run(args, workdir))
+            print(f"  {name:10s} done in {time.perf_counter() - t:5.1f}s")
+    try:
+        import resource
+        results['memory.process_max_rss_mb'] = _metric(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 'MB')
+    except ImportError:
+        pass  # No resource module on Windows
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'xgboost': xgboost.__version__,
+            'repeat': args.repeat,
+            'seconds': time.perf_counter() - start,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    rows, regressions = compare_results(report, baseline, args.threshold, args.min_delta_ms) if baseline else (
+        [(name, None, metric, None, '') for name, metric in results.items()], [])
+    for name, base, metric, change, status in rows:
+        line = f"  {name:36s} {metric['value']:12.3f} {metric['unit']:12s}"
+        if base is not None:
+            line += f" baseline {base['value']:12.3f}  {change:+7.1%}"
+        print(f"{line}  {status}")
+    print(f"Wrote {args.output}")
+    if baseline:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%} vs {args.compare} "
+              f"(baseline {baseline['meta'].get('commit') or '?'})")
+        if regressions:
+            raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="F1 simulator micro-benchmarks")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('features', help="Per-driver feature extraction: vectorized vs per-driver loop")
+    p.add_argument('--drivers', type=int, default=20)
+    p.add_argument('--laps', type=int, default=57)
+    p.add_argument('--repeat', type=int, default=20)
+    p.set_defaults(func=bench_features)
+
+    p = sub.add_parser('stints', help="/strategy stint extraction: one grouped pass vs per-driver loop")
+    p.add_argument('--drivers', type=int, default=20)
+    p.add_argument('--laps', type=int, default=57)
+    p.add_argument('--repeat', type=int, default=20)
+    p.set_defaults(func=bench_stints)
+
+    p = sub.add_parser('laps', help="Compact lap tables: parity with FastF1 sessions and memory per cached race")
+    p.add_argument('--drivers', type=int, default=20)
+    p.add_argument('--laps', type=int, default=57)
+    p.add_argument('--repeat', type=int, default=20)
+    p.set_defaults(func=bench_laps)
+
+    p = sub.add_parser('predict', help="Per-request /predict inference latency: DataFrame path vs native booster")
+    p.add_argument('--drivers', type=int, default=20)
+    p.add_argument('--requests', type=int, default=2000)
+    p.set_defaults(func=bench_predict)
+
+    p = sub.add_parser('batch', help="Scenarios/s: one /predict per scenario vs /predict/batch")
+    p.add_argument('--drivers', type=int, default=20)
+    p.add_argument('--scenarios', type=int, default=500)
+    p.add_argument('--http', action='store_true', help="Go through a local HTTP server instead of the test client")
+    p.set_defaults(func=bench_batch)
+
+    p = sub.add_parser('race', help="Lap-by-lap race engine: tyre model fit and races/s")
+    p.add_argument('--drivers', type=int, default=20)
+    p.add_argument('--laps', type=int, default=57)
+    p.add_argument('--sims', type=int, nargs='+', default=[1, 100, 1000, 5000])
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_race)
+
+    p = sub.add_parser('memo', help="/predict memoization on a repeat-or-tweak-one-driver request stream")
+    p.add_argument('--drivers', type=int, default=20)
+    p.add_argument('--requests', type=int, default=500)
+    p.add_argument('--repeat-share', type=float, default=0.5)
+    p.set_defaults(func=bench_memo)
+
+    p = sub.add_parser('stream', help="/simulate/race/stream time to first event and cancellation on disconnect")
+    p.add_argument('--sims', type=int, nargs='+', default=[100, 1000, 5000])
+    p.add_argument('--laps', type=int, default=57)
+    p.set_defaults(func=bench_stream)
+
+    p = sub.add_parser('coldstart', help="Fresh-process time to the first /predict, and to the XGBoost booster")
+    p.add_argument('--runs', type=int, default=5)
+    p.set_defaults(func=bench_coldstart)
+
+    p = sub.add_parser('suite', help="Every benchmark on fixed workloads; JSON results, optional baseline comparison")
+    p.add_argument('--output', default='bench_results.json')
+    p.add_argument('--compare', default=None, help="Baseline JSON from an earlier run; exits 1 on regressions")
+    p.add_argument('--threshold', type=float, default=0.25, help="Relative change that counts as a regression")
+    p.add_argument('--min-delta-ms', type=float, default=1.0, help="Ignore latency changes smaller than this")
+    p.add_argument('--repeat', type=int, default=20)
+    p.add_argument('--races', type=int, default=10, help="Synthetic races to ingest")
+    p.add_argument('--only', nargs='+', choices=[name for name, _ in SUITE])
+    p.set_defaults(func=bench_suite)
+
+    p = sub.add_parser('loadtest', help="/predict latency while slow FastF1 loads are in progress")
+    p.add_argument('--threads', type=int, default=16)
+    p.add_argument('--race-loads', type=int, default=12)
+    p.add_argument('--load-seconds', type=float, default=3.0)
+    p.add_argument('--requests', type=int, default=200)
+    p.set_defaults(func=bench_loadtest)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
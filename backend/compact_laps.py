@@ -0,0 +1,223 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from atomic_io import replacing
+
+# Compact per-race lap table for cached sessions.
+# A loaded FastF1 session keeps ~30 lap columns (object strings, Timedeltas, session times) of
+# which features.py reads eight. CompactLaps keeps just those as flat typed arrays:
+#   driver    int8     code into drivers (DriverNumber) / abbreviations (Driver)
+#   team      int8     code into teams
+#   compound  int8     code into compounds
+#   lap       int16    LapNumber
+#   stint     int16    Stint       (-1 = missing)
+#   tyre_life int16    TyreLife    (-1 = missing)
+#   seconds   float32  LapTime in seconds (NaN = missing)
+# laps['Column'] decodes the pandas Series the feature code expects on access (categoricals for
+# names, floats with NaN, LapTime as Timedelta), so features.py runs on it unchanged.
+# CompactSession adds the few results columns, driver order, event names and compound colours.
+# Saved sessions are one .npy per array, loaded memory-mapped: server processes share the pages
+# and a cold start reads nothing it does not touch.
+#   python compact_laps.py --seasons 2023   (convert races already in the FastF1 cache)
+
+LAPS_DIR = os.environ.get('F1_LAPS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compact_laps'))
+META_FILE = 'meta.json'
+MISSING = -1
+
+RESULT_COLUMNS = ['Abbreviation', 'BroadcastName', 'FullName', 'TeamName', 'GridPosition', 'Position']
+
+_ARRAYS = {
+    'driver': np.int8, 'team': np.int8, 'compound': np.int8,
+    'lap': np.int16, 'stint': np.int16, 'tyre_life': np.int16, 'seconds': np.float32,
+}
+
+
+def _codes(values):
+    # int8 codes (-1 for missing) and the category list
+    codes, categories = pd.factorize(pd.Series(values, dtype=object).where(pd.notna(values), None))
+    if len(categories) > np.iinfo(np.int8).max:
+        raise ValueError(f"{len(categories)} categories do not fit int8 codes")
+    return codes.astype(np.int8), [str(c) for c in categories]
+
+
+def _small_int(values):
+    values = np.asarray(values, dtype=float)
+    return np.where(np.isfinite(values), values, MISSING).astype(np.int16)
+
+
+def _decode_int(codes):
+    out = codes.astype(float)
+    out[codes == MISSING] = np.nan
+    return out
+
+
+class CompactLaps:
+    def __init__(self, arrays, drivers, abbreviations, teams, compounds):
+        self.arrays = arrays
+        self.drivers = list(drivers)
+        self.abbreviations = list(abbreviations)
+        self.teams = list(teams)
+        self.compounds = list(compounds)
+        self._dtypes = {}
+
+    @classmethod
+    def from_laps(cls, laps):
+        driver, drivers = _codes(laps['DriverNumber'].astype(str).to_numpy())
+        first = pd.Series(np.arange(len(driver))).groupby(driver).first()
+        abbreviations = [str(laps['Driver'].iloc[first[i]]) for i in range(len(drivers))]
+        team, teams = _codes(laps['Team'].to_numpy())
+        compound, compounds = _codes(laps['Compound'].to_numpy())
+        arrays = {
+            'driver': driver,
+            'team': team,
+            'compound': compound,
+            'lap': _small_int(laps['LapNumber']),
+            'stint': _small_int(laps['Stint']),
+            'tyre_life': _small_int(laps['TyreLife']),
+            'seconds': laps['LapTime'].dt.total_seconds().to_numpy(dtype=np.float32),
+        }
+        return cls(arrays, drivers, abbreviations, teams, compounds)
+
+    def __len__(self):
+        return len(self.arrays['lap'])
+
+    def __contains__(self, column):
+        return column in _COLUMNS
+
+    def __getitem__(self, column):
+        return pd.Series(_COLUMNS[column](self), name=column)
+
+    @property
+    def columns(self):
+        return list(_COLUMNS)
+
+    def lap_seconds(self):
+        # LapTime as float seconds without the Timedelta round trip (see features.lap_seconds)
+        return self.arrays['seconds'].astype(float)
+
+    def _categorical(self, name, categories):
+        # One dtype per category list: validating the categories costs more than the decode
+        dtype = self._dtypes.get(name)
+        if dtype is None:
+            dtype = self._dtypes[name] = pd.CategoricalDtype(categories)
+        return pd.Categorical.from_codes(np.asarray(self.arrays[name]), dtype=dtype)
+
+    @property
+    def nbytes(self):
+        strings = sum(len(s) + 50 for s in self.drivers + self.abbreviations + self.teams + self.compounds)
+        return sum(a.nbytes for a in self.arrays.values()) + strings
+
+    @property
+    def mapped(self):
+        return any(isinstance(a, np.memmap) for a in self.arrays.values())
+
+
+_COLUMNS = {
+    'DriverNumber': lambda laps: laps._categorical('driver', laps.drivers),
+    'Driver': lambda laps: np.asarray(laps.abbreviations + [np.nan], dtype=object)[laps.arrays['driver']],
+    'Team': lambda laps: laps._categorical('team', laps.teams),
+    'Compound': lambda laps: laps._categorical('compound', laps.compounds),
+    'LapNumber': lambda laps: _decode_int(laps.arrays['lap']),
+    'Stint': lambda laps: _decode_int(laps.arrays['stint']),
+    'TyreLife': lambda laps: _decode_int(laps.arrays['tyre_life']),
+    'LapTime': lambda laps: pd.to_timedelta(laps.lap_seconds(), unit='s'),
+}
+
+
+class CompactSession:
+    # The parts of a FastF1 session the API reads: laps, results, drivers, event, compound colours
+    def __init__(self, laps, results, drivers, event, compound_colors=None):
+        self.laps = laps
+        self.results = results
+        self.drivers = list(drivers)
+        self.event = event
+        self.compound_colors = compound_colors or {}
+
+    @classmethod
+    def from_session(cls, session):
+        from race_index import compound_colors
+
+        results = pd.DataFrame({c: session.results[c].to_numpy() for c in RESULT_COLUMNS},
+                               index=pd.Index([str(d) for d in session.results.index], name='DriverNumber'))
+        event = {key: str(session.event[key]) for key in ('EventName', 'Location', 'Country')}
+        return cls(CompactLaps.from_laps(session.laps), results, [str(d) for d in session.drivers],
+                   event, compound_colors(session))
+
+    @property
+    def nbytes(self):
+        return self.laps.nbytes + int(self.results.memory_usage(deep=True).sum())
+
+    def save(self, path):
+        # Renamed in whole, so a reader never maps half of it; readers that mapped a directory
+        # saved before keep their (unlinked) files
+        meta = {
+            'drivers': self.laps.drivers, 'abbreviations': self.laps.abbreviations,
+            'teams': self.laps.teams, 'compounds': self.laps.compounds,
+            'session_drivers': self.drivers,
+            'event': self.event,
+            'compound_colors': self.compound_colors,
+            'results': json.loads(self.results.to_json(orient='split')),
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with replacing(path) as tmp_path:
+            os.makedirs(tmp_path)
+            for name, array in self.laps.arrays.items():
+                np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(array))
+            with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+                json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r' if mmap else None)
+                  for name in _ARRAYS}
+        laps = CompactLaps(arrays, meta['drivers'], meta['abbreviations'], meta['teams'], meta['compounds'])
+        split = meta['results']
+        results = pd.DataFrame(split['data'], columns=split['columns'],
+                               index=pd.Index([str(i) for i in split['index']], name='DriverNumber'))
+        for column in ('GridPosition', 'Position'):
+            results[column] = results[column].astype(float)
+        return cls(laps, results, meta['session_drivers'], meta['event'], meta['compound_colors'])
+
+
+def compact_path(year, round_num, session_type='R', root=None):
+    return os.path.join(root or LAPS_DIR, str(int(year)), f"{int(round_num):02d}{session_type}")
+
+
+def load_compact_session(year, round_num, session_type='R', root=None,
+                         mmap=os.environ.get('F1_LAPS_MMAP', '1') != '0'):
+    # Saved compact session if there is one, else FastF1 (saved for next time when it has laps)
+    path = compact_path(year, round_num, session_type, root)
+    if os.path.exists(os.path.join(path, META_FILE)):
+        return CompactSession.load(path, mmap=mmap)
+
+    from session_cache import load_race_session
+
+    session = CompactSession.from_session(load_race_session(year, round_num, session_type))
+    if len(session.laps):
+        session.save(path)
+    return session
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from ingest import CACHE_DIR, enable_cache, parse_rounds, race_targets
+
+    parser = argparse.ArgumentParser(description="Save compact lap tables for completed races")
+    parser.add_argument('--seasons', type=int, nargs='+', default=[2023])
+    parser.add_argument('--rounds', default=None, help="e.g. '1-5,8' (default: every completed round)")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args()
+
+    enable_cache(args.cache_dir)
+    for year, round_num, name in race_targets(args.seasons, parse_rounds(args.rounds)):
+        try:
+            session = load_compact_session(year, round_num, mmap=False)
+            print(f"  {year} R{round_num:02d} {name:28s} {len(session.laps):5d} laps  {session.nbytes / 1024:7.1f} KB")
+        except Exception as e:
+            print(f"  {year} R{round_num:02d} {name:28s} error: {e}")
@@ -0,0 +1,493 @@
+import json
+import os
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from atomic_io import replacing, write_text
+from inference import COMPOUND_MAP, compound_code  # Defined with the pandas-free /predict path
+
+# Per-race driver features shared by train.py and app.py.
+# Tables are written once per (year, round) to FEATURE_STORE_DIR so serving a
+# historical race or retraining never has to re-parse the FastF1 session.
+
+# Next to this file unless F1_FEATURE_STORE says otherwise (app.py and train.py are started from
+# the repo root as well as from backend/)
+FEATURE_STORE_DIR = os.environ.get('F1_FEATURE_STORE',
+                                   os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feature_store'))
+
+FEATURE_COLUMNS = [
+    'DriverNumber', 'Driver', 'Name', 'Team', 'GridPosition', 'FinishPosition',
+    'StartCompound', 'Stops', 'PaceDelta', 'Consistency', 'IsWet'
+]
+
+_EVENT_KEY = b'f1_event'
+
+
+def is_wet_race(laps):
+    # FastF1 doesn't give simple "Wet/Dry" boolean easily without weather data stream
+    # We approximate from tyre choice. If Inters/Wets used > 10% laps -> Wet
+    if len(laps) == 0:
+        return False
+    tyre_counts = laps['Compound'].value_counts()
+    wet_tyres = tyre_counts.get('INTERMEDIATE', 0) + tyre_counts.get('WET', 0)
+    return bool(wet_tyres / len(laps) > 0.1)
+
+
+QUICKLAP_THRESHOLD = 1.07  # Same 107% rule as Laps.pick_quicklaps
+
+
+def lap_seconds(laps):
+    # LapTime as float seconds; compact lap tables (compact_laps.py) store them as such
+    if hasattr(laps, 'lap_seconds'):
+        return laps.lap_seconds()
+    return laps['LapTime'].dt.total_seconds().to_numpy()
+
+
+def _group_mean(codes, values, n_groups):
+    counts = np.bincount(codes, minlength=n_groups)
+    sums = np.bincount(codes, weights=values, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts, counts
+
+
+def driver_lap_features(laps):
+    # One grouped pass over the laps frame instead of pick_driver/pick_quicklaps per driver.
+    # Returns one row per DriverNumber (in order of first appearance).
+    secs = lap_seconds(laps)
+    drv_codes, drivers = pd.factorize(laps['DriverNumber'].to_numpy())
+    valid = drv_codes >= 0
+    secs, drv_codes = secs[valid], drv_codes[valid]
+    n = len(drivers)
+
+    # Field pace: mean of team averages over quick laps (excluding in/out laps)
+    field_quick = secs < np.nanmin(secs, initial=np.inf) * QUICKLAP_THRESHOLD
+    team_codes, teams = pd.factorize(laps['Team'].to_numpy()[valid][field_quick])
+    has_team = team_codes >= 0
+    if has_team.any():
+        team_pace, _ = _group_mean(team_codes[has_team], secs[field_quick][has_team], len(teams))
+        field_avg = team_pace.mean()
+    else:
+        field_avg = 90.0  # fallback
+
+    # Quick laps are judged against each driver's own best, like d_laps.pick_quicklaps()
+    best = np.full(n, np.inf)
+    np.fmin.at(best, drv_codes, secs)
+    quick = secs < best[drv_codes] * QUICKLAP_THRESHOLD
+    q_codes, q_secs = drv_codes[quick], secs[quick]
+    mean, counts = _group_mean(q_codes, q_secs, n)
+    sq_dev = np.bincount(q_codes, weights=(q_secs - mean[q_codes]) ** 2, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(sq_dev / (counts - 1))  # ddof=1 like Series.std
+    std[counts < 2] = np.nan
+
+    # Stops = distinct stints - 1 (a missing Stint counts as one more value, like unique())
+    stint_codes, stint_values = pd.factorize(laps['Stint'].to_numpy()[valid])
+    pairs = np.unique(drv_codes * (len(stint_values) + 1) + (stint_codes + 1))
+    stints = np.bincount(pairs // (len(stint_values) + 1), minlength=n)
+
+    _, first_idx = np.unique(drv_codes, return_index=True)
+    start_compound = laps['Compound'].to_numpy()[valid][first_idx]
+
+    return pd.DataFrame({
+        'Stints': stints,
+        'StartCompound': [str(c) for c in start_compound],
+        'QuickLapMean': mean,
+        'QuickLapStd': std,
+        'Stops': np.maximum(stints - 1, 0),
+        'PaceDelta': np.nan_to_num(mean - field_avg),  # Negative is faster
+        'Consistency': np.nan_to_num(std),
+    }, index=pd.Index(drivers, name='DriverNumber'))
+
+
+MIN_COMPOUND_LAPS = 30  # Fewer green laps than this and the race engine uses its defaults
+
+
+def fit_tyre_model(laps):
+    # Per-compound pace offset (s, relative to the most used compound) and degradation (s/lap of
+    # tyre age), plus fuel burn (s/lap of race) and pit loss, for race_engine.py.
+    # Least squares on green laps with per-driver fixed effects, so car pace drops out.
+    secs = lap_seconds(laps)
+    drv_codes, drivers = pd.factorize(laps['DriverNumber'].to_numpy())
+    lap_num = laps['LapNumber'].to_numpy(dtype=float)
+    stint = laps['Stint'].to_numpy(dtype=float)
+    age = laps['TyreLife'].to_numpy(dtype=float)
+    compound = laps['Compound'].astype(str).str.upper().to_numpy()
+    ok = (drv_codes >= 0) & np.isfinite(secs) & np.isfinite(lap_num) & np.isfinite(stint) & np.isfinite(age)
+    if not ok.any():
+        return None
+
+    # Pit in/out laps are the ones next to a stint change (laps without a stint number are skipped,
+    # so a missing value does not count as a stop)
+    known = np.flatnonzero((drv_codes >= 0) & np.isfinite(lap_num) & np.isfinite(stint))
+    order = known[np.lexsort((lap_num[known], drv_codes[known]))]
+    same_car = drv_codes[order][1:] == drv_codes[order][:-1]
+    changed = same_car & (stint[order][1:] != stint[order][:-1])
+    stop_in, stop_out = order[:-1][changed], order[1:][changed]
+    in_lap, out_lap = np.zeros(len(secs), bool), np.zeros(len(secs), bool)
+    in_lap[stop_in] = True
+    out_lap[stop_out] = True
+
+    n = len(drivers)
+    best = np.full(n, np.inf)
+    np.fmin.at(best, drv_codes[ok], secs[ok])
+    green = ok & (lap_num > 1) & ~in_lap & ~out_lap
+    green &= secs < best[np.where(drv_codes >= 0, drv_codes, 0)] * QUICKLAP_THRESHOLD
+    if green.sum() < MIN_COMPOUND_LAPS:
+        return None
+
+    counts = pd.Series(compound[green]).value_counts()
+    fitted = [c for c, k in counts.items() if k >= MIN_COMPOUND_LAPS and c in COMPOUND_MAP and c != 'UNKNOWN']
+    if not fitted:
+        return None
+    reference = fitted[0]
+    use = green & np.isin(compound, fitted)
+
+    codes, y = drv_codes[use], secs[use]
+    columns = [lap_num[use]]
+    for c in fitted:
+        is_c = (compound[use] == c).astype(float)
+        if c != reference:
+            columns.append(is_c)
+        columns.append(is_c * age[use])
+    X = np.column_stack(columns)
+
+    # Driver fixed effects: demean everything within each driver
+    def demean(values):
+        mean, _ = _group_mean(codes, values, n)
+        return values - mean[codes]
+    Xd = np.column_stack([demean(col) for col in X.T])
+    coef, *_ = np.linalg.lstsq(Xd, demean(y), rcond=None)
+
+    compounds, i = {}, 1
+    for c in fitted:
+        offset = 0.0
+        if c != reference:
+            offset, i = float(coef[i]), i + 1
+        compounds[c] = {'offset': offset, 'slope': max(float(coef[i]), 0.0), 'laps': int(counts[c])}
+        i += 1
+
+    # Pit loss: in + out lap against the driver's typical green lap, averaged over the stops whose
+    # in- and out-lap are consecutive and both timed
+    median = pd.Series(secs[green]).groupby(drv_codes[green]).median().reindex(range(n)).to_numpy()
+    stop = lap_num[stop_out] == lap_num[stop_in] + 1
+    stop_in, stop_out = stop_in[stop], stop_out[stop]
+    loss = (secs[stop_in] - median[drv_codes[stop_in]]) + (secs[stop_out] - median[drv_codes[stop_out]])
+    pit_loss = float(np.nanmean(loss)) if np.isfinite(loss).any() else None
+
+    return {
+        'base_lap': float(np.median(secs[green])),
+        'fuel_per_lap': float(coef[0]),
+        'pit_loss': pit_loss if pit_loss is not None and 10 <= pit_loss <= 40 else None,
+        'laps': int(np.nanmax(lap_num[ok])),
+        'compounds': compounds,
+    }
+
+
+STINT_COLUMNS = [
+    'DriverNumber', 'Driver', 'Stint', 'Compound', 'StartLap', 'EndLap',
+    'Laps', 'MedianLapTime', 'DegradationSlope'
+]
+
+
+def stint_table(laps, drivers=None):
+    # One row per (driver, stint) for the whole field from a single grouping of the laps frame.
+    # Compound/StartLap/EndLap come from the stint's first and last rows (like iloc[0]/iloc[-1]);
+    # DegradationSlope is s/lap of tyre age over green laps (no in/out laps, within 107% of the
+    # driver's best), NaN with fewer than 3. Rows follow `drivers` order when given.
+    driver_numbers = laps['DriverNumber'].to_numpy()
+    stint = laps['Stint'].to_numpy(dtype=float)
+    keep = pd.notna(driver_numbers) & np.isfinite(stint)
+    frame = pd.DataFrame({
+        'DriverNumber': driver_numbers[keep],
+        'Stint': stint[keep],
+    })
+    codes = frame.groupby(['DriverNumber', 'Stint'], sort=False).ngroup().to_numpy()
+    n = int(codes.max()) + 1 if len(codes) else 0
+
+    secs = lap_seconds(laps)[keep]
+    lap_num = laps['LapNumber'].to_numpy(dtype=float)[keep]
+    age = laps['TyreLife'].to_numpy(dtype=float)[keep] if 'TyreLife' in laps else lap_num
+    age = np.where(np.isfinite(age), age, lap_num)
+
+    first = np.unique(codes, return_index=True)[1]
+    last = len(codes) - 1 - np.unique(codes[::-1], return_index=True)[1]
+    counts = np.bincount(codes, minlength=n)
+
+    has_time = np.isfinite(secs)
+    median = pd.Series(secs[has_time]).groupby(codes[has_time]).median().reindex(range(n)).to_numpy()
+
+    # Green laps: not the stint's first/last lap, not lap 1, within 107% of the driver's best
+    drv_codes, _ = pd.factorize(frame['DriverNumber'].to_numpy())
+    best = np.full(drv_codes.max() + 1 if len(drv_codes) else 0, np.inf)
+    np.fmin.at(best, drv_codes[has_time], secs[has_time])
+    green = has_time & (lap_num > 1) & (secs < best[drv_codes] * QUICKLAP_THRESHOLD)
+    green[first] = False
+    green[last] = False
+
+    # Least-squares slope per stint from grouped sums
+    g, x, y = codes[green], age[green], secs[green]
+    k = np.bincount(g, minlength=n).astype(float)
+    sx, sy = np.bincount(g, x, n), np.bincount(g, y, n)
+    sxx, sxy = np.bincount(g, x * x, n), np.bincount(g, x * y, n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (k * sxy - sx * sy) / (k * sxx - sx * sx)
+    slope[(k < 3) | ~np.isfinite(slope)] = np.nan
+
+    table = pd.DataFrame({
+        'DriverNumber': frame['DriverNumber'].to_numpy()[first],
+        'Driver': laps['Driver'].to_numpy()[keep][first] if 'Driver' in laps else frame['DriverNumber'].to_numpy()[first],
+        'Stint': frame['Stint'].to_numpy()[first].astype(int),
+        'Compound': laps['Compound'].to_numpy()[keep][first],
+        'StartLap': lap_num[first].astype(int),
+        'EndLap': lap_num[last].astype(int),
+        'Laps': counts,
+        'MedianLapTime': median,
+        'DegradationSlope': slope,
+    }, columns=STINT_COLUMNS)
+
+    if drivers is not None:
+        order = pd.Index([str(d) for d in drivers]).get_indexer(table['DriverNumber'].astype(str))
+        table = table[order >= 0].iloc[np.argsort(order[order >= 0], kind='stable')]
+    return table.reset_index(drop=True)
+
+
+def extract_race_features(session):
+    laps = session.laps
+    is_wet = int(is_wet_race(laps))
+
+    lap_features = driver_lap_features(laps)
+
+    # Keep session.drivers order; drivers without laps or results are skipped
+    results = session.results
+    drivers = pd.Index([str(d) for d in session.drivers])
+    lap_pos = lap_features.index.get_indexer(drivers)
+    res_pos = results.index.get_indexer(drivers)
+    keep = (lap_pos >= 0) & (res_pos >= 0)
+    lap_pos, res_pos = lap_pos[keep], res_pos[keep]
+
+    def res_col(column, dtype=None):
+        return results[column].to_numpy(dtype=dtype)[res_pos]
+
+    def lap_col(column, dtype=None):
+        return lap_features[column].to_numpy(dtype=dtype)[lap_pos]
+
+    broadcast_name, full_name = res_col('BroadcastName'), res_col('FullName')
+    df = pd.DataFrame({
+        'DriverNumber': drivers[keep],
+        'Driver': res_col('Abbreviation'),
+        'Name': np.where(broadcast_name == '', full_name, broadcast_name),
+        'Team': res_col('TeamName'),
+        'GridPosition': res_col('GridPosition', float),
+        'FinishPosition': res_col('Position', float),
+        'StartCompound': lap_col('StartCompound'),
+        'Stops': lap_col('Stops', int),
+        'PaceDelta': lap_col('PaceDelta', float),
+        'Consistency': lap_col('Consistency', float),
+        'IsWet': is_wet
+    }, columns=FEATURE_COLUMNS)
+
+    event = {
+        'EventName': str(session.event['EventName']),
+        'Location': str(session.event['Location']),
+        'Country': str(session.event['Country']),
+        'TyreModel': fit_tyre_model(laps)
+    }
+    return df, event
+
+
+# --- On-disk store ---
+
+def store_path(year, round_num, root=None):
+    return os.path.join(root or FEATURE_STORE_DIR, str(int(year)), f"{int(round_num):02d}.parquet")
+
+
+def has_race_features(year, round_num, root=None):
+    return os.path.exists(store_path(year, round_num, root))
+
+
+def write_race_features(year, round_num, df, event, root=None):
+    path = store_path(year, round_num, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[_EVENT_KEY] = json.dumps(event).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    with replacing(path) as tmp_path:
+        pq.write_table(table, tmp_path)
+    return path
+
+
+def read_race_features(year, round_num, root=None):
+    path = store_path(year, round_num, root)
+    if not os.path.exists(path):
+        return None
+    table = pq.read_table(path)
+    event = json.loads((table.schema.metadata or {}).get(_EVENT_KEY, b'{}'))
+    return table.to_pandas(), event
+
+
+def stint_store_path(year, round_num, root=None):
+    return os.path.join(root or FEATURE_STORE_DIR, str(int(year)), 'stints', f"{int(round_num):02d}.parquet")
+
+
+def write_stints(year, round_num, stints, root=None, colors=None):
+    # colors: compound -> colour for this session (race_index.compound_colors), stored as a Color
+    # column so /strategy never needs FastF1 to colour stored stints
+    if colors:
+        stints = stints.assign(Color=stints['Compound'].map(colors))
+    path = stint_store_path(year, round_num, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with replacing(path) as tmp_path:
+        pq.write_table(pa.Table.from_pandas(stints, preserve_index=False), tmp_path)
+    return path
+
+
+def read_stints(year, round_num, root=None):
+    path = stint_store_path(year, round_num, root)
+    if not os.path.exists(path):
+        return None
+    return pq.read_table(path).to_pandas()
+
+
+def build_race_features(year, round_num, load_session, root=None, stage=None):
+    # Store first; fall back to parsing the session and persist the result.
+    # Sessions without laps (future races) are never written.
+    # `stage(name)` is an optional timing context manager (see metrics.stage).
+    stage = stage or (lambda name: nullcontext())
+    with stage('feature_store_read'):
+        stored = read_race_features(year, round_num, root)
+    if stored is not None:
+        return stored
+
+    with stage('session_load'):
+        session = load_session(year, round_num)
+    if len(session.laps) == 0:
+        return None
+    with stage('feature_extraction'):
+        df, event = extract_race_features(session)
+    with stage('stint_extraction'):
+        stints = stint_table(session.laps, session.drivers)
+    with stage('feature_store_write'):
+        from race_index import compound_colors
+
+        write_stints(year, round_num, stints, root, colors=compound_colors(session))
+        write_race_features(year, round_num, df, event, root)
+    return df, event
+
+
+def list_stored_races(root=None):
+    root = root or FEATURE_STORE_DIR
+    races = []
+    if not os.path.isdir(root):
+        return races
+    for year in sorted(os.listdir(root)):
+        if not year.isdigit():
+            continue
+        for name in sorted(os.listdir(os.path.join(root, year))):
+            if name.endswith('.parquet'):
+                races.append((int(year), int(name[:-len('.parquet')])))
+    return races
+
+
+def load_feature_dataset(races=None, root=None):
+    races = list_stored_races(root) if races is None else races
+    frames = []
+    for year, round_num in races:
+        stored = read_race_features(year, round_num, root)
+        if stored is None:
+            continue
+        df = stored[0]
+        df.insert(0, 'Round', int(round_num))
+        df.insert(0, 'Year', int(year))
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=['Year', 'Round'] + FEATURE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+# --- Consolidated training dataset ---
+# dataset.parquet holds every race listed in manifest.json as one table, so training reads a
+# single file and a post-race update only appends the races that are new (or were re-ingested).
+
+DATASET_FILE = 'dataset.parquet'
+MANIFEST_FILE = 'manifest.json'
+
+
+def _race_key(year, round_num):
+    return f"{int(year)}-{int(round_num):02d}"
+
+
+def read_manifest(root=None):
+    path = os.path.join(root or FEATURE_STORE_DIR, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'races': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def update_dataset(races=None, root=None):
+    # Append stored races missing from dataset.parquet; returns (dataset, races added)
+    root = root or FEATURE_STORE_DIR
+    races = list_stored_races(root) if races is None else races
+    path = os.path.join(root, DATASET_FILE)
+    manifest = read_manifest(root) if os.path.exists(path) else {'races': {}}
+    known = manifest['races']
+
+    # A race is (re)loaded when it is new or its per-race file changed since it was appended
+    todo = []
+    for year, round_num in races:
+        race_path = store_path(year, round_num, root)
+        if os.path.exists(race_path) and known.get(_race_key(year, round_num)) != os.path.getmtime(race_path):
+            todo.append((int(year), int(round_num)))
+
+    dataset = pd.read_parquet(path) if known else None
+    if not todo:
+        return (dataset if dataset is not None else load_feature_dataset([], root)), []
+
+    added = load_feature_dataset(todo, root)
+    if dataset is not None:
+        stale = pd.MultiIndex.from_frame(dataset[['Year', 'Round']]).isin(todo)
+        dataset = pd.concat([dataset[~stale], added], ignore_index=True)
+    else:
+        dataset = added
+    dataset = dataset.sort_values(['Year', 'Round'], kind='stable').reset_index(drop=True)
+
+    with replacing(path) as tmp_path:
+        pq.write_table(pa.Table.from_pandas(dataset, preserve_index=False), tmp_path)
+
+    for year, round_num in todo:
+        known[_race_key(year, round_num)] = os.path.getmtime(store_path(year, round_num, root))
+    write_text(os.path.join(root, MANIFEST_FILE), json.dumps({'races': dict(sorted(known.items()))}, indent=2))
+    return dataset, todo
+
+
+def load_stint_dataset(races=None, root=None):
+    # Stint tables of stored races with Year/Round columns, e.g. for degradation features in training
+    races = list_stored_races(root) if races is None else races
+    frames = []
+    for year, round_num in races:
+        stints = read_stints(year, round_num, root)
+        if stints is None:
+            continue
+        stints.insert(0, 'Round', int(round_num))
+        stints.insert(0, 'Year', int(year))
+        frames.append(stints)
+    if not frames:
+        return pd.DataFrame(columns=['Year', 'Round'] + STINT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_training_dataset(races=None, root=None):
+    # Feature rows for `races` (default: all stored) via dataset.parquet, appending as needed
+    dataset, _ = update_dataset(races, root)
+    if races is None:
+        return dataset
+    wanted = pd.MultiIndex.from_tuples([(int(y), int(r)) for y, r in races], names=['Year', 'Round'])
+    keep = pd.MultiIndex.from_frame(dataset[['Year', 'Round']]).isin(wanted)
+    return dataset[keep].reset_index(drop=True)
@@ -0,0 +1,31 @@
+import os
+
+# gunicorn -c gunicorn.conf.py app:app   (Linux/macOS; on Windows use serve.py)
+
+bind = os.environ.get('F1_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('F1_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('F1_THREADS', 16))
+
+# Import pandas/fastf1/xgboost and app.py once in the master, shared copy-on-write by the workers
+preload_app = True
+
+timeout = 180  # A cold session.load can take a while
+graceful_timeout = 30
+
+
+def when_ready(server):
+    # app.py defers its heavy imports; the master finishes them before the first fork
+    import app
+    app.preload()
+
+
+def post_fork(server, worker):
+    # The registry watcher and the load pool are per worker; models come from the master
+    import app
+    app.init_worker()
+
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown()
@@ -0,0 +1,285 @@
+import json
+import os
+import threading
+from contextlib import nullcontext
+
+import numpy as np
+
+from atomic_io import replacing
+
+# Fast inference path: features go straight into a preallocated float32 matrix and are
+# scored with Booster.inplace_predict, skipping the DataFrame build and the sklearn wrapper.
+# Results are identical to XGBRegressor.predict on the equivalent DataFrame.
+# Importing xgboost also imports sklearn and scipy (over a second), so a fresh process scores
+# with TreeArrays, the same trees memory-mapped as flat numpy arrays, until the Booster has
+# loaded in the background. Neither this module nor its imports touch pandas.
+
+NATIVE_MODEL_FILE = 'model.ubj'
+TREES_DIR = 'trees'
+TREES_MAX_ROWS = 2000  # Larger matrices wait for the Booster; numpy is ~7x slower on those
+
+# Map tyre compounds to numeric (also exported by features.py)
+# Soft=1, Medium=2, Hard=3, Intermediate=4, Wet=5
+COMPOUND_MAP = {
+    'SOFT': 1, 'MEDIUM': 2, 'HARD': 3,
+    'INTERMEDIATE': 4, 'WET': 5,
+    'UNKNOWN': 2  # Default to medium
+}
+
+
+def compound_code(compound):
+    return COMPOUND_MAP.get(str(compound).upper(), 2)
+
+
+def _request_columns(drivers_input, is_wet):
+    return {
+        'GridPosition': [d['grid'] for d in drivers_input],
+        'StartCompound': [compound_code(d['start_compound']) for d in drivers_input],
+        'Stops': [int(d['stops']) for d in drivers_input],
+        'PaceDelta': [d['pace_delta'] for d in drivers_input],
+        'Consistency': [d['consistency'] for d in drivers_input],
+        'IsWet': [is_wet] * len(drivers_input),
+    }
+
+
+def feature_matrix(drivers_input, is_wet, model_features, out=None):
+    # (drivers x features) float32 matrix in model_features order, written into `out` if given
+    columns = _request_columns(drivers_input, is_wet)
+    n = len(drivers_input)
+    if out is None:
+        out = np.empty((n, len(model_features)), dtype=np.float32)
+    for j, name in enumerate(model_features):
+        out[:n, j] = columns[name]
+    return out[:n]
+
+
+def batch_feature_matrix(scenarios, model_features):
+    # Stack several grids [(drivers_input, is_wet), ...] into one matrix; offsets[i]:offsets[i+1]
+    # are the rows of scenario i. Each feature is gathered over all rows at once, as for one grid.
+    sizes = [len(drivers_input) for drivers_input, _ in scenarios]
+    offsets = np.zeros(len(scenarios) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(sizes)
+    drivers = [d for drivers_input, _ in scenarios for d in drivers_input]
+    columns = _request_columns(drivers, 0)
+    columns['IsWet'] = np.repeat([is_wet for _, is_wet in scenarios], sizes)
+    X = np.empty((len(drivers), len(model_features)), dtype=np.float32)
+    for j, name in enumerate(model_features):
+        X[:, j] = columns[name]
+    return X, offsets
+
+
+class TreeArrays:
+    # A gbtree regression model as flat node arrays (all trees concatenated), scored with numpy.
+    # Leaves point back at themselves, so every row takes exactly `depth` steps down each tree.
+    # Saved as one .npy per array plus meta.json in <version>/trees/, loaded memory-mapped.
+    ARRAYS = ('feature', 'threshold', 'left', 'right', 'default_left', 'value', 'roots')
+
+    def __init__(self, arrays, base_score, depth):
+        self.arrays = arrays
+        self.base_score = base_score
+        self.depth = depth
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def from_booster(cls, booster, iteration_range=(0, 0)):
+        # ValueError for models this evaluator does not cover (other objectives, categorical splits)
+        learner = json.loads(booster.save_raw('json'))['learner']
+        if learner['objective']['name'] != 'reg:squarederror':
+            raise ValueError(f"Unsupported objective {learner['objective']['name']}")
+        if learner['gradient_booster']['name'] != 'gbtree':
+            raise ValueError(f"Unsupported booster {learner['gradient_booster']['name']}")
+        model = learner['gradient_booster']['model']
+        indptr = model['iteration_indptr']
+        start, end = iteration_range
+        trees = model['trees'][indptr[start]:indptr[end or len(indptr) - 1]]
+
+        columns = {name: [] for name in cls.ARRAYS}
+        offset = depth = 0
+        for tree in trees:
+            if any(tree['split_type']):
+                raise ValueError("Categorical splits are not supported")
+            left = np.asarray(tree['left_children'], dtype=np.int32)
+            right = np.asarray(tree['right_children'], dtype=np.int32)
+            node = np.arange(len(left), dtype=np.int32)
+            leaf = left < 0
+            columns['feature'].append(np.where(leaf, 0, tree['split_indices']))
+            columns['threshold'].append(np.asarray(tree['split_conditions'], dtype=np.float32))
+            columns['left'].append(np.where(leaf, node, left) + offset)
+            columns['right'].append(np.where(leaf, node, right) + offset)
+            columns['default_left'].append(np.asarray(tree['default_left'], dtype=bool))
+            columns['value'].append(np.where(leaf, tree['split_conditions'], 0.0))
+            columns['roots'].append([offset])
+            depth = max(depth, _tree_depth(tree['parents']))
+            offset += len(left)
+
+        dtypes = {'feature': np.int32, 'threshold': np.float32, 'left': np.int32, 'right': np.int32,
+                  'default_left': bool, 'value': np.float32, 'roots': np.int32}
+        arrays = {name: np.concatenate(parts).astype(dtypes[name]) if parts else np.empty(0, dtypes[name])
+                  for name, parts in columns.items()}
+        base_score = float(str(learner['learner_model_param']['base_score']).strip('[]'))
+        return cls(arrays, base_score, depth)
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(len(X))[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.depth):
+            x = X[rows, self.feature[node]]
+            go_left = np.where(np.isnan(x), self.default_left[node], x < self.threshold[node])
+            node = np.where(go_left, self.left[node], self.right[node])
+        # Base score first, then tree by tree in float32: the same additions XGBoost makes, so the
+        # predictions are bit-identical (cumsum adds sequentially, sum() would not)
+        leaves = np.empty((len(X), len(self.roots) + 1), dtype=np.float32)
+        leaves[:, 0] = self.base_score
+        leaves[:, 1:] = self.value[node]
+        return np.cumsum(leaves, axis=1)[:, -1]
+
+    def save(self, path):
+        # Renamed in whole, so a reader never sees half of it
+        with replacing(path) as tmp_path:
+            os.makedirs(tmp_path)
+            for name in self.ARRAYS:
+                np.save(os.path.join(tmp_path, f"{name}.npy"), self.arrays[name])
+            with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+                json.dump({'base_score': self.base_score, 'depth': self.depth}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r' if mmap else None)
+                  for name in cls.ARRAYS}
+        return cls(arrays, meta['base_score'], meta['depth'])
+
+
+def _tree_depth(parents):
+    depth = [0] * len(parents)
+    for node, parent in enumerate(parents):
+        if node and 0 <= parent < len(parents):
+            depth[node] = depth[parent] + 1
+    return max(depth, default=0)
+
+
+def _iteration_range(booster):
+    # Match XGBRegressor.predict, which stops at best_iteration after early stopping
+    best = getattr(booster, 'best_iteration', None)
+    return (0, int(best) + 1) if best is not None else (0, 0)
+
+
+_xgboost_lock = threading.Lock()
+
+
+def import_xgboost():
+    # One thread at a time: importing xgboost from two threads at once (the background Booster
+    # load and an unpickle, say) can fail half way through its package init
+    with _xgboost_lock:
+        import xgboost
+    return xgboost
+
+
+def _load_booster(path):
+    booster = import_xgboost().Booster()
+    booster.load_model(path)
+    return booster
+
+
+class NativePredictor:
+    def __init__(self, booster, features, trees=None):
+        self.booster = booster
+        self.features = list(features)
+        self.trees = trees
+        self.iteration_range = _iteration_range(booster) if booster is not None else (0, 0)
+        self.booster_ready = threading.Event()
+        if booster is not None:
+            self.booster_ready.set()
+        self._local = threading.local()
+
+    @classmethod
+    def from_file(cls, path, features, background=True):
+        # With saved tree arrays the Booster loads on a background thread (background=True) and
+        # requests are scored from the arrays meanwhile. Versions saved before tree arrays existed
+        # load the Booster now and get their arrays written for next time.
+        trees_path = os.path.join(os.path.dirname(path), TREES_DIR)
+        if os.path.exists(os.path.join(trees_path, 'meta.json')):
+            predictor = cls(None, features, TreeArrays.load(trees_path))
+            if background:
+                threading.Thread(target=predictor._load_booster_background, args=(path,),
+                                 name='booster-load', daemon=True).start()
+            else:
+                predictor._load_booster(path)
+            return predictor
+
+        booster = _load_booster(path)
+        try:
+            TreeArrays.from_booster(booster, _iteration_range(booster)).save(trees_path)
+        except (OSError, ValueError):
+            pass  # Read-only registry or a model TreeArrays can't express: Booster only
+        return cls(booster, features)
+
+    @classmethod
+    def from_sklearn(cls, model, features):
+        return cls(model.get_booster(), features)
+
+    def _load_booster(self, path):
+        booster = _load_booster(path)
+        self.iteration_range = _iteration_range(booster)
+        self.booster = booster
+        self.booster_ready.set()
+
+    def _load_booster_background(self, path):
+        try:
+            self._load_booster(path)
+        except Exception as e:
+            print(f"Booster load failed, scoring with tree arrays only: {e}")
+            self.booster_ready.set()
+
+    def _buffer(self, n_rows):
+        # One reusable matrix per thread; requests run concurrently under a threaded server
+        buf = getattr(self._local, 'buf', None)
+        if buf is None or buf.shape[0] < n_rows:
+            buf = np.empty((max(n_rows, 32), len(self.features)), dtype=np.float32)
+            self._local.buf = buf
+        return buf
+
+    def predict_matrix(self, X):
+        booster = self.booster
+        if booster is None and len(X) > TREES_MAX_ROWS:
+            self.booster_ready.wait()
+            booster = self.booster
+        if booster is None:
+            return self.trees.predict(X)
+        return booster.inplace_predict(
+            X, iteration_range=self.iteration_range, validate_features=False
+        )
+
+    def matrix(self, drivers_input, is_wet):
+        # Valid until this thread's next call
+        return feature_matrix(drivers_input, is_wet, self.features, out=self._buffer(len(drivers_input)))
+
+    def predict(self, drivers_input, is_wet):
+        return self.predict_matrix(self.matrix(drivers_input, is_wet))
+
+    def predict_batch(self, scenarios, stage=None, prepare=None):
+        # One model call for every row of every scenario: stacked predictions plus the offsets
+        # that split them per scenario (preds[offsets[i]:offsets[i + 1]]).
+        # prepare(X) may adjust the stacked matrix in place first (app.py rounds it like /predict).
+        stage = stage or (lambda name: nullcontext())
+        with stage('feature_matrix'):
+            X, offsets = batch_feature_matrix(scenarios, self.features)
+            if prepare is not None:
+                X = prepare(X)
+        with stage('model_predict'):
+            preds = self.predict_matrix(X) if len(X) else np.empty(0, dtype=np.float32)
+        return preds, offsets
+
+
+def save_native(model, path):
+    # model.ubj plus its tree arrays next to it (skipped for models TreeArrays can't express)
+    booster = model.get_booster()
+    booster.save_model(path)
+    try:
+        TreeArrays.from_booster(booster, _iteration_range(booster)).save(
+            os.path.join(os.path.dirname(path), TREES_DIR))
+    except ValueError:
+        pass
@@ -0,0 +1,147 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import fastf1
+import pandas as pd
+
+from compact_laps import CompactSession, compact_path
+from features import extract_race_features, has_race_features, stint_table, write_race_features, write_stints
+from race_index import compound_colors
+
+# Builds the feature store for a set of seasons/rounds in a pool of worker processes.
+# Races already in the store are skipped, so an interrupted rebuild resumes where it stopped.
+
+CACHE_DIR = 'cache'
+
+
+def parse_rounds(spec):
+    # "1-5,8,10" -> [1, 2, 3, 4, 5, 8, 10]; empty/None means every round
+    if not spec:
+        return None
+    rounds = set()
+    for part in str(spec).split(','):
+        part = part.strip()
+        if '-' in part:
+            lo, hi = part.split('-', 1)
+            rounds.update(range(int(lo), int(hi) + 1))
+        elif part:
+            rounds.add(int(part))
+    return sorted(rounds)
+
+
+def enable_cache(cache_dir=CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    fastf1.Cache.enable_cache(cache_dir)
+
+
+def race_targets(seasons, rounds=None):
+    # Schedules are fetched here in the parent, so workers only ever request their own session
+    targets = []
+    now = pd.Timestamp.now()
+    for year in seasons:
+        schedule = fastf1.get_event_schedule(year)
+        races = schedule[schedule['EventFormat'] == 'conventional'] # Stick to conventional for simplicity
+        races = races[races['EventDate'] <= now]  # Completed races only
+        for _, event in races.iterrows():
+            round_num = int(event['RoundNumber'])
+            if rounds is None or round_num in rounds:
+                targets.append((int(year), round_num, event['EventName']))
+    return targets
+
+
+def _init_worker(cache_dir):
+    # Each worker opens its own handle on the shared cache directory
+    enable_cache(cache_dir)
+    fastf1.set_log_level('WARNING')
+
+
+def store_race(year, round_num, session):
+    # Everything after session.load(): features and stint table into the feature store
+    df, event = extract_race_features(session)
+    write_stints(year, round_num, stint_table(session.laps, session.drivers), colors=compound_colors(session))
+    write_race_features(year, round_num, df, event)
+    return df
+
+
+def ingest_race(year, round_num, event_name=''):
+    report = {'year': year, 'round': round_num, 'event': event_name, 'pid': os.getpid()}
+    start = time.perf_counter()
+    try:
+        session = fastf1.get_session(year, round_num, 'R')
+        session.load(telemetry=False, weather=False, messages=False)
+        report['load_s'] = time.perf_counter() - start
+
+        if len(session.laps) == 0:
+            report['status'] = 'empty'
+        else:
+            t = time.perf_counter()
+            # Features come from the compact lap table the API will memory-map later
+            session = CompactSession.from_session(session)
+            session.save(compact_path(year, round_num))
+            df = store_race(year, round_num, session)
+            report['features_s'] = time.perf_counter() - t
+            report['drivers'] = len(df)
+            report['status'] = 'ok'
+    except Exception as e:
+        report['status'] = 'error'
+        report['error'] = f"{type(e).__name__}: {e}"
+    report['total_s'] = time.perf_counter() - start
+    return report
+
+
+def _print_report(r):
+    if r['status'] == 'ok':
+        print(f"  {r['year']} R{r['round']:02d} {r['event']:<28} ok    "
+              f"load {r['load_s']:6.2f}s  features {r['features_s']:5.2f}s  total {r['total_s']:6.2f}s")
+    else:
+        print(f"  {r['year']} R{r['round']:02d} {r['event']:<28} {r['status']:<5} "
+              f"total {r['total_s']:6.2f}s  {r.get('error', '')}")
+
+
+def ingest(seasons, rounds=None, workers=None, cache_dir=CACHE_DIR, force=False):
+    enable_cache(cache_dir)
+    return ingest_targets(race_targets(seasons, rounds), workers, cache_dir, force)
+
+
+def ingest_targets(targets, workers=None, cache_dir=CACHE_DIR, force=False):
+    todo = [t for t in targets if force or not has_race_features(t[0], t[1])]
+    print(f"{len(targets)} races selected, {len(targets) - len(todo)} already in feature store, "
+          f"{len(todo)} to ingest.")
+    if not todo:
+        return []
+
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, len(todo)))
+    reports = []
+    start = time.perf_counter()
+
+    if workers == 1:
+        for target in todo:
+            reports.append(ingest_race(*target))
+            _print_report(reports[-1])
+    else:
+        # spawn, not fork: the parent already holds the FastF1 HTTP cache (SQLite) open
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                 initializer=_init_worker, initargs=(cache_dir,)) as pool:
+            futures = [pool.submit(ingest_race, *target) for target in todo]
+            for future in as_completed(futures):
+                reports.append(future.result())
+                _print_report(reports[-1])
+
+        # Concurrent writers can still trip over the shared HTTP cache; retry those serially
+        retry = [r for r in reports if r['status'] == 'error']
+        for r in retry:
+            print(f"  Retrying {r['year']} R{r['round']:02d} serially...")
+            reports.remove(r)
+            reports.append(ingest_race(r['year'], r['round'], r['event']))
+            _print_report(reports[-1])
+
+    wall = time.perf_counter() - start
+    busy = sum(r['total_s'] for r in reports)
+    ok = sum(r['status'] == 'ok' for r in reports)
+    print(f"Ingested {ok}/{len(reports)} races in {wall:.1f}s wall "
+          f"({busy:.1f}s of session work, {workers} workers).")
+    return reports
@@ -0,0 +1,137 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+# Minimal Prometheus text-format metrics (no client library needed) plus per-request
+# stage timing. render() output is served at /metrics.
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_metrics = []
+_collectors = []
+
+
+def _label_str(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        le_names = self.labelnames + ('le',)
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_label_str(le_names, labels + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_label_str(le_names, labels + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_label_str(self.labelnames, labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_label_str(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+def register_collector(fn):
+    # fn() -> iterable of (name, type, help, [(labels dict, value), ...]) read at scrape time
+    _collectors.append(fn)
+    return fn
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        for name, kind, help_text, samples in collect():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_label_str(tuple(labels), tuple(labels.values()))} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_SECONDS = Histogram(
+    'f1_request_duration_seconds', 'End-to-end request latency', ('endpoint', 'method', 'status'))
+STAGE_SECONDS = Histogram(
+    'f1_stage_duration_seconds', 'Time spent per request stage', ('endpoint', 'stage'))
+MOCK_FALLBACKS = Counter(
+    'f1_mock_fallbacks_total', 'Responses that fell back to mock data', ('endpoint', 'reason'))
+STREAM_FIRST_EVENT_SECONDS = Histogram(
+    'f1_stream_first_event_seconds', 'Request start to first streamed event', ('endpoint',))
+STREAM_EVENTS = Counter(
+    'f1_stream_events_total', 'Events sent on streaming responses', ('endpoint', 'event'))
+STREAMS_CANCELLED = Counter(
+    'f1_streams_cancelled_total', 'Streams closed by the client before the final event', ('endpoint',))
+
+
+@contextmanager
+def stage(name):
+    # Times a block into STAGE_SECONDS and into this request's breakdown (see X-Profile)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if has_request_context():
+            STAGE_SECONDS.observe((request.endpoint or 'unknown', name), elapsed)
+            stages = g.setdefault('stages', {})
+            stages[name] = stages.get(name, 0.0) + elapsed
+        else:
+            STAGE_SECONDS.observe(('background', name), elapsed)
+
+
+def server_timing(stages, total):
+    # Server-Timing header value, readable in browser dev tools
+    parts = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in stages.items()]
+    parts.append(f"total;dur={total * 1000:.3f}")
+    return ', '.join(parts)
@@ -0,0 +1,338 @@
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from atomic_io import replacing, write_text
+from inference import NATIVE_MODEL_FILE, NativePredictor, import_xgboost, save_native
+
+# Versioned model artifacts:
+#   models/<version>/model.pkl + model.ubj (native XGBoost format) + trees/ + meta.json
+#   models/CURRENT        -> name of the version /predict uses by default
+#   models/ROUTING.json   -> optional A/B split, e.g. {"v0003": 0.9, "v0004": 0.1}
+# The server swaps to a new CURRENT without a restart; requests already running keep
+# the LoadedModel they started with.
+
+# Next to this file unless F1_MODEL_DIR says otherwise, so the server finds its models whatever
+# directory it is started from
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+REGISTRY_DIR = os.environ.get('F1_MODEL_DIR', os.path.join(BACKEND_DIR, 'models'))
+
+# Pre-registry artifacts written by older train.py versions
+LEGACY_MODEL_PATH = os.path.join(BACKEND_DIR, 'f1_model.pkl')
+LEGACY_FEATURES_PATH = os.path.join(BACKEND_DIR, 'model_features.pkl')
+LEGACY_VERSION = 'legacy'
+
+
+def _load_pickle(path):
+    import joblib  # With the sklearn model it unpickles, only needed by train.py and legacy models
+
+    import_xgboost()  # Not alongside a background Booster load
+    return joblib.load(path)
+
+
+def model_nbytes(model):
+    # Serialized booster size; a good proxy for the trees held in memory
+    try:
+        return len(model.get_booster().save_raw())
+    except Exception:
+        return None
+
+
+class LoadedModel:
+    def __init__(self, version, model, features, meta, load_seconds, native=None, nbytes=None):
+        # `model` is the XGBRegressor, or a function returning it when unpickled on first use:
+        # serving only needs `native`, so the API never imports sklearn for it
+        self.version = version
+        self._model = None if callable(model) else model
+        self._load_model = model if callable(model) else None
+        self._model_lock = threading.Lock()
+        self.features = features
+        self.meta = meta
+        self.load_seconds = load_seconds
+        self.nbytes = nbytes if nbytes is not None else model_nbytes(self.model)
+        # Booster-level predictor used by the API; falls back to the pickled model's booster
+        self.native = native or NativePredictor.from_sklearn(self.model, features)
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._load_model()
+        return self._model
+
+    def info(self):
+        return {
+            'version': self.version,
+            'load_ms': self.load_seconds * 1000,
+            'model_bytes': self.nbytes,
+            # False until the background XGBoost load finishes (tree arrays score meanwhile)
+            'booster_loaded': self.native.booster is not None,
+            **self.meta
+        }
+
+
+def list_versions(root=None):
+    root = root or REGISTRY_DIR
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if not name.startswith('.') and os.path.exists(os.path.join(root, name, 'meta.json'))
+    )
+
+
+def save_version(model, features, meta=None, activate=True, root=None):
+    import joblib
+
+    root = root or REGISTRY_DIR
+    os.makedirs(root, exist_ok=True)
+    existing = [int(v[1:]) for v in list_versions(root) if v[1:].isdigit()]
+    version = f"v{max(existing, default=0) + 1:04d}"
+
+    meta = {
+        'version': version,
+        'features': list(features),
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        **(meta or {})
+    }
+
+    # Renamed in whole, so readers never see half a version; never over one saved meanwhile
+    with replacing(os.path.join(root, version), overwrite=False) as tmp_dir:
+        os.makedirs(tmp_dir)
+        joblib.dump(model, os.path.join(tmp_dir, 'model.pkl'))
+        save_native(model, os.path.join(tmp_dir, NATIVE_MODEL_FILE))
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    if activate:
+        set_current(version, root)
+    return version
+
+
+def set_current(version, root=None):
+    root = root or REGISTRY_DIR
+    if version not in list_versions(root):
+        raise KeyError(f"Unknown model version {version}")
+    write_text(os.path.join(root, 'CURRENT'), version + '\n')
+
+
+def read_current(root=None):
+    root = root or REGISTRY_DIR
+    try:
+        with open(os.path.join(root, 'CURRENT')) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_version(version, root=None):
+    root = root or REGISTRY_DIR
+    start = time.perf_counter()
+    native = nbytes = None
+    if version == LEGACY_VERSION:
+        model = _load_pickle(LEGACY_MODEL_PATH)
+        features = _load_pickle(LEGACY_FEATURES_PATH)
+        meta = {'features': list(features), 'created_at': None}
+    else:
+        path = os.path.join(root, version)
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        features = meta['features']
+        model_path = os.path.join(path, 'model.pkl')
+        native_path = os.path.join(path, NATIVE_MODEL_FILE)
+        if os.path.exists(native_path):
+            # The API scores with the native model; the pickle waits until someone asks for .model
+            native = NativePredictor.from_file(native_path, features)
+            nbytes = os.path.getsize(native_path)
+            model = lambda: _load_pickle(model_path)
+        else:
+            model = _load_pickle(model_path)
+    return LoadedModel(version, model, features, meta, time.perf_counter() - start, native, nbytes)
+
+
+class ModelRegistry:
+    def __init__(self, root=None, max_loaded=4):
+        self.root = root or REGISTRY_DIR
+        self.max_loaded = max_loaded
+
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = {}  # version -> LoadedModel
+        self._current = None
+        self._routing = {}
+        self._watch_state = None
+        self._watcher = None
+        self._stop = threading.Event()
+
+        self.last_swap = None
+        self.loaded_in_pid = os.getpid()
+
+    # --- lookups used per request ---
+
+    def current(self):
+        return self._current
+
+    def get(self, version=None, routing_key=None):
+        # Pinned version > A/B routing > CURRENT
+        if version:
+            return self._get_or_load(str(version))
+        routing = self._routing
+        if routing:
+            return self._get_or_load(self._pick_routed(routing, routing_key))
+        return self._current
+
+    def _pick_routed(self, routing, routing_key):
+        # Same key always lands on the same arm; no key means a random split
+        if routing_key is None:
+            point = random.random()
+        else:
+            point = (zlib.crc32(str(routing_key).encode()) % 10000) / 10000
+        total = sum(routing.values())
+        acc = 0.0
+        for version, weight in routing.items():
+            acc += weight / total
+            if point < acc:
+                return version
+        return version
+
+    def _get_or_load(self, version):
+        loaded = self._loaded.get(version)
+        if loaded is not None:
+            return loaded
+        if version == LEGACY_VERSION:
+            if not os.path.exists(LEGACY_MODEL_PATH):
+                raise KeyError(f"No legacy model at {LEGACY_MODEL_PATH}")
+        elif version not in list_versions(self.root):
+            raise KeyError(f"Unknown model version {version}")
+        with self._load_lock:
+            loaded = self._loaded.get(version)
+            if loaded is None:
+                loaded = load_version(version, self.root)
+                self._remember(loaded)
+        return loaded
+
+    def _remember(self, loaded):
+        with self._lock:
+            loaded_now = dict(self._loaded)
+            loaded_now[loaded.version] = loaded
+            # Keep CURRENT and routed versions, drop the oldest of the rest
+            keep = {loaded.version, *self._routing}
+            if self._current is not None:
+                keep.add(self._current.version)
+            for version in list(loaded_now):
+                if len(loaded_now) <= self.max_loaded:
+                    break
+                if version not in keep:
+                    del loaded_now[version]
+            self._loaded = loaded_now  # Readers see either the old or the new dict
+
+    # --- swapping ---
+
+    def reload(self):
+        # Point CURRENT at whatever the registry says now; returns True if it changed
+        version = read_current(self.root)
+        if version is None and os.path.exists(LEGACY_MODEL_PATH):
+            version = LEGACY_VERSION
+
+        self._routing = self._read_routing()
+        if version is None:
+            return False
+        if self._current is not None and self._current.version == version:
+            return False
+
+        start = time.perf_counter()
+        loaded = self._get_or_load(version)  # Heavy part happens before the swap
+        with self._lock:
+            previous = self._current
+            self._current = loaded
+        self.last_swap = {
+            'from': previous.version if previous else None,
+            'to': version,
+            'load_ms': loaded.load_seconds * 1000,
+            'swap_ms': (time.perf_counter() - start) * 1000,
+            'at': datetime.now(timezone.utc).isoformat(timespec='seconds')
+        }
+        print(f"Model {version} loaded ({self.last_swap['swap_ms']:.1f} ms).")
+        return True
+
+    def activate(self, version):
+        set_current(version, self.root)
+        return self.reload()
+
+    def _read_routing(self):
+        try:
+            with open(os.path.join(self.root, 'ROUTING.json')) as f:
+                routing = {str(k): float(v) for k, v in json.load(f).items() if float(v) > 0}
+        except (FileNotFoundError, ValueError):
+            return {}
+        known = set(list_versions(self.root))
+        return {k: v for k, v in routing.items() if k in known}
+
+    def _registry_state(self):
+        state = []
+        for name in ('CURRENT', 'ROUTING.json'):
+            try:
+                state.append(os.stat(os.path.join(self.root, name)).st_mtime_ns)
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def after_fork(self):
+        # Keep the models loaded before the fork, shared copy-on-write. The watcher thread did not
+        # survive it; a Booster still loading in the parent lost its thread too, so that case is
+        # left to reset() and a fresh load (returns False).
+        if not all(loaded.native.booster_ready.is_set() for loaded in self._loaded.values()):
+            return False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+        self.loaded_in_pid = os.getpid()
+        return True
+
+    def reset(self):
+        # Forget every loaded model (used after a fork, before loading again)
+        with self._lock:
+            self._loaded = {}
+            self._current = None
+        self._watcher = None
+        self._stop = threading.Event()
+        self.loaded_in_pid = os.getpid()
+
+    def start_watcher(self, interval=5.0):
+        # Polls CURRENT/ROUTING.json so a finished train.py run is picked up without a restart
+        if self._watcher is not None or interval <= 0:
+            return
+        self._watch_state = self._registry_state()
+
+        def watch():
+            while not self._stop.wait(interval):
+                state = self._registry_state()
+                if state != self._watch_state:
+                    self._watch_state = state
+                    try:
+                        self.reload()
+                    except Exception as e:
+                        print(f"Model reload failed: {e}")
+
+        self._watcher = threading.Thread(target=watch, name='model-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+
+    def info(self):
+        loaded = self._loaded
+        return {
+            'current': self._current.version if self._current else None,
+            'routing': self._routing,
+            'versions': list_versions(self.root),
+            'loaded': [m.info() for m in loaded.values()],
+            'loaded_bytes': sum(m.nbytes or 0 for m in loaded.values()),
+            'last_swap': self.last_swap
+        }
@@ -0,0 +1,172 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Memoization in front of /predict inference.
+# Tweaking one driver in the UI and re-running repeats the previous request almost exactly, so
+# results are cached per canonical request and predictions per canonical feature row:
+# - canonical form: the request's float32 feature matrix (compounds already mapped through
+#   COMPOUND_MAP by inference.feature_matrix), float features rounded to `decimals`, plus the
+#   driver codes/grid slots echoed in the response and the model version
+# - a repeated request returns the stored ranked result without touching the model
+# - a changed request predicts only the rows not seen before under the same model version
+# Predictions are always made on the rounded features, so a cached answer is the same one a
+# fresh call would give.
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_ROWS = 100000
+DEFAULT_TTL = 300  # seconds
+DEFAULT_DECIMALS = 3
+ROUNDED_FEATURES = ('PaceDelta', 'Consistency')
+
+
+class PredictCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_rows=DEFAULT_MAX_ROWS,
+                 ttl=DEFAULT_TTL, decimals=DEFAULT_DECIMALS, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.decimals = decimals
+        self.clock = clock
+
+        self._results = OrderedDict()  # request key -> (expires, result)
+        self._rows = OrderedDict()     # (version, row bytes) -> (expires, prediction)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.rows_reused = 0
+        self.rows_predicted = 0
+        self.seconds_saved = 0.0
+        # Running average cost of a computed request; a hit saves that minus its own lookup
+        self._miss_seconds = None
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def canonical(self, X, features):
+        # Rounds the float feature columns of X in place and returns it
+        for j, name in enumerate(features):
+            if name in ROUNDED_FEATURES:
+                X[:, j] = np.round(X[:, j], self.decimals)
+        return X
+
+    def key(self, version, X, drivers_input, is_wet):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(str(version).encode())
+        h.update(b'\x00wet' if is_wet else b'\x00dry')
+        h.update(np.ascontiguousarray(X, dtype=np.float32).tobytes())
+        for d in drivers_input:
+            h.update(f"\x1f{d['code']}\x1e{d['grid']}".encode())
+        return h.hexdigest()
+
+    def _get(self, table, key, now):
+        entry = table.get(key)
+        if entry is None:
+            return None
+        if entry[0] < now:
+            del table[key]
+            self.expired += 1
+            return None
+        table.move_to_end(key)
+        return entry[1]
+
+    def _put(self, table, key, value, now, limit):
+        table[key] = (now + self.ttl, value)
+        table.move_to_end(key)
+        while len(table) > limit:
+            table.popitem(last=False)
+
+    def get(self, key, lookup_start=None):
+        # Stored result for a canonical request, or None. lookup_start (perf_counter at the start
+        # of the request) lets a hit count the time it saved against the average miss.
+        if not self.enabled:
+            return None
+        with self._lock:
+            result = self._get(self._results, key, self.clock())
+            if result is None:
+                return None
+            self.hits += 1
+            if lookup_start is not None and self._miss_seconds is not None:
+                self.seconds_saved += max(0.0, self._miss_seconds - (time.perf_counter() - lookup_start))
+        return result
+
+    def predict_rows(self, version, X, predict):
+        # (per-row predictions for X, rows reused), calling predict() only on rows not cached
+        # for this model version
+        if not self.enabled:
+            return predict(X), 0
+        now = self.clock()
+        keys = [(version, row.tobytes()) for row in X]
+        preds = np.empty(len(X), dtype=np.float32)
+        with self._lock:
+            missing = []
+            for i, key in enumerate(keys):
+                pred = self._get(self._rows, key, now)
+                if pred is None:
+                    missing.append(i)
+                else:
+                    preds[i] = pred
+
+        fresh = ()
+        if missing:
+            fresh = predict(X[missing])
+            preds[missing] = fresh
+        with self._lock:
+            reused = len(X) - len(missing)
+            # A new request: partial when some of its rows were already predicted
+            if reused:
+                self.partial_hits += 1
+            else:
+                self.misses += 1
+            for i, pred in zip(missing, fresh):
+                self._put(self._rows, keys[i], float(pred), now, self.max_rows)
+            self.rows_reused += reused
+            self.rows_predicted += len(missing)
+        return preds, reused
+
+    def put(self, key, result, seconds):
+        # Stores a computed result; `seconds` is what computing it cost (from the same start as
+        # get()'s lookup_start)
+        if not self.enabled:
+            return
+        with self._lock:
+            self._put(self._results, key, result, self.clock(), self.max_entries)
+            self._miss_seconds = _average(self._miss_seconds, seconds)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._rows.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.partial_hits + self.misses
+            rows = self.rows_reused + self.rows_predicted
+            return {
+                'entries': len(self._results),
+                'rows': len(self._rows),
+                'max_entries': self.max_entries,
+                'max_rows': self.max_rows,
+                'ttl': self.ttl,
+                'decimals': self.decimals,
+                'hits': self.hits,
+                'partial_hits': self.partial_hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'hit_ratio': (self.hits / lookups) if lookups else 0.0,
+                'rows_reused': self.rows_reused,
+                'rows_predicted': self.rows_predicted,
+                'row_hit_ratio': (self.rows_reused / rows) if rows else 0.0,
+                'seconds_saved': self.seconds_saved,
+            }
+
+
+def _average(current, value, weight=0.1):
+    return value if current is None else (1 - weight) * current + weight * value
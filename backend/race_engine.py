@@ -0,0 +1,502 @@
+import json
+import os
+import time
+
+import numpy as np
+
+# Lap-by-lap race engine. The whole field advances one lap at a time as NumPy arrays of
+# (replicas x cars) state: cumulative time, compound, tyre age and stint. Lap times come from
+# the driver's pace plus a per-compound degradation model fitted on historical stints
+# (features.fit_tyre_model); pit stops cost pit_loss; a car that catches the one ahead only
+# gets past when it is quick enough, otherwise it is held up behind it.
+# race_report() turns one representative replica into the /predict response shape, with
+# overtakes, pit stops and radio taken from that race.
+
+POINTS = {1: 25, 2: 18, 3: 15, 4: 12, 5: 10, 6: 8, 7: 6, 8: 4, 9: 2, 10: 1}
+
+COMPOUNDS = ['SOFT', 'MEDIUM', 'HARD', 'INTERMEDIATE', 'WET']
+
+# Used where no race (or too few laps) was available to fit from
+DEFAULT_TYRE_MODEL = {
+    'base_lap': 92.0,
+    'fuel_per_lap': -0.06,
+    'pit_loss': 22.0,
+    'laps': 57,
+    'compounds': {
+        'SOFT': {'offset': -0.6, 'slope': 0.09},
+        'MEDIUM': {'offset': 0.0, 'slope': 0.06},
+        'HARD': {'offset': 0.4, 'slope': 0.035},
+        'INTERMEDIATE': {'offset': 0.0, 'slope': 0.05},
+        'WET': {'offset': 3.0, 'slope': 0.03},
+    }
+}
+
+DEFAULT_RACE_PARAMS = {
+    'grid_gap': 0.25,        # s between grid slots at lights out
+    'start_sd': 0.4,         # s of launch variation
+    'pit_window': 3,         # planned stop lap +/- this many laps
+    'follow_gap': 0.4,       # s a held-up car stays behind the one ahead
+    'pass_threshold': 0.6,   # s/lap pace advantage that gives a 50% chance to pass
+    'pass_scale': 0.25,      # how quickly that chance rises with the advantage
+    'wet_noise': 1.8,        # lap-time noise multiplier in the wet
+}
+
+MAX_RACE_SIMS = 5000
+
+
+def compound_name(compound):
+    name = str(compound).upper()
+    return name if name in COMPOUNDS else 'MEDIUM'
+
+
+def race_tyre_model(model):
+    # A single race's fit, with compounds it did not run filled from the defaults. Offsets are
+    # fitted against the race's most used compound; re-anchor them on MEDIUM (or that compound's
+    # default) so fits from different races line up.
+    if not model:
+        return DEFAULT_TYRE_MODEL
+    fitted = model['compounds']
+    anchor = 'MEDIUM' if 'MEDIUM' in fitted else min(fitted, key=lambda c: abs(fitted[c]['offset']))
+    shift = fitted[anchor]['offset'] - DEFAULT_TYRE_MODEL['compounds'][anchor]['offset']
+    compounds = {name: dict(default) for name, default in DEFAULT_TYRE_MODEL['compounds'].items()}
+    for name, fit in fitted.items():
+        compounds[name] = {'offset': fit['offset'] - shift, 'slope': fit['slope']}
+    return {
+        'base_lap': model.get('base_lap') or DEFAULT_TYRE_MODEL['base_lap'],
+        'fuel_per_lap': model.get('fuel_per_lap', DEFAULT_TYRE_MODEL['fuel_per_lap']),
+        'pit_loss': model.get('pit_loss') or DEFAULT_TYRE_MODEL['pit_loss'],
+        'laps': model.get('laps') or DEFAULT_TYRE_MODEL['laps'],
+        'compounds': compounds,
+    }
+
+
+def merge_tyre_models(models):
+    # Per-compound fits averaged over races, weighted by laps; the rest from DEFAULT_TYRE_MODEL
+    models = [m for m in models if m]
+    if not models:
+        return DEFAULT_TYRE_MODEL
+    merged = {key: DEFAULT_TYRE_MODEL[key] for key in ('base_lap', 'laps')}
+    for key in ('fuel_per_lap', 'pit_loss'):
+        values = [m[key] for m in models if m.get(key) is not None]
+        merged[key] = float(np.median(values)) if values else DEFAULT_TYRE_MODEL[key]
+
+    anchored = [race_tyre_model(m)['compounds'] for m in models]
+    compounds = {}
+    for name, default in DEFAULT_TYRE_MODEL['compounds'].items():
+        fits = [(a[name], m['compounds'][name]['laps'])
+                for a, m in zip(anchored, models) if name in m['compounds']]
+        if not fits:
+            compounds[name] = default
+            continue
+        weights = [laps for _, laps in fits]
+        compounds[name] = {
+            'offset': float(np.average([fit['offset'] for fit, _ in fits], weights=weights)),
+            'slope': float(np.average([fit['slope'] for fit, _ in fits], weights=weights)),
+        }
+    merged['compounds'] = compounds
+    return merged
+
+
+_pooled = {}
+
+
+def pooled_tyre_model(root=None):
+    # Degradation pooled over every race in the feature store (re-read when the store changes).
+    # The store (pandas, pyarrow) is imported here, not when app.py imports this module.
+    import pyarrow.parquet as pq
+
+    import features
+    from features import _EVENT_KEY, list_stored_races, store_path
+
+    root = root or features.FEATURE_STORE_DIR
+    races = list_stored_races(root)
+    key = (root, tuple(races), max((os.path.getmtime(store_path(y, r, root)) for y, r in races), default=0))
+    if key not in _pooled:
+        models = []
+        for year, round_num in races:
+            metadata = pq.read_schema(store_path(year, round_num, root)).metadata or {}
+            if _EVENT_KEY in metadata:
+                models.append(json.loads(metadata[_EVENT_KEY]).get('TyreModel'))
+        _pooled.clear()
+        _pooled[key] = merge_tyre_models(models)
+    return _pooled[key]
+
+
+def tyre_model_for(year=None, round_num=None, root=None):
+    # The race's own fit when it is in the store, else the pooled fit
+    if year is not None and round_num is not None:
+        from features import read_race_features
+
+        stored = read_race_features(year, round_num, root)
+        if stored is not None and stored[1].get('TyreModel'):
+            return race_tyre_model(stored[1]['TyreModel'])
+    return pooled_tyre_model(root)
+
+
+def _strategies(drivers_input, is_wet, n_laps):
+    # Compound per stint and planned pit laps for each car
+    stops = np.clip([int(d.get('stops', 1)) for d in drivers_input], 0, 4)
+    max_stops = int(stops.max()) if len(stops) else 0
+    sequence = np.empty((len(drivers_input), max_stops + 1), dtype=np.int64)
+    planned = np.full((len(drivers_input), max(max_stops, 1)), -1, dtype=np.int64)
+    for i, d in enumerate(drivers_input):
+        current = 'INTERMEDIATE' if is_wet else compound_name(d.get('start_compound'))
+        for k in range(max_stops + 1):
+            sequence[i, k] = COMPOUNDS.index(current)
+            if not is_wet:
+                # Dry races need a second compound: hards after softs/mediums, mediums after hards
+                current = 'MEDIUM' if current == 'HARD' else 'HARD'
+        for k in range(stops[i]):
+            planned[i, k] = round(n_laps * (k + 1) / (stops[i] + 1))
+    return sequence, planned, stops
+
+
+class RaceSim:
+    # One batch of replicas advanced a lap at a time: simulate_race() runs it to the flag,
+    # race_events() reports between laps and can stop early
+    def __init__(self, drivers_input, is_wet=False, tyre_model=None, n_sims=1000, laps=None,
+                 params=None, seed=None):
+        self.start = time.perf_counter()
+        self.tyre_model = tyre_model = tyre_model or DEFAULT_TYRE_MODEL
+        self.params = params = {**DEFAULT_RACE_PARAMS, **(params or {})}
+        self.rng = rng = np.random.default_rng(seed)
+        self.is_wet = bool(is_wet)
+        self.n_laps = n_laps = int(laps or tyre_model['laps'])
+        self.n_sims = R = n_sims
+        N = len(drivers_input)
+
+        self.grid = np.array([d['grid'] for d in drivers_input], dtype=np.float64)
+        self.pace = np.array([d.get('pace_delta', 0.0) for d in drivers_input], dtype=np.float64)
+        consistency = np.array([d.get('consistency', 0.3) for d in drivers_input], dtype=np.float64)
+        self.consistency = np.clip(consistency, 0.05, 3.0) * (params['wet_noise'] if is_wet else 1.0)
+
+        self.offset = np.array([tyre_model['compounds'].get(c, DEFAULT_TYRE_MODEL['compounds'][c])['offset'] for c in COMPOUNDS])
+        self.slope = np.array([tyre_model['compounds'].get(c, DEFAULT_TYRE_MODEL['compounds'][c])['slope'] for c in COMPOUNDS])
+
+        self.sequence, planned, self.stops = _strategies(drivers_input, is_wet, n_laps)
+        jitter = rng.integers(-params['pit_window'], params['pit_window'] + 1, (R,) + planned.shape)
+        self.pit_laps = np.where(planned >= 0, np.clip(planned + jitter, 2, n_laps - 1), -1)
+
+        # Per-car state across all replicas
+        grid_rank = np.argsort(np.argsort(self.grid))
+        self.cum = (grid_rank * params['grid_gap'])[None, :] + rng.normal(0, params['start_sd'], (R, N))
+        self.age = np.zeros((R, N))
+        self.stint = np.zeros((R, N), dtype=np.int64)
+
+        self.positions = np.empty((n_laps + 1, R, N), dtype=np.int16)
+        self.positions[0] = grid_rank[None, :]
+        self.best_lap = np.full((R, N), np.inf)
+        self.best_lap_no = np.zeros((R, N), dtype=np.int16)
+        self.lap = 0
+
+    @property
+    def done(self):
+        return self.lap >= self.n_laps
+
+    def step(self):
+        self.lap = lap = self.lap + 1
+        tm, params, rng = self.tyre_model, self.params, self.rng
+        R, N = self.cum.shape
+        rows, car_idx = np.arange(R), np.arange(N)[None, :]
+        cum = self.cum
+
+        self.age += 1
+        comp = self.sequence[car_idx, np.minimum(self.stint, self.sequence.shape[1] - 1)]
+        pitting = (self.pit_laps == lap).any(axis=-1)
+        lap_time = (tm['base_lap'] + self.pace + self.offset[comp] + self.slope[comp] * self.age
+                    + tm['fuel_per_lap'] * (lap - 1)
+                    + rng.normal(0, 1, (R, N)) * self.consistency
+                    + pitting * tm['pit_loss'])
+        new = cum + lap_time
+
+        # Front to back in last lap's order: a car that closes up on the one ahead passes with a
+        # probability rising with its pace advantage this lap, or is held up behind it
+        order = np.argsort(cum, axis=1)
+        u = rng.random((R, N))
+        for p in range(1, N):
+            car, ahead = order[:, p], order[:, p - 1]
+            t, t_ahead = new[rows, car], new[rows, ahead]
+            advantage = lap_time[rows, ahead] - lap_time[rows, car]
+            p_pass = 1.0 / (1.0 + np.exp(-(advantage - params['pass_threshold']) / params['pass_scale']))
+            held = (t < t_ahead + params['follow_gap']) & (u[:, p] >= p_pass)
+            new[rows, car] = np.where(held, t_ahead + params['follow_gap'], t)
+
+        actual = new - cum
+        faster = ~pitting & (actual < self.best_lap)
+        self.best_lap = np.where(faster, actual, self.best_lap)
+        self.best_lap_no = np.where(faster, lap, self.best_lap_no)
+
+        self.cum = new
+        self.positions[lap] = _ranks(new)
+        self.stint += pitting
+        self.age[pitting] = 0
+
+    def result(self, featured=None):
+        # Position distribution over all replicas; `featured` (default: the replica whose result
+        # sits closest to the expected order) is the race race_report() tells the story of
+        R, N = self.cum.shape
+        finish = self.positions[self.lap].astype(np.int64)  # 0-based position per replica and car
+        distribution = np.zeros((N, N))
+        np.add.at(distribution, (np.broadcast_to(np.arange(N)[None, :], (R, N)).ravel(), finish.ravel()), 1.0 / R)
+        expected = distribution @ np.arange(1, N + 1)
+        if featured is None:
+            featured = int(np.argmin(np.abs(finish + 1 - expected[None, :]).sum(axis=1)))
+
+        return {
+            'n_sims': R,
+            'laps': self.lap,
+            'is_wet': self.is_wet,
+            'expected_position': expected,
+            'distribution': distribution,
+            'featured': {
+                'positions': self.positions[:self.lap + 1, featured, :].astype(np.int64),
+                'pit_laps': self.pit_laps[featured],
+                'stops': self.stops,
+                'sequence': self.sequence,
+                'total_time': self.cum[featured],
+                'best_lap': self.best_lap[featured],
+                'best_lap_no': self.best_lap_no[featured],
+            },
+            'timing_ms': {'total': (time.perf_counter() - self.start) * 1000},
+        }
+
+
+def simulate_race(drivers_input, is_wet=False, tyre_model=None, n_sims=1000, laps=None,
+                  params=None, seed=None):
+    sim = RaceSim(drivers_input, is_wet, tyre_model, n_sims, laps, params, seed)
+    while not sim.done:
+        sim.step()
+    return sim.result()
+
+
+def _ranks(times):
+    # 0-based position of each car from cumulative times, per replica
+    order = np.argsort(times, axis=1)
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(times.shape[1])[None, :], axis=1)
+    return ranks
+
+
+def _lap_time_str(seconds):
+    minutes, secs = divmod(seconds, 60)
+    return f"{int(minutes)}:{secs:06.3f}"
+
+
+class Commentary:
+    # Story and radio for one replica, lap by lap from its positions so far. race_report() runs it
+    # over a finished race; race_events() after every lap. Pit laps are planned before the start,
+    # so everything here only looks at laps already run.
+    def __init__(self, codes, pit_laps, stops, sequence, n_laps):
+        self.codes = codes
+        self.sequence = sequence
+        self.n_laps = n_laps
+        N = len(codes)
+        self.stop_laps = [sorted(int(l) for l in pit_laps[i][:stops[i]] if l > 0) for i in range(N)]
+        self.pitted = np.zeros((n_laps + 1, N), dtype=bool)
+        for i, laps_i in enumerate(self.stop_laps):
+            self.pitted[laps_i, i] = True
+
+    def compound_after(self, i, k):
+        return COMPOUNDS[self.sequence[i, min(k, self.sequence.shape[1] - 1)]]
+
+    def lap(self, P, lap):
+        # P: (laps + 1, cars) 1-based positions, filled up to `lap`. Returns (events, radio, passes)
+        # with events as (lap, priority, text) and passes as (position, lap, text)
+        codes, stop_laps, pitted, n_laps = self.codes, self.stop_laps, self.pitted, self.n_laps
+        N = len(codes)
+        prev, cur = P[lap - 1], P[lap]
+        events, radio, passes = [], [], []
+
+        # Start
+        if lap == 1:
+            for i in range(N):
+                gained = int(prev[i] - cur[i])
+                if gained >= 3:
+                    events.append((1, 2, f"Lap 1: {codes[i]} makes a flying start, up from P{prev[i]} to P{cur[i]}."))
+                elif gained <= -3:
+                    events.append((1, 2, f"Lap 1: {codes[i]} struggles off the line and drops to P{cur[i]}."))
+
+        # Lead changes, pit stops and on-track passes in the points
+        old_leader, new_leader = int(np.argmin(prev)), int(np.argmin(cur))
+        if old_leader != new_leader:
+            if pitted[lap, old_leader]:
+                events.append((lap, 0, f"Lap {lap}: {codes[new_leader]} inherits the lead as {codes[old_leader]} pits."))
+            else:
+                events.append((lap, 0, f"Lap {lap}: {codes[new_leader]} passes {codes[old_leader]} for the lead!"))
+
+        for i in np.flatnonzero(pitted[lap]):
+            k = stop_laps[i].index(lap) + 1
+            if prev[i] <= 5:
+                events.append((lap, 1, f"Lap {lap}: {codes[i]} pits from P{prev[i]} and switches to {self.compound_after(i, k)}s."))
+            if prev[i] <= 2:
+                radio.append((lap, {'driver': codes[i], 'message': f"Box, box. We're going {self.compound_after(i, k).lower()}.", 'lap': str(lap)}))
+
+        for i in range(N):
+            if cur[i] >= prev[i] or cur[i] > 10 or pitted[lap, i] or lap == 1:
+                continue
+            # Cars it went past on track (they did not pit this lap)
+            overtaken = np.flatnonzero((prev < prev[i]) & (cur > cur[i]) & ~pitted[lap])
+            if len(overtaken) and cur[i] > 1:
+                victim = overtaken[np.argmin(cur[overtaken])]
+                passes.append((int(cur[i]), lap, f"Lap {lap}: {codes[i]} overtakes {codes[victim]} for P{cur[i]}."))
+
+        # Undercuts: a car that stopped first comes out ahead of the rival it was behind once
+        # that rival stops within 5 laps
+        for i in range(N):
+            for stop in stop_laps[i]:
+                if not stop < lap <= stop + 5:
+                    continue
+                for j in np.flatnonzero(P[stop - 1] == P[stop - 1, i] - 1):
+                    later = [l for l in stop_laps[j] if stop < l <= stop + 5]
+                    if later and later[0] == lap and cur[i] < cur[j] and cur[i] <= 10:
+                        events.append((lap, 1, f"Lap {lap}: The undercut works! {codes[i]} jumps {codes[j]} in the stops."))
+                        radio.append((lap, {'driver': codes[i], 'message': "Undercut worked, we're ahead. Push now!", 'lap': str(lap)}))
+
+        # Worn tyres on a long final stint
+        for i in range(N):
+            last_stop = stop_laps[i][-1] if stop_laps[i] else 0
+            final_compound = self.compound_after(i, len(stop_laps[i]))
+            if not ((n_laps - last_stop >= 30 and final_compound == 'SOFT') or n_laps - last_stop >= 40):
+                continue
+            if lap != min(n_laps - 5, last_stop + 25) or lap < 10 or cur[i] < P[lap - 10, i] + 2:
+                continue
+            events.append((lap, 2, f"Lap {lap}: {codes[i]} struggles on worn {final_compound.lower()}s and is losing places."))
+            radio.append((lap, {'driver': codes[i], 'message': "I have no grip! Tires are gone.", 'lap': str(lap)}))
+
+        return events, radio, passes
+
+
+def race_report(drivers_input, sim, include_story=True):
+    # /predict-shaped response: classification of the featured replica, story and radio from its laps
+    f = sim['featured']
+    codes = [d['code'] for d in drivers_input]
+    P = f['positions'] + 1  # (laps + 1, cars), 1-based
+    n_laps, N = sim['laps'], len(drivers_input)
+    finish = P[-1]
+    leader_time = f['total_time'].min()
+    distribution = sim['distribution']
+    commentary = Commentary(codes, f['pit_laps'], f['stops'], f['sequence'], n_laps)
+    stop_laps = commentary.stop_laps
+
+    classification = []
+    for i, d in enumerate(drivers_input):
+        rank = int(finish[i])
+        classification.append({
+            'code': d['code'],
+            'predicted_position_raw': float(sim['expected_position'][i]),
+            'start_pos': d['grid'],
+            'delta': float(sim['expected_position'][i] - d['grid']),
+            'predicted_rank': rank,
+            'gain_loss': d['grid'] - rank,
+            'points': POINTS.get(rank, 0),
+            'gap_to_leader': round(float(f['total_time'][i] - leader_time), 3),
+            'pit_laps': stop_laps[i],
+            'compounds': [commentary.compound_after(i, k) for k in range(len(stop_laps[i]) + 1)],
+            'win_prob': float(distribution[i, 0]),
+            'podium_prob': float(distribution[i, :3].sum()),
+        })
+    classification.sort(key=lambda x: x['predicted_rank'])
+    if not include_story:
+        return {'classification': classification}
+
+    events = []   # (lap, priority, text); lower priority sorts first within a lap
+    radio = []    # (lap, {driver, message, lap})
+    passes = []
+    for lap in range(1, n_laps + 1):
+        lap_events, lap_radio, lap_passes = commentary.lap(P, lap)
+        events.extend(lap_events)
+        radio.extend(lap_radio)
+        passes.extend(lap_passes)
+    # Only the passes highest up the order make the story
+    for _, lap, text in sorted(passes)[:12]:
+        events.append((lap, 2, text))
+
+    fastest = int(np.argmin(f['best_lap']))
+    events.append((int(f['best_lap_no'][fastest]), 3,
+                   f"Lap {f['best_lap_no'][fastest]}: {codes[fastest]} sets the fastest lap, {_lap_time_str(f['best_lap'][fastest])}."))
+
+    events.sort(key=lambda e: (e[0], e[1]))
+    story = [text for _, _, text in events]
+
+    # Finish
+    for res in classification:
+        rank, code = res['predicted_rank'], res['code']
+        if rank == 1:
+            story.append(f"Finish: {code} takes the chequered flag to win!")
+            radio.append((n_laps + 1, {'driver': code, 'message': "Simply lovely! Great job guys, the car was on rails.", 'lap': 'Finish'}))
+        elif rank <= 3:
+            story.append(f"Finish: {code} crosses the line to take a podium spot, +{res['gap_to_leader']:.1f}s.")
+            radio.append((n_laps + 1, {'driver': code, 'message': "Podium! Good points for the team.", 'lap': 'Finish'}))
+        elif res['gain_loss'] >= 4:
+            story.append(f"Finish: {code} charges from P{res['start_pos']} to P{rank}.")
+            radio.append((n_laps + 2, {'driver': code, 'message': "What a race! From P" + str(res['start_pos']) + " to P" + str(rank) + ". Mega.", 'lap': 'Cool-down'}))
+
+    if sim['is_wet']:
+        story.insert(0, "Race Control: Wet conditions declared. Intermediates are the tyre of choice.")
+    else:
+        story.insert(0, "Race Control: Dry conditions. Track temperature is optimal.")
+
+    radio.sort(key=lambda r: r[0])
+    return {
+        'classification': classification,
+        'story': story,
+        'radio': [message for _, message in radio],
+        'lap_chart': {codes[i]: P[:, i].tolist() for i in range(N)},
+    }
+
+
+def race_events(drivers_input, is_wet=False, tyre_model=None, n_sims=1000, laps=None, seed=None,
+                standings_every=1, include_story=True):
+    # The race as it runs, as (event, data) pairs: 'start' before any work, then per lap 'lap'
+    # (story lines), 'radio' and 'standings', and 'result' (the race_report body) after the flag.
+    # Nothing is simulated ahead of what the consumer has taken, so closing the generator stops
+    # the work. The story follows replica 0 (replicas are exchangeable, so that is a random race
+    # rather than the most typical one); expected positions and lead odds are over all replicas.
+    tyre_model = tyre_model or DEFAULT_TYRE_MODEL
+    n_laps = int(laps or tyre_model['laps'])
+    codes = [d['code'] for d in drivers_input]
+    grid = [int(d['grid']) for d in drivers_input]
+    yield 'start', {'laps': n_laps, 'n_sims': n_sims, 'is_wet': bool(is_wet),
+                    'drivers': [{'code': c, 'grid': p} for c, p in zip(codes, grid)]}
+
+    sim = RaceSim(drivers_input, is_wet, tyre_model, n_sims, n_laps, seed=seed)
+    commentary = Commentary(codes, sim.pit_laps[0], sim.stops, sim.sequence, n_laps)
+    P = np.empty((n_laps + 1, len(codes)), dtype=np.int64)
+    P[0] = sim.positions[0, 0] + 1
+    while not sim.done:
+        sim.step()
+        lap = sim.lap
+        P[lap] = sim.positions[lap, 0] + 1
+        events, radio, passes = commentary.lap(P, lap)
+        events.extend((l, 2, text) for _, l, text in passes)
+        events.sort(key=lambda e: e[1])
+        if include_story:
+            yield 'lap', {'lap': lap, 'events': [text for _, _, text in events]}
+            for _, message in radio:
+                yield 'radio', message
+
+        if lap % standings_every == 0 or sim.done:
+            positions = sim.positions[lap]
+            expected = positions.mean(axis=0) + 1
+            lead_prob = (positions == 0).mean(axis=0)
+            cum = sim.cum[0]
+            standings = []
+            for i in np.argsort(cum):
+                standings.append({
+                    'code': codes[i],
+                    'predicted_rank': int(P[lap, i]),
+                    'start_pos': grid[i],
+                    'gain_loss': grid[i] - int(P[lap, i]),
+                    'points': POINTS.get(int(P[lap, i]), 0),
+                    'gap_to_leader': round(float(cum[i] - cum.min()), 3),
+                    'compound': COMPOUNDS[sim.sequence[i, min(sim.stint[0, i], sim.sequence.shape[1] - 1)]],
+                    'tyre_age': int(sim.age[0, i]),
+                    'expected_position': round(float(expected[i]), 2),
+                    'lead_prob': round(float(lead_prob[i]), 4),
+                })
+            yield 'standings', {'lap': lap, 'standings': standings}
+
+    result = sim.result(featured=0)
+    report = race_report(drivers_input, result, include_story)
+    report.update({'n_sims': result['n_sims'], 'laps': result['laps'], 'timing_ms': result['timing_ms']})
+    yield 'result', report
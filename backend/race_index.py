@@ -0,0 +1,262 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from atomic_io import write_bytes
+
+# Local race index: season schedules and fully built /race and /strategy payloads for
+# completed events, so browsing history never needs FastF1 or the network.
+#   python race_index.py --seasons 2023 2024 --gzip
+# Layout: <root>/<year>/schedule.json, <root>/<year>/<round:02d>/{race,strategy}.json
+# (+ .json.gz next to each when built with --gzip). The API serves these bytes as-is with an
+# ETag, and answers If-None-Match with 304.
+
+RACE_INDEX_DIR = os.environ.get('F1_RACE_INDEX', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'race_index'))
+
+
+# --- Payloads (shared with app.py's live path) ---
+
+def schedule_payload(schedule):
+    races = schedule[schedule['EventFormat'] == 'conventional']
+    return [{
+        'RoundNumber': int(e.RoundNumber),
+        'EventName': str(e.EventName),
+        'Location': str(e.Location),
+        'Country': str(e.Country),
+    } for e in races.itertuples(index=False)]
+
+
+def _missing(value):
+    # pd.isna for the scalars in feature and stint rows, without importing pandas here
+    return value is None or (isinstance(value, (float, np.floating)) and np.isnan(value))
+
+
+def race_payload(year, round_num, features, event):
+    drivers_data = []
+    for row in features.itertuples(index=False):
+        if _missing(row.GridPosition): continue
+        drivers_data.append({
+            'code': row.Driver,
+            'name': row.Name,
+            'team': row.Team,
+            'grid': int(row.GridPosition),
+            'start_compound': row.StartCompound,
+            'stops': int(row.Stops),
+            'pace_delta': float(row.PaceDelta),
+            'consistency': float(row.Consistency)
+        })
+
+    return {
+        'year': year,
+        'round': round_num,
+        'event': event['EventName'],
+        'circuit_info': {
+            'location': event['Location'],
+            'country': event['Country'],
+            'name': event['EventName']
+        },
+        'is_wet': bool(features['IsWet'].any()),
+        'drivers': drivers_data
+    }
+
+
+# FastF1's own compound colours, for when the installed version can't provide them
+DEFAULT_COMPOUND_COLORS = {
+    'SOFT': '#da291c', 'MEDIUM': '#ffd12e', 'HARD': '#f0f0ec',
+    'INTERMEDIATE': '#43b02a', 'WET': '#0067ad', 'UNKNOWN': '#00ffff', 'TEST_UNKNOWN': '#434649',
+}
+
+
+def compound_colors(session=None):
+    # Compact sessions carry the colours captured when they were built; without a session the
+    # defaults, so the stored-stints path never imports FastF1
+    stored = getattr(session, 'compound_colors', None)
+    if stored:
+        return {**DEFAULT_COMPOUND_COLORS, **stored}
+    if session is None:
+        return dict(DEFAULT_COMPOUND_COLORS)
+
+    import fastf1.plotting
+
+    # FastF1 < 3.4 has a static COMPOUND_COLORS; newer versions map colours per session/season
+    colors = getattr(fastf1.plotting, 'COMPOUND_COLORS', None)
+    if colors is None:
+        try:
+            colors = fastf1.plotting.get_compound_mapping(session)
+        except Exception:
+            colors = {}
+    return {**DEFAULT_COMPOUND_COLORS, **colors}
+
+
+def _rounded(values, digits):
+    return [None if _missing(v) else round(v, digits) for v in values]
+
+
+def strategy_payload(stints, colors=None):
+    # From features.stint_table: one entry per driver (in table order) with its stints.
+    # Colours: the stored Color column (see features.write_stints), else `colors`, else defaults.
+    # Built from whole columns: a stable sort on first appearance keeps each driver's rows
+    # together in table order, and the stints are split at the driver boundaries.
+    colors = colors or DEFAULT_COMPOUND_COLORS
+    numbers = stints['DriverNumber'].to_numpy()
+    _, first, inverse = np.unique(numbers.astype(str), return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    codes, drivers = rank[inverse.ravel()], numbers[np.sort(first)]
+    order = np.argsort(codes, kind='stable')
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+
+    def column(name):
+        return stints[name].to_numpy()[order].tolist()
+
+    compound = column('Compound')
+    if 'Color' in stints:
+        color = [c if isinstance(c, str) else colors.get(k, '#ffffff') for c, k in zip(column('Color'), compound)]
+    else:
+        color = [colors.get(k, '#ffffff') for k in compound]
+    rows = [{
+        'compound': k,
+        'start_lap': int(start),
+        'end_lap': int(end),
+        'laps': int(laps),
+        'median_lap_time': median,
+        'degradation': slope,
+        'color': c
+    } for k, start, end, laps, median, slope, c in zip(
+        compound, column('StartLap'), column('EndLap'), column('Laps'),
+        _rounded(column('MedianLapTime'), 3), _rounded(column('DegradationSlope'), 4), color)]
+    return [{'driver': drv, 'stints': rows[lo:hi]}
+            for drv, lo, hi in zip(drivers.tolist(), [0, *bounds.tolist()], [*bounds.tolist(), len(rows)])]
+
+
+# --- On-disk index ---
+
+def payload_path(year, round_num=None, kind='schedule', root=None):
+    root = root or RACE_INDEX_DIR
+    if round_num is None:
+        return os.path.join(root, str(int(year)), f"{kind}.json")
+    return os.path.join(root, str(int(year)), f"{int(round_num):02d}", f"{kind}.json")
+
+
+def write_payload(path, payload, compress=False):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    body = json.dumps(payload, separators=(',', ':')).encode()
+    # The .json goes last: readers notice a rebuild by its mtime
+    outputs = [(path, body)]
+    if compress:
+        outputs.insert(0, (path + '.gz', gzip.compress(body, compresslevel=9, mtime=0)))
+    elif os.path.exists(path + '.gz'):
+        os.remove(path + '.gz')  # Never leave a stale compressed copy behind
+    for out_path, data in outputs:
+        write_bytes(out_path, data)
+    return len(body)
+
+
+class IndexEntry:
+    def __init__(self, body, gzipped, etag):
+        self.body = body
+        self.gzipped = gzipped
+        self.etag = etag
+
+
+class RaceIndex:
+    # Payload bytes and ETags kept in memory after the first read; a rebuilt file is picked up
+    # by its mtime. The whole index is a few KB per race, so nothing is evicted.
+    def __init__(self, root=None):
+        self.root = root or RACE_INDEX_DIR
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, year, round_num=None, kind='schedule'):
+        path = payload_path(year, round_num, kind, self.root)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            cached = self._entries.get(path)
+            self.hits += 1
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, 'rb') as f:
+            body = f.read()
+        gzipped = None
+        if os.path.exists(path + '.gz'):
+            with open(path + '.gz', 'rb') as f:
+                gzipped = f.read()
+        entry = IndexEntry(body, gzipped, hashlib.sha1(body).hexdigest())
+        with self._lock:
+            self._entries[path] = (mtime, entry)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'loaded': len(self._entries)}
+
+
+# --- Builder ---
+
+def build_index(seasons, rounds=None, compress=False, force=False, root=None):
+    import fastf1
+
+    from compact_laps import load_compact_session
+    from features import build_race_features, stint_table
+    from ingest import race_targets
+
+    root = root or RACE_INDEX_DIR
+    start = time.perf_counter()
+    built = skipped = failed = 0
+    for year in seasons:
+        schedule = schedule_payload(fastf1.get_event_schedule(year))
+        write_payload(payload_path(year, root=root), schedule, compress)
+        print(f"{year}: schedule with {len(schedule)} events")
+
+        for _, round_num, name in race_targets([year], rounds):
+            race_path = payload_path(year, round_num, 'race', root)
+            strategy_path = payload_path(year, round_num, 'strategy', root)
+            if not force and os.path.exists(race_path) and os.path.exists(strategy_path):
+                skipped += 1
+                continue
+            t = time.perf_counter()
+            try:
+                session = load_compact_session(year, round_num)
+                if len(session.laps) == 0:
+                    print(f"  {year} R{round_num:02d} {name:28s} no laps, skipped")
+                    continue
+                stored = build_race_features(year, round_num, lambda y, r: session)
+                size = write_payload(race_path, race_payload(year, round_num, *stored), compress)
+                stints = stint_table(session.laps, session.drivers)
+                size += write_payload(strategy_path, strategy_payload(stints, compound_colors(session)), compress)
+                built += 1
+                print(f"  {year} R{round_num:02d} {name:28s} {size / 1024:6.1f} KB  {time.perf_counter() - t:5.1f}s")
+            except Exception as e:
+                failed += 1
+                print(f"  {year} R{round_num:02d} {name:28s} error: {e}")
+    print(f"Built {built} races ({skipped} already indexed, {failed} failed) "
+          f"in {time.perf_counter() - start:.1f}s -> {root}")
+
+
+if __name__ == '__main__':
+    from ingest import CACHE_DIR, enable_cache, parse_rounds
+
+    parser = argparse.ArgumentParser(description="Build the local race index served by /races and /race")
+    parser.add_argument('--seasons', type=int, nargs='+', default=[2023])
+    parser.add_argument('--rounds', default=None, help="e.g. '1-5,8' (default: every completed round)")
+    parser.add_argument('--gzip', action='store_true', help="Also write pre-compressed .json.gz payloads")
+    parser.add_argument('--force', action='store_true', help="Rebuild races already in the index")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args()
+
+    enable_cache(args.cache_dir)
+    build_index(args.seasons, parse_rounds(args.rounds), compress=args.gzip, force=args.force)
@@ -0,0 +1,54 @@
+import argparse
+import os
+import signal
+
+# Production entry point: multi-threaded WSGI server (waitress, works on Windows and Linux).
+#   python serve.py --threads 16
+# FastF1 session loads run on SessionCache's own pool (F1_LOAD_WORKERS) and at most
+# F1_MAX_WAITING_LOADS request threads may wait on them, so keep --threads above that
+# and /predict always has threads to run on.
+#
+# On Linux, multiple processes with the app preloaded before fork:
+#   gunicorn -c gunicorn.conf.py app:app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the F1 simulator API")
+    parser.add_argument('--host', default=os.environ.get('F1_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('F1_PORT', 5000)))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('F1_THREADS', 16)))
+    args = parser.parse_args()
+
+    from waitress import create_server
+
+    import app as app_module
+
+    max_waiting = app_module.session_cache.max_waiting
+    if args.threads <= max_waiting:
+        print(f"Warning: --threads {args.threads} <= F1_MAX_WAITING_LOADS {max_waiting}; "
+              f"race loads can occupy every thread.")
+
+    app_module.init_worker()
+    server = create_server(app_module.app, host=args.host, port=args.port, threads=args.threads)
+
+    def stop(signum, frame):
+        # Stop accepting connections; requests already running are allowed to finish
+        print("Shutting down...")
+        server.close()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"Serving on http://{args.host}:{args.port} with {args.threads} threads "
+          f"({app_module.session_cache.load_workers} FastF1 load workers)")
+    try:
+        server.run()
+    except OSError:
+        pass  # Listening socket closed by stop()
+    finally:
+        server.task_dispatcher.shutdown()
+        app_module.shutdown()
+
+
+if __name__ == '__main__':
+    main()
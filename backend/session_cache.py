@@ -0,0 +1,266 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from atomic_io import write_text
+
+# In-process cache of loaded FastF1 sessions.
+# /race and /race/.../strategy are requested together by the frontend, so without
+# this every race selection parses the same session twice.
+
+DEFAULT_MAX_ENTRIES = 8
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512 MB
+DEFAULT_LOAD_WORKERS = 2
+DEFAULT_MAX_WAITING = 8
+DEFAULT_LOAD_TIMEOUT = 120  # seconds
+DEFAULT_RECENT_RACES = 8
+
+
+def estimate_session_bytes(session):
+    # Laps dominate the footprint of a session loaded without telemetry. Compact sessions
+    # (compact_laps.py) know their own size.
+    if hasattr(session, 'nbytes'):
+        return int(session.nbytes)
+    total = 0
+    for attr in ('laps', 'results'):
+        try:
+            frame = getattr(session, attr)
+            total += int(frame.memory_usage(deep=True).sum())
+        except Exception:
+            pass
+    return total
+
+
+def has_laps(session):
+    # A race that has not been run yet loads without laps and the API answers with mock data.
+    # Such a session is not cached, or the real race would never replace it.
+    try:
+        return len(session.laps) > 0
+    except Exception:
+        return False
+
+
+FASTF1_CACHE_DIR = 'cache'
+
+
+def import_fastf1():
+    # FastF1 brings in matplotlib, scipy and requests (about a second), so the API imports it on
+    # the first live load. Its local cache is enabled then, unless a script chose one already.
+    import fastf1
+
+    if fastf1.Cache._CACHE_DIR is None and os.path.exists(FASTF1_CACHE_DIR):
+        try:
+            fastf1.Cache.enable_cache(FASTF1_CACHE_DIR)
+        except Exception:
+            pass  # Cache might be locked or issues
+    return fastf1
+
+
+def load_race_session(year, round_num, session_type='R'):
+    session = import_fastf1().get_session(year, round_num, session_type)
+    session.load(telemetry=False, weather=False, messages=False)
+    return session
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class LoadBusy(Exception):
+    # Raised instead of queueing when too many requests are already waiting on session loads
+    pass
+
+
+class SessionCache:
+    def __init__(self, loader=load_race_session, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, sizeof=estimate_session_bytes,
+                 load_workers=DEFAULT_LOAD_WORKERS, max_waiting=DEFAULT_MAX_WAITING,
+                 load_timeout=DEFAULT_LOAD_TIMEOUT, cacheable=has_laps):
+        self.loader = loader
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.cacheable = cacheable
+
+        # Slow session.load() calls run on a small pool of their own. At most max_waiting
+        # request threads may block on them, so the rest of the server threads stay free
+        # for cheap requests such as /predict.
+        self.load_workers = load_workers
+        self.max_waiting = max_waiting
+        self.load_timeout = load_timeout
+        self._waiting = threading.BoundedSemaphore(max_waiting)
+        self._pool = None
+        self._pool_pid = None
+
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def _executor(self):
+        # Created lazily and per process: pool threads do not survive a fork
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ThreadPoolExecutor(max_workers=self.load_workers,
+                                            thread_name_prefix='fastf1-load')
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def _lookup(self, key):
+        # Caller holds the lock
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, self._entries[key][0]
+        return False, None
+
+    def get(self, year, round_num, session_type='R'):
+        key = (int(year), int(round_num), session_type)
+
+        with self._lock:
+            found, value = self._lookup(key)
+        if found:
+            return value
+
+        if not self._waiting.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise LoadBusy(f"Too many session loads in progress (max {self.max_waiting} waiting)")
+        try:
+            with self._lock:
+                found, value = self._lookup(key)
+                if found:
+                    return value
+                flight = self._inflight.get(key)
+                if flight is None:
+                    # First caller for this key starts the load, later ones wait on it
+                    flight = _InFlight()
+                    self._inflight[key] = flight
+                    self.misses += 1
+                    start_load = True
+                else:
+                    # Someone else is already loading this race: waits like a miss, loads nothing
+                    self.coalesced += 1
+                    start_load = False
+
+            if start_load:
+                if self.load_workers:
+                    self._executor().submit(self._load, key, flight)
+                else:
+                    self._load(key, flight)
+
+            if not flight.done.wait(self.load_timeout):
+                # The load keeps going and is cached when it finishes
+                raise LoadBusy(f"Session {key} still loading after {self.load_timeout}s")
+        finally:
+            self._waiting.release()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _load(self, key, flight):
+        size, keep = 0, False
+        try:
+            flight.value = self.loader(*key)
+            keep = self.cacheable(flight.value)
+            size = self.sizeof(flight.value)  # Measured outside the lock, deep sizing is not free
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                if flight.error is None and keep:
+                    self._store(key, flight.value, size)
+            flight.done.set()
+
+    def shutdown(self):
+        # Drop queued loads; a load already running finishes in the background
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+    def _store(self, key, value, size):
+        # Caller holds the lock
+        if self.max_bytes and size > self.max_bytes:
+            return  # Would evict everything else and still not fit
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def invalidate(self, year=None, round_num=None, session_type='R'):
+        with self._lock:
+            if year is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            entry = self._entries.pop((int(year), int(round_num), session_type), None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected,
+                'loading': len(self._inflight),
+                'hit_ratio': (self.hits / lookups) if lookups else 0.0,
+                'keys': [list(k) for k in self._entries],
+                'entry_bytes': [size for _, size in self._entries.values()],
+            }
+
+
+class RecentRaces:
+    # Most recently viewed races, newest first, kept in a small JSON file so a restarted server
+    # knows which ones to warm up (app.warm_up)
+    def __init__(self, path, max_races=DEFAULT_RECENT_RACES):
+        self.path = path
+        self.max_races = max_races
+        self._lock = threading.Lock()
+        self._races = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return [(int(year), int(round_num)) for year, round_num in json.load(f)][:self.max_races]
+        except (OSError, ValueError, TypeError):
+            return []
+
+    def record(self, year, round_num):
+        race = (int(year), int(round_num))
+        with self._lock:
+            if self._races[:1] == [race]:
+                return  # Already the newest, nothing to write
+            self._races = [race] + [r for r in self._races if r != race][:self.max_races - 1]
+            try:
+                write_text(self.path, json.dumps(self._races))
+            except OSError:
+                pass  # Only a warm-up hint
+
+    def races(self):
+        with self._lock:
+            return list(self._races)
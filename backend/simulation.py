@@ -0,0 +1,88 @@
+import time
+
+import numpy as np
+
+from inference import feature_matrix
+
+# Monte Carlo race outcomes: N perturbed replicas of the grid scored in one batched
+# model call, ranked with NumPy.
+
+POINTS = np.array([25, 18, 15, 12, 10, 8, 6, 4, 2, 1], dtype=np.float64)
+
+# Spread of the per-replica perturbations
+DEFAULT_NOISE = {
+    'pace_sd': 0.25,         # s/lap added to PaceDelta
+    'consistency_sd': 0.25,  # log-normal scale on Consistency
+    'stop_change_p': 0.15,   # chance a car does one stop more or less than planned
+    'weather_flip_p': 0.05,  # chance the whole race goes the other way on wet/dry
+}
+
+MAX_SIMS = 100000
+
+
+def run_monte_carlo(predictor, drivers_input, is_wet, n_sims=10000, noise=None, seed=None):
+    start = time.perf_counter()
+    noise = {**DEFAULT_NOISE, **(noise or {})}
+    rng = np.random.default_rng(seed)
+
+    model_features = predictor.features
+    base = feature_matrix(drivers_input, is_wet, model_features)
+    n_drivers, n_features = base.shape
+    col = {name: i for i, name in enumerate(model_features)}
+
+    X = np.broadcast_to(base, (n_sims, n_drivers, n_features)).copy()
+    if 'PaceDelta' in col:
+        X[:, :, col['PaceDelta']] += rng.normal(0, noise['pace_sd'], (n_sims, n_drivers))
+    if 'Consistency' in col:
+        X[:, :, col['Consistency']] *= rng.lognormal(0, noise['consistency_sd'], (n_sims, n_drivers))
+    if 'Stops' in col:
+        change = rng.random((n_sims, n_drivers)) < noise['stop_change_p']
+        step = rng.choice(np.array([-1, 1], dtype=np.float32), (n_sims, n_drivers))
+        X[:, :, col['Stops']] = np.maximum(X[:, :, col['Stops']] + change * step, 0)
+    if 'IsWet' in col:
+        flip = rng.random(n_sims) < noise['weather_flip_p']
+        X[flip, :, col['IsWet']] = 1 - X[flip, :, col['IsWet']]
+
+    # One model call for every replica
+    t = time.perf_counter()
+    preds = predictor.predict_matrix(X.reshape(n_sims * n_drivers, n_features)).reshape(n_sims, n_drivers)
+    predict_s = time.perf_counter() - t
+
+    # Finish = Grid + PredDelta; tiny jitter breaks exact ties at random
+    raw = base[:, col['GridPosition']] + preds + rng.uniform(0, 1e-3, preds.shape)
+    order = np.argsort(raw, axis=1)
+    positions = np.empty_like(order)
+    np.put_along_axis(positions, order, np.arange(n_drivers)[None, :], axis=1)
+
+    # distribution[d, p] = share of replicas where driver d finished in position p + 1
+    flat = (np.arange(n_drivers)[None, :] * n_drivers + positions).ravel()
+    distribution = np.bincount(flat, minlength=n_drivers * n_drivers).reshape(n_drivers, n_drivers) / n_sims
+
+    points = np.zeros(n_drivers)
+    points[:min(n_drivers, len(POINTS))] = POINTS[:n_drivers]
+    expected_points = distribution @ points
+    expected_position = distribution @ np.arange(1, n_drivers + 1)
+
+    results = []
+    for i, d in enumerate(drivers_input):
+        results.append({
+            'code': d['code'],
+            'start_pos': d['grid'],
+            'expected_position': float(expected_position[i]),
+            'expected_points': float(expected_points[i]),
+            'win_prob': float(distribution[i, 0]),
+            'podium_prob': float(distribution[i, :3].sum()),
+            'points_prob': float(distribution[i, :len(POINTS)].sum()),
+            'position_distribution': distribution[i].round(6).tolist()
+        })
+    results.sort(key=lambda x: x['expected_position'])
+
+    return {
+        'n_sims': n_sims,
+        'noise': noise,
+        'drivers': results,
+        'timing_ms': {
+            'predict': predict_s * 1000,
+            'total': (time.perf_counter() - start) * 1000
+        }
+    }
@@ -1,128 +1,48 @@
+import argparse
 import fastf1
-import pandas as pd
 import numpy as np
 import xgboost as xgb
-import joblib
 import os
+import time
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_absolute_error
 from scipy.stats import spearmanr
+from features import compound_code, load_training_dataset
+from ingest import ingest_targets, parse_rounds, race_targets
+from model_registry import LEGACY_VERSION, load_version, read_current, save_version
 
 # Setup cache
 if not os.path.exists('cache'):
     os.makedirs('cache')
 fastf1.Cache.enable_cache('cache')
 
-def get_compound_map():
-    # Map tyre compounds to numeric
-    # Soft=1, Medium=2, Hard=3, Intermediate=4, Wet=5
-    return {
-        'SOFT': 1, 'MEDIUM': 2, 'HARD': 3,
-        'INTERMEDIATE': 4, 'WET': 5,
-        'UNKNOWN': 2 # Default to medium
-    }
+def to_training_frame(features):
+    # Stored features keep the raw compound and unclassified drivers; the model wants neither
+    df = features.dropna(subset=['GridPosition', 'FinishPosition']).copy()
+    df['StartCompound'] = df['StartCompound'].map(compound_code)
+    return df.reset_index(drop=True)
 
-def process_season(year):
+def process_season(year, rounds=None, workers=None):
     print(f"Processing season {year}...")
-    schedule = fastf1.get_event_schedule(year)
-    season_data = []
+    return build_dataset([year], rounds, workers)
 
-    # Filter for completed races only
-    completed_races = schedule[schedule['EventFormat'] == 'conventional'] # Stick to conventional for simplicity
-    
-    # Limit to first 5 races for faster demo training if needed, but let's try to do a reasonable chunk
-    # If the user wants a full robust model, we'd run all. For this demo, lets do 3 races to ensure it runs quickly 
-    # and prove the pipeline, but I'll comment on how to expand.
-    # Actually, for a good model we need data. I'll read as many as possible but handle errors.
-    
-    # Let's pick a few specific races to ensure variety (e.g., Bahrain, Monaco, Silverstone, Spa, Abu Dhabi)
-    # OR just loop through the first 10.
-    
-    for i, event in completed_races.iterrows():
-        try:
-            if event['RoundNumber'] > 2: # LIMIT TO 2 RACES FOR SPEED IN THIS DEMO
-                break
-            
-            print(f"  Processing {event['EventName']}...")
-            try:
-                session = fastf1.get_session(year, event['RoundNumber'], 'R')
-                session.load(telemetry=False, messages=False) # Optimize loading
-            except Exception as e:
-                print(f"Failed to load session: {e}")
-                continue
-            
-            laps = session.laps
-            results = session.results
-
-            # Weather (Simplified: % of laps declared rainy?)
-            # FastF1 doesn't give simple "Wet/Dry" boolean easily without weather data stream
-            # We will approximate from tyre choice. If Inters/Wets used > 10% laps -> Wet
-            tyre_counts = laps['Compound'].value_counts()
-            wet_tyres = tyre_counts.get('INTERMEDIATE', 0) + tyre_counts.get('WET', 0)
-            is_wet = 1 if (wet_tyres / len(laps) > 0.1) else 0
-
-            # Calculate Team Pace (Avg lap time excluding in/out laps)
-            clean_laps = laps.pick_quicklaps()
-            team_pace = clean_laps.groupby('Team')['LapTime'].mean().dt.total_seconds()
-            avg_field_pace = team_pace.mean()
-            
-            for driver in session.drivers:
-                try:
-                    d_res = results.loc[driver]
-                    d_laps = laps.pick_driver(driver)
-                    
-                    if len(d_laps) == 0: continue
-
-                    # Features
-                    grid = d_res['GridPosition']
-                    finish = d_res['Position']
-                    if pd.isna(finish) or pd.isna(grid): continue
-                    
-                    # Target: Position Delta (- gain, + loss)
-                    # Use Finish Position directly or delta
-                    # Prompt asks for "Position Delta"
-                    
-                    # Tyre Strategy
-                    stints = d_laps['Stint'].unique()
-                    stops = len(stints) - 1 if len(stints) > 0 else 0
-                    start_compound = d_laps.iloc[0]['Compound']
-                    compound_map = get_compound_map()
-                    start_compound_val = compound_map.get(str(start_compound).upper(), 2)
-
-                    # Pace Features
-                    d_clean_laps = d_laps.pick_quicklaps()
-                    if len(d_clean_laps) > 0:
-                        d_avg_pace = d_clean_laps['LapTime'].mean().total_seconds()
-                        pace_delta = d_avg_pace - avg_field_pace # Negative is faster
-                        consistency = d_clean_laps['LapTime'].std().total_seconds()
-                    else:
-                        pace_delta = 0
-                        consistency = 0
-                        
-                    season_data.append({
-                        'Year': year,
-                        'Round': event['RoundNumber'],
-                        'Driver': d_res['Abbreviation'],
-                        'GridPosition': grid,
-                        'StartCompound': start_compound_val,
-                        'Stops': stops,
-                        'PaceDelta': pace_delta if not pd.isna(pace_delta) else 0,
-                        'Consistency': consistency if not pd.isna(consistency) else 0,
-                        'IsWet': is_wet,
-                        'FinishPosition': finish
-                    })
-                except Exception as e:
-                    print(f"    Error processing driver {driver}: {e}")
-                    
-        except Exception as e:
-            print(f"  Error processing race {event['EventName']}: {e}")
-            
-    return pd.DataFrame(season_data)
-
-def train_model():
-    # Load Data (2023 Season)
-    # Ideally should use more, but this is a demo.
-    df = process_season(2023)
+def build_dataset(seasons, rounds=None, workers=None):
+    # Featurize any missing races in parallel, then read everything back from the feature store
+    # (dataset.parquet, which only has the new races appended; see features.update_dataset)
+    targets = race_targets(seasons, rounds)
+    ingest_targets(targets, workers)
+    races = [(year, round_num) for year, round_num, _ in targets]
+    return to_training_frame(load_training_dataset(races))
+
+def trained_races(df):
+    return sorted([int(y), int(r)] for y, r in df[['Year', 'Round']].drop_duplicates().itertuples(index=False))
+
+FEATURES = ['GridPosition', 'StartCompound', 'Stops', 'PaceDelta', 'Consistency', 'IsWet']
+
+def train_model(seasons=(2023,), rounds=None, workers=None, activate=True, df=None, params=None, cv=None):
+    # params: XGBRegressor overrides (e.g. the best trial from tuning.py); cv: its summary, kept in meta
+    if df is None:
+        df = build_dataset(list(seasons), rounds, workers)
     
     if df.empty:
         print("No data collected. Exiting.")
@@ -139,7 +59,7 @@ def train_model():
     
     df['PositionDelta'] = df['FinishPosition'] - df['GridPosition']
     
-    features = ['GridPosition', 'StartCompound', 'Stops', 'PaceDelta', 'Consistency', 'IsWet']
+    features = FEATURES
     target = 'PositionDelta'
     
     X = df[features]
@@ -149,28 +69,125 @@ def train_model():
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
     
     # Model: XGBoost
-    model = xgb.XGBRegressor(
-        n_estimators=100,
-        learning_rate=0.1,
-        max_depth=5,
-        objective='reg:squarederror'
-    )
+    model = xgb.XGBRegressor(**{
+        'n_estimators': 100,
+        'learning_rate': 0.1,
+        'max_depth': 5,
+        'objective': 'reg:squarederror',
+        **(params or {})
+    })
     
     model.fit(X_train, y_train)
     
     # Evaluate
     preds = model.predict(X_test)
     mae = mean_absolute_error(y_test, preds)
-    # Spearman requires aligning indices, simple check here
-    
-    print(f"Model MAE: {mae:.4f}")
+    # Spearman of predicted vs actual finishing order, per race among its test rows
+    test = df.loc[X_test.index]
+    rhos = [
+        spearmanr(g['GridPosition'] + g['Pred'], g['FinishPosition']).correlation
+        for _, g in test.assign(Pred=preds).groupby(['Year', 'Round']) if len(g) >= 3
+    ]
+    rho = float(np.nanmean(rhos)) if rhos else float('nan')
     
-    # Save Model
-    joblib.dump(model, 'f1_model.pkl')
-    print("Model saved to f1_model.pkl")
+    print(f"Model MAE: {mae:.4f}, mean per-race Spearman: {rho:.3f}")
     
-    # Save feature names for inference
-    joblib.dump(features, 'model_features.pkl')
+    # Save Model as a new registry version; a running server switches to it on its own
+    version = save_version(model, features, meta={
+        'seasons': sorted(df['Year'].unique().tolist()),
+        'races': int(df.groupby(['Year', 'Round']).ngroups),
+        'samples': int(len(df)),
+        'mae': float(mae),
+        'spearman': rho,
+        'mode': 'full',
+        'trained_races': trained_races(df),
+        'params': {k: model.get_params()[k] for k in ('n_estimators', 'learning_rate', 'max_depth', 'objective', *(params or {}))},
+        **({'cv': cv} if cv else {})
+    }, activate=activate)
+    print(f"Model saved as {version}" + (" (now CURRENT)" if activate else ""))
+    return version
+
+def update_model(seasons=(2023,), rounds=None, workers=None, refit=False, extra_trees=25, activate=True):
+    # Post-race update: only sessions missing from the feature store are fetched and appended to
+    # dataset.parquet. Then either keep boosting the CURRENT model for `extra_trees` more rounds
+    # or (refit=True) train a fresh model on the cached dataset.
+    start = time.perf_counter()
+    targets = race_targets(list(seasons), rounds)
+    ingest_targets(targets, workers)
+
+    current = read_current()
+    base = load_version(current) if current and current != LEGACY_VERSION else None
+    previous = {tuple(r) for r in base.meta.get('trained_races', [])} if base else set()
+    races = sorted(previous | {(year, round_num) for year, round_num, _ in targets})
+    df = to_training_frame(load_training_dataset(races))
+    if df.empty:
+        print("No data collected. Exiting.")
+        return
+    df['PositionDelta'] = df['FinishPosition'] - df['GridPosition']
+
+    race_keys = list(zip(df['Year'], df['Round']))
+    is_new = np.array([key not in previous for key in race_keys])
+    new_races = sorted(set(key for key, new in zip(race_keys, is_new) if new))
+    print(f"{len(new_races)} new races since {current or 'no model'}: {new_races}")
+
+    # Hyperparameters of the CURRENT version (tuning.py --train results included) carry over
+    params = dict(base.meta.get('params') or {}) if base else {}
+
+    if refit or base is None or not previous or list(base.features) != FEATURES:
+        if not refit:
+            print("No incremental base (legacy model or no race list), refitting from the cached dataset.")
+        version = train_model(df=df.drop(columns=['PositionDelta']), activate=activate, params=params or None)
+        print(f"Updated in {time.perf_counter() - start:.1f}s")
+        return version
+    if not new_races:
+        print(f"{current} is up to date.")
+        return current
+
+    X, y = df[FEATURES], df['PositionDelta']
+    # The previous model has never seen the new races, so this is an honest out-of-sample check
+    mae_before = mean_absolute_error(y[is_new], base.model.predict(X[is_new]))
+
+    # Extra rounds fit the residuals of the existing trees over the whole cached dataset
+    model = xgb.XGBRegressor(**{**base.model.get_params(), 'n_estimators': extra_trees})
+    model.fit(X, y, xgb_model=base.model.get_booster())
+    mae_after = mean_absolute_error(y[is_new], model.predict(X[is_new]))
+    print(f"MAE on new races: {mae_before:.4f} before, {mae_after:.4f} after (in-sample)")
+
+    if not params:
+        params = {k: base.model.get_params()[k] for k in ('n_estimators', 'learning_rate', 'max_depth', 'objective')}
+    version = save_version(model, FEATURES, meta={
+        'seasons': sorted(df['Year'].unique().tolist()),
+        'races': len(set(race_keys)),
+        'samples': int(len(df)),
+        # Boosted on the new races, so not comparable with the held-out 'mae' of a full train
+        'mae_in_sample': float(mae_after),
+        'mae_new_races_before': float(mae_before),
+        'mode': 'continue',
+        'parent': base.version,
+        'new_races': [list(key) for key in new_races],
+        'trained_races': trained_races(df),
+        'trees': int(model.get_booster().num_boosted_rounds()),
+        'extra_trees': extra_trees,
+        # The parent's, so a later --refit trains like it did (not with n_estimators=extra_trees)
+        'params': params
+    }, activate=activate)
+    print(f"Model saved as {version}" + (" (now CURRENT)" if activate else "")
+          + f", updated in {time.perf_counter() - start:.1f}s")
+    return version
 
 if __name__ == "__main__":
-    train_model()
+    parser = argparse.ArgumentParser(description="Build the training set from FastF1 and train the model")
+    parser.add_argument('--seasons', type=int, nargs='+', default=[2023])
+    parser.add_argument('--rounds', default=None, help="e.g. '1-5,8' (default: every completed round)")
+    parser.add_argument('--workers', type=int, default=None, help="Ingestion processes (default: CPU count)")
+    parser.add_argument('--no-activate', action='store_true', help="Register the model without making it CURRENT")
+    parser.add_argument('--update', action='store_true',
+                        help="Incremental: ingest only new races and continue boosting the CURRENT model")
+    parser.add_argument('--refit', action='store_true', help="With --update: retrain from the cached dataset instead")
+    parser.add_argument('--extra-trees', type=int, default=25, help="Boosting rounds added by --update")
+    args = parser.parse_args()
+    if args.update:
+        update_model(args.seasons, parse_rounds(args.rounds), args.workers, refit=args.refit,
+                     extra_trees=args.extra_trees, activate=not args.no_activate)
+    else:
+        train_model(args.seasons, parse_rounds(args.rounds), args.workers, activate=not args.no_activate)
@@ -0,0 +1,227 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from joblib import Memory, Parallel, delayed, effective_n_jobs
+from scipy.stats import spearmanr
+from sklearn.metrics import mean_absolute_error
+from sklearn.model_selection import GroupKFold
+
+# Hyperparameter search for the finishing-position model.
+#   python tuning.py --seasons 2022 2023 --trials 40 --jobs -1 --budget-cpu 900 --train
+# Folds are grouped by race (Year, Round): a race's drivers are never split between train and
+# test. Each fit early-stops on a held-out set of the training races. Trials x folds run in
+# parallel worker processes, and fold fits are cached on disk (joblib.Memory), so a rerun
+# with more trials only pays for the new ones.
+
+TUNING_CACHE_DIR = os.environ.get('F1_TUNING_CACHE', 'tuning_cache')
+
+SEARCH_SPACE = {
+    'max_depth': [3, 4, 5, 6, 8],
+    'learning_rate': [0.02, 0.05, 0.1, 0.2],
+    'min_child_weight': [1, 3, 5, 10],
+    'subsample': [0.6, 0.8, 1.0],
+    'colsample_bytree': [0.6, 0.8, 1.0],
+    'reg_lambda': [0.1, 1.0, 10.0],
+}
+
+# What train.py fits without tuning; always trial 0 so there is a baseline to beat
+BASELINE_PARAMS = {
+    'max_depth': 5, 'learning_rate': 0.1, 'min_child_weight': 1,
+    'subsample': 1.0, 'colsample_bytree': 1.0, 'reg_lambda': 1.0,
+}
+
+MAX_ROUNDS = 1000
+EARLY_STOPPING_ROUNDS = 30
+EARLY_STOPPING_FRACTION = 0.2  # Share of a fold's training races used to pick the stopping round
+
+
+def sample_trials(n_trials, seed=0):
+    rng = np.random.default_rng(seed)
+    trials, seen = [dict(BASELINE_PARAMS)], {tuple(BASELINE_PARAMS.values())}
+    attempts = 0
+    while len(trials) < n_trials and attempts < n_trials * 50:
+        attempts += 1
+        params = {name: values[rng.integers(len(values))] for name, values in SEARCH_SPACE.items()}
+        params = {k: (float(v) if isinstance(v, float) else int(v)) for k, v in params.items()}
+        key = tuple(params[k] for k in BASELINE_PARAMS)
+        if key not in seen:
+            seen.add(key)
+            trials.append(params)
+    return trials
+
+
+def race_groups(df):
+    # One integer id per (Year, Round), plus 'YYYY-RR' names by id
+    codes, races = pd.factorize(pd.MultiIndex.from_frame(df[['Year', 'Round']]))
+    return codes, [f"{int(year)}-{int(round_num):02d}" for year, round_num in races]
+
+
+def per_race_spearman(groups, grid, pred_delta, finish):
+    # Spearman between predicted (grid + delta) and actual finishing order, one value per race
+    out = {}
+    for g in np.unique(groups):
+        rows = groups == g
+        if rows.sum() < 3:
+            continue
+        rho = spearmanr(grid[rows] + pred_delta[rows], finish[rows]).correlation
+        if np.isfinite(rho):
+            out[int(g)] = float(rho)
+    return out
+
+
+def _fit_fold(params, X, y, groups, train_idx, test_idx, seed):
+    # Early stopping on whole races held out of the training part, never on the test fold
+    start, cpu_start = time.perf_counter(), time.process_time()
+    train_races = np.unique(groups[train_idx])
+    rng = np.random.default_rng(seed)
+    n_stop = max(1, int(len(train_races) * EARLY_STOPPING_FRACTION))
+    stop_races = rng.choice(train_races, n_stop, replace=False) if len(train_races) > 1 else train_races[:0]
+    is_stop = np.isin(groups[train_idx], stop_races)
+    fit_idx, stop_idx = train_idx[~is_stop], train_idx[is_stop]
+
+    model = xgb.XGBRegressor(
+        n_estimators=MAX_ROUNDS, objective='reg:squarederror', n_jobs=1, random_state=seed,
+        early_stopping_rounds=EARLY_STOPPING_ROUNDS if len(stop_idx) else None, **params
+    )
+    eval_set = [(X[stop_idx], y[stop_idx])] if len(stop_idx) else None
+    model.fit(X[fit_idx], y[fit_idx], eval_set=eval_set, verbose=False)
+    best = getattr(model, 'best_iteration', None)
+    return {
+        'pred': model.predict(X[test_idx]),
+        'best_iteration': int(best) if best is not None else MAX_ROUNDS - 1,
+        'fit_s': time.perf_counter() - start,
+        'cpu_s': time.process_time() - cpu_start,
+    }
+
+
+def _run_fold(cache_dir, trial, fold, params, X, y, groups, train_idx, test_idx, seed):
+    args = (params, X, y, groups, train_idx, test_idx, seed)
+    if not cache_dir:
+        return trial, fold, {**_fit_fold(*args), 'cached': False}
+    fit = Memory(cache_dir, verbose=0).cache(_fit_fold)
+    # Asked before the call: a cached result carries the fit and CPU time of the run that made it
+    cached = fit.check_call_in_cache(*args)
+    return trial, fold, {**fit(*args), 'cached': cached}
+
+
+def tune(df, features, target='PositionDelta', n_trials=20, n_folds=5, n_jobs=-1,
+         budget_cpu=None, metric='spearman', seed=0, cache_dir=TUNING_CACHE_DIR):
+    X = df[features].to_numpy(dtype=np.float32)
+    y = df[target].to_numpy(dtype=np.float64)
+    groups, race_names = race_groups(df)
+    n_folds = min(n_folds, len(np.unique(groups)))
+    if n_folds < 2:
+        raise ValueError("Need at least 2 races to cross-validate")
+    folds = list(GroupKFold(n_splits=n_folds).split(X, y, groups))
+
+    trials = sample_trials(n_trials, seed)
+    n_workers = effective_n_jobs(n_jobs)  # joblib's reading: -1 all CPUs, -2 all but one, ...
+    results, cpu_spent, start = [], 0.0, time.perf_counter()
+
+    with Parallel(n_jobs=n_jobs) as parallel:
+        # A batch of trials per round of workers, so the CPU budget is checked as results come in
+        batch_size = max(1, -(-n_workers // n_folds))
+        for lo in range(0, len(trials), batch_size):
+            if budget_cpu is not None and cpu_spent >= budget_cpu:
+                print(f"CPU budget of {budget_cpu:g}s spent; {len(trials) - lo} trials not run.")
+                break
+            batch = range(lo, min(lo + batch_size, len(trials)))
+            done = parallel(
+                delayed(_run_fold)(cache_dir, t, k, trials[t], X, y, groups, tr, te, seed + k)
+                for t in batch for k, (tr, te) in enumerate(folds)
+            )
+            for t in batch:
+                fold_results = sorted((k, r) for tt, k, r in done if tt == t)
+                oof = np.empty(len(y))
+                for k, r in fold_results:
+                    oof[folds[k][1]] = r['pred']
+                rhos = per_race_spearman(groups, df['GridPosition'].to_numpy(float), oof,
+                                         df['FinishPosition'].to_numpy(float))
+                fits = [r for _, r in fold_results]
+                cpu_spent += sum(r['cpu_s'] for r in fits if not r['cached'])
+                results.append({
+                    'trial': t,
+                    'params': trials[t],
+                    'mae': float(mean_absolute_error(y, oof)),
+                    'spearman': float(np.mean(list(rhos.values()))) if rhos else float('nan'),
+                    'per_race_spearman': {race_names[g]: rho for g, rho in rhos.items()},
+                    'best_iterations': [r['best_iteration'] for r in fits],
+                    'n_estimators': int(np.median([r['best_iteration'] for r in fits])) + 1,
+                    'fit_s': float(sum(r['fit_s'] for r in fits)),
+                    'cpu_s': float(sum(r['cpu_s'] for r in fits)),
+                    'cached': all(r['cached'] for r in fits),
+                })
+                print_trial(results[-1])
+
+    better = (lambda r: -r['spearman']) if metric == 'spearman' else (lambda r: r['mae'])
+    results.sort(key=lambda r: (np.nan_to_num(better(r), nan=np.inf), r['trial']))
+    return {
+        'metric': metric,
+        'folds': n_folds,
+        'races': int(len(np.unique(groups))),
+        'samples': int(len(y)),
+        'trials_run': len(results),
+        'wall_s': time.perf_counter() - start,
+        'cpu_s': cpu_spent,
+        'best': results[0] if results else None,
+        'trials': results,
+    }
+
+
+def print_trial(r):
+    params = ' '.join(f"{k}={v}" for k, v in r['params'].items())
+    print(f"  trial {r['trial']:3d}  MAE {r['mae']:.3f}  spearman {r['spearman']:+.3f}  "
+          f"trees {r['n_estimators']:4d}  fit {r['fit_s']:6.2f}s{' (cached)' if r['cached'] else ''}  {params}")
+
+
+def print_summary(summary, per_race=False):
+    print(f"\n{summary['trials_run']} trials x {summary['folds']} race-grouped folds over "
+          f"{summary['races']} races ({summary['samples']} samples) in {summary['wall_s']:.1f}s wall, "
+          f"{summary['cpu_s']:.1f}s CPU")
+    print(f"Ranked by {summary['metric']}:")
+    for r in summary['trials'][:10]:
+        print_trial(r)
+    best = summary['best']
+    if per_race and best:
+        print(f"\nPer-race Spearman, trial {best['trial']}:")
+        for race, rho in sorted(best['per_race_spearman'].items()):
+            print(f"  {race}  {rho:+.3f}")
+
+
+if __name__ == '__main__':
+    from ingest import parse_rounds
+    from train import FEATURES, build_dataset, train_model
+
+    parser = argparse.ArgumentParser(description="Race-grouped cross-validated hyperparameter search")
+    parser.add_argument('--seasons', type=int, nargs='+', default=[2023])
+    parser.add_argument('--rounds', default=None, help="e.g. '1-5,8' (default: every completed round)")
+    parser.add_argument('--workers', type=int, default=None, help="Ingestion processes for missing races")
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--jobs', type=int, default=-1, help="Parallel fits (default: all cores)")
+    parser.add_argument('--budget-cpu', type=float, default=None, help="Stop starting trials after this many CPU seconds")
+    parser.add_argument('--metric', choices=['spearman', 'mae'], default='spearman')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-cache', action='store_true', help="Do not reuse cached fold fits")
+    parser.add_argument('--per-race', action='store_true', help="Print per-race Spearman for the best trial")
+    parser.add_argument('--train', action='store_true', help="Train and register a model with the best parameters")
+    parser.add_argument('--no-activate', action='store_true')
+    args = parser.parse_args()
+
+    df = build_dataset(args.seasons, parse_rounds(args.rounds), args.workers)
+    df['PositionDelta'] = df['FinishPosition'] - df['GridPosition']
+    summary = tune(df, FEATURES, n_trials=args.trials, n_folds=args.folds, n_jobs=args.jobs,
+                   budget_cpu=args.budget_cpu, metric=args.metric, seed=args.seed,
+                   cache_dir=None if args.no_cache else TUNING_CACHE_DIR)
+    print_summary(summary, per_race=args.per_race)
+
+    if args.train and summary['best']:
+        best = summary['best']
+        cv = {k: summary[k] for k in ('metric', 'folds', 'trials_run', 'cpu_s')}
+        cv.update({k: best[k] for k in ('trial', 'mae', 'spearman')})
+        train_model(df=df.drop(columns=['PositionDelta']), activate=not args.no_activate,
+                    params={**best['params'], 'n_estimators': best['n_estimators']}, cv=cv)
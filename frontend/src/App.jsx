@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useRef, useState } from 'react';
 import axios from 'axios';
 import { RaceSelector } from './components/RaceSelector';
 import { DriverControl } from './components/DriverControl';
@@ -14,6 +14,8 @@ function App() {
   const [strategyData, setStrategyData] = useState([]);
   const [prediction, setPrediction] = useState(null); // Changed to object {classification, story, radio}
   const [loading, setLoading] = useState(false);
+  const [engine, setEngine] = useState('laps'); // 'laps' = lap-by-lap race engine, 'ml' = XGBoost /predict
+  const streamRef = useRef(null); // AbortController of the running simulation, if any
 
   const handleRaceSelect = async (year, round) => {
     setLoading(true);
@@ -45,7 +47,49 @@ function App() {
     setRaceData(prev => ({ ...prev, is_wet: !prev.is_wet }));
   };
 
+  // Lap-by-lap race as NDJSON events: story, radio and live standings arrive while it runs,
+  // the full result replaces them at the flag. Aborting the fetch cancels the race server-side.
+  const streamRace = async (payload, signal) => {
+    const res = await fetch('http://localhost:5000/simulate/race/stream?format=ndjson', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(payload),
+      signal
+    });
+    if (!res.ok) throw new Error(`HTTP ${res.status}`);
+
+    setPrediction({ classification: [], story: [], radio: [] });
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split('\n');
+      buffer = lines.pop();
+      for (const line of lines) {
+        if (!line) continue;
+        const { event, data } = JSON.parse(line);
+        if (event === 'lap' && data.events.length) {
+          setPrediction(prev => ({ ...prev, story: [...prev.story, ...data.events] }));
+        } else if (event === 'radio') {
+          setPrediction(prev => ({ ...prev, radio: [...prev.radio, data] }));
+        } else if (event === 'standings') {
+          setPrediction(prev => ({ ...prev, classification: data.standings }));
+        } else if (event === 'result') {
+          setPrediction(data);
+        } else if (event === 'error') {
+          throw new Error(data.error);
+        }
+      }
+    }
+  };
+
   const runSimulation = async () => {
+    if (streamRef.current) streamRef.current.abort();
+    const controller = new AbortController();
+    streamRef.current = controller;
     setLoading(true);
     try {
       const payload = {
@@ -53,12 +97,21 @@ function App() {
         weather: { is_wet: raceData.is_wet }
       };
 
-      const res = await axios.post('http://localhost:5000/predict', payload);
-      setPrediction(res.data); // Expecting { classification: [], story: [], radio: [] }
+      if (engine === 'laps') {
+        await streamRace({ ...payload, year: raceData.year, round: raceData.round }, controller.signal);
+      } else {
+        const res = await axios.post('http://localhost:5000/predict', payload, { signal: controller.signal });
+        setPrediction(res.data); // Expecting { classification: [], story: [], radio: [] }
+      }
     } catch (e) {
+      if (e.name === 'AbortError' || axios.isCancel(e)) return;
       alert("Error running simulation. Ensure backend is running and model is trained.");
     } finally {
-      setLoading(false);
+      // A newer run aborted this one and owns the spinner now
+      if (streamRef.current === controller) {
+        streamRef.current = null;
+        setLoading(false);
+      }
     }
   };
 
@@ -109,6 +162,15 @@ function App() {
                   Change
                 </button>
               </div>
+              <div className="flex items-center justify-between">
+                <div>
+                  <h3 className="font-bold text-sm uppercase">Engine</h3>
+                  <p className="text-xs text-white/50">{engine === 'laps' ? 'Lap-by-lap race' : 'ML finishing order'}</p>
+                </div>
+                <button onClick={() => setEngine(engine === 'laps' ? 'ml' : 'laps')} className="text-[10px] font-bold uppercase tracking-wider border border-white/20 hover:bg-white/10 px-3 py-1 rounded transition-all">
+                  Switch
+                </button>
+              </div>
             </div>
           )}
 
@@ -1,17 +1,26 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Mic, X } from 'lucide-react';
 import { motion, AnimatePresence } from 'framer-motion';
 
 export function TeamRadio({ messages }) {
     const [queue, setQueue] = useState([]);
     const [currentMsg, setCurrentMsg] = useState(null);
+    const seen = useRef([]);
 
     useEffect(() => {
         if (messages && messages.length > 0) {
-            // Add new messages to queue if not already seen
-            // Simple implementation: Just reset queue on new messages batch
-            setQueue(messages);
+            // A streamed race grows the same list: queue only what was appended since last time.
+            // Anything else (e.g. the final result replacing the live list) is a new batch.
+            const key = m => `${m.lap}|${m.driver}|${m.message}`;
+            const previous = seen.current;
+            const appended = messages.length >= previous.length && previous.every((m, i) => key(messages[i]) === key(m));
+            if (!appended) {
+                setQueue(messages);
+            } else if (messages.length > previous.length) {
+                setQueue(prev => [...prev, ...messages.slice(previous.length)]);
+            }
         }
+        seen.current = messages || [];
     }, [messages]);
 
     useEffect(() => {